@@ -0,0 +1,152 @@
+"""A user's posts and comments as one timeline, newest first.
+
+Posts and comments live in different tables, so the timeline is a UNION ALL
+of the two, each side walking its (author_id, time, id) index and stopping
+after a page's worth. Postgres merges the two short lists; nothing scales
+with how much the user has ever written. Rows come out as (kind, id, time)
+and get turned into the usual post and comment dicts a page at a time.
+
+Ties on time go posts first, then by id, so the keyset is (time, kind, id)
+and cursors carry all three.
+
+The counts shown with it are users.num_posts and users.num_comments,
+maintained as things get written (see models.py) rather than counted here.
+Those include private posts and comments, though, so anonymous viewers get
+`public_counts` instead, which does count, over the same author indexes.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from peewee import *
+from .models import *
+from . import serialize, stream
+
+KINDS = {"post": Post, "comment": Comment}
+
+def encode_cursor(row):
+    kind, id, time = row
+    return f"{time.isoformat()}_{kind}_{id}"
+
+def decode_cursor(cursor):
+    try:
+        time, kind, id = cursor.rsplit("_", 2)
+        if kind not in KINDS:
+            return None
+        return datetime.fromisoformat(time), kind, int(id)
+    except ValueError:
+        return None
+
+def side(kind, user_id, private, after, limit):
+    """One table's half of the timeline."""
+    model = KINDS[kind]
+    q = (model
+         .select(Value(kind).alias("kind"), model.id, model.time)
+         .where(model.author_id == user_id)
+         .order_by(model.time.desc(), model.id.desc()))
+    if not private:
+        q = q.where(model.public())
+        if model is Comment:
+            # A public comment on a private post is still private.
+            q = q.join(Post, on=(Comment.post_id == Post.id)).where(Post.public())
+    if after is not None:
+        # Everything here has the same kind, so where it stands against the
+        # cursor comes down to time (and id, if the cursor's kind is ours).
+        time, after_kind, id = after
+        if kind == after_kind:
+            q = q.where(Tuple(model.time, model.id) < Tuple(time, id))
+        elif kind < after_kind:
+            q = q.where(model.time <= time)
+        else:
+            q = q.where(model.time < time)
+    if limit is not None:
+        q = q.limit(limit)
+    return q
+
+def query(user_id, private=False, after=None, limit=None):
+    """(kind, id, time) for the user's timeline past `after`."""
+    both = side("post", user_id, private, after, limit) + side("comment", user_id, private, after, limit)
+    q = (both
+         .order_by(SQL("time DESC"), SQL("kind DESC"), SQL("id DESC"))
+         .tuples())
+    if limit is not None:
+        q = q.limit(limit)
+    return q
+
+def public_counts(user_id):
+    """(posts, comments) as anonymous users see them: what the public
+    timeline shows, minus deleted comments like num_comments."""
+    posts = (Post
+             .select(fn.COUNT(Post.id))
+             .where((Post.author_id == user_id) & Post.public()))
+    comments = (Comment
+                .select(fn.COUNT(Comment.id))
+                .join(Post, on=(Comment.post_id == Post.id))
+                .where(
+                    (Comment.author_id == user_id) &
+                    Comment.public() &
+                    Post.public() &
+                    (Comment.content != DELETED)))
+    return posts.scalar(), comments.scalar()
+
+def items(rows):
+    """Post and comment dicts for (kind, id, time) rows, each with its "type".
+
+    At most three queries: posts, tags and comments.
+    """
+    ids = defaultdict(list)
+    for kind, id, _ in rows:
+        ids[kind].append(id)
+    found = {
+        "post": {p["id"]: p for p in serialize.posts(ids["post"])},
+        "comment": {c["id"]: c for c in serialize.comments(ids["comment"])},
+    }
+    return [{"type": kind, **found[kind][id]} for kind, id, _ in rows if id in found[kind]]
+
+def page(user_id, private=False, after=None, limit=None):
+    """One page of the timeline, and the cursor for the next one (or None)."""
+    rows = list(query(user_id, private, after, limit + 1))
+    cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return items(rows[:limit]), cursor
+
+def everything(user_id, private=False, after=None):
+    """All of the timeline past `after`, as a stream of lists of dicts."""
+    for rows in stream.batches(query(user_id, private, after)):
+        yield items(rows)
+
+def recount():
+    """(Re)build users.num_posts and users.num_comments. Returns how many moved."""
+    cur = db.execute_sql("""
+        UPDATE users SET
+          num_posts = coalesce(p.n, 0),
+          num_comments = coalesce(c.n, 0)
+        FROM users u
+        LEFT JOIN (SELECT author_id, count(*) AS n FROM posts GROUP BY author_id) p ON p.author_id = u.id
+        LEFT JOIN (
+          SELECT author_id, count(*) AS n
+          FROM comments
+          WHERE content <> %s
+          GROUP BY author_id
+        ) c ON c.author_id = u.id
+        WHERE users.id = u.id AND (
+          users.num_posts IS DISTINCT FROM coalesce(p.n, 0) OR
+          users.num_comments IS DISTINCT FROM coalesce(c.n, 0)
+        )
+    """, (DELETED,))
+    return cur.rowcount
+
+def add(posts={}, comments={}):
+    """Bump users' counters by the amounts in `posts` and `comments` (user id: n).
+
+    One statement however many users there are.
+    """
+    ids = sorted(posts.keys() | comments.keys())
+    if len(ids) == 0:
+        return
+    deltas = ValuesList([(id, posts.get(id, 0), comments.get(id, 0)) for id in ids],
+                        columns=("id", "posts", "comments"), alias="d")
+    (User
+     .update(num_posts=User.num_posts + deltas.c.posts,
+             num_comments=User.num_comments + deltas.c.comments)
+     .from_(deltas)
+     .where(User.id == deltas.c.id)
+     .execute())
@@ -0,0 +1,138 @@
+"""Postgres from asyncio: a connection pool on psycopg2's async mode.
+
+Queries are still built with peewee, and come back as the same model
+instances, tuples or dicts they would from the blocking pool. Only the
+round trip to the server is different: instead of a worker thread sitting
+in a socket read, the event loop gets on with something else until the
+connection's socket is ready.
+
+    ps = await adb.run(Post.select().where(Post.id << ids))
+
+Async connections are always in autocommit mode, so this is for reads.
+Anything that needs a transaction should go through the usual `db`.
+"""
+import asyncio
+import contextlib
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+from .models import *
+from . import config, models, serialize
+
+SIZE = config.get("ASYNC_DB_CONNECTIONS", 10, int)
+
+async def wait(conn):
+    """Poll an async connection until whatever it's doing is done."""
+    loop = asyncio.get_running_loop()
+    fd = conn.fileno()
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        ready = loop.create_future()
+        wake = lambda: ready.done() or ready.set_result(None)
+        if state == extensions.POLL_READ:
+            loop.add_reader(fd, wake)
+            try:
+                await ready
+            finally:
+                loop.remove_reader(fd)
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fd, wake)
+            try:
+                await ready
+            finally:
+                loop.remove_writer(fd)
+        else:
+            raise psycopg2.OperationalError(f"Bad poll state: {state}")
+
+class AsyncPool:
+    """Up to `size` connections, opened as they're needed and then kept."""
+
+    def __init__(self, size=SIZE):
+        self.size = size
+        self.idle = []
+        self.slots = None
+        self.in_use = 0
+
+    async def acquire(self):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size)
+        await self.slots.acquire()
+        self.in_use += 1
+        while len(self.idle) != 0:
+            conn = self.idle.pop()
+            if not conn.closed:
+                return conn
+        try:
+            conn = psycopg2.connect(dbname=db.web.database, async_=True, **db.web.connect_params)
+            await wait(conn)
+            return conn
+        except BaseException:
+            self.release(None)
+            raise
+
+    def release(self, conn, broken=False):
+        self.in_use -= 1
+        if conn is not None:
+            if broken or conn.closed:
+                conn.close()
+            else:
+                self.idle.append(conn)
+        self.slots.release()
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        conn = await self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            # Cancelled or failed partway through a query, so there's no
+            # telling what state it's in. Don't hand it to anyone else.
+            self.release(conn, broken=True)
+            raise
+        self.release(conn)
+
+    async def execute(self, sql, params=None):
+        """Run a query. Returns the cursor, with all of the rows already in it."""
+        async with self.connection() as conn:
+            start = time.perf_counter()
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            await wait(conn)
+            took = time.perf_counter() - start
+        # Same hooks as the blocking pool's, see metrics.py.
+        for f in models.Pool.observers:
+            f(sql, took)
+        return cursor
+
+    def close(self):
+        for conn in self.idle:
+            conn.close()
+        self.idle = []
+
+    def stats(self):
+        return {"in_use": self.in_use, "idle": len(self.idle), "max": self.size}
+
+pool = AsyncPool()
+
+async def run(query):
+    """A peewee select, run without blocking. Returns a list of its rows."""
+    sql, params = query.sql()
+    cursor = await pool.execute(sql, params)
+    # The same wrapper query.execute() would put around a blocking cursor, so
+    # joins, .tuples() and .dicts() all come out the way they usually do.
+    return list(query._get_cursor_wrapper(cursor))
+
+async def scalar(query):
+    rows = await run(query.tuples())
+    return rows[0][0] if len(rows) != 0 else None
+
+async def posts(ps):
+    """serialize.posts, for rows from serialize.post_query()."""
+    if len(ps) == 0:
+        return []
+    tags = serialize.group_tags(await run(serialize.tag_query([p.id for p in ps])))
+    return [serialize.post_dict(p, p.author_id.nick, tags[p.id]) for p in ps]
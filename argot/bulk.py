@@ -0,0 +1,262 @@
+"""Writing posts in bulk, and the transactional single-post paths.
+
+`create_post` and `delete_post` do everything for one post (tagmaps,
+comments, the announcement) in one transaction. `tag_posts` tags any
+number of posts with any number of tags in one statement.
+
+`import_posts` ingests NDJSON, one post per line:
+
+    {"title": "...", "link": "https://...", "content": "...",
+     "private": false, "time": "2024-01-31T12:00:00", "author": "nick",
+     "tags": ["rust", "async"],
+     "comments": [{"author": "nick", "content": "...", "replies": [...]}]}
+
+Only `link` is required. Missing tags get created. `author` defaults to
+whoever is importing and comment authors default to the post's; through
+the HTTP endpoint everything is by whoever is importing, full stop.
+
+Lines are grouped into batches of IMPORT_BATCH posts. Each batch is a single transaction of a
+handful of insert_many statements. A bad line is skipped and reported; a
+batch that fails in the database is rolled back and reported as a whole.
+Imports don't announce anything, so a backlog doesn't flood Discord.
+
+Times with a UTC offset ("...Z", "...+02:00") are converted to local time,
+which is what everything else in the database is in; times without one are
+taken to be local already.
+"""
+import json
+from collections import Counter
+from datetime import datetime
+
+from marshmallow import EXCLUDE, Schema, ValidationError, fields
+
+from .models import *
+from . import activity, config, events, inbox, ranking
+
+BATCH = config.get("IMPORT_BATCH", 1000, int)
+
+def missing_tags(tag_ids):
+    """Which of these tag ids don't exist, in one query."""
+    tag_ids = set(tag_ids)
+    if len(tag_ids) == 0:
+        return set()
+    return tag_ids - {t for (t,) in Tag.select(Tag.id).where(Tag.id << list(tag_ids)).tuples()}
+
+def missing_posts(post_ids):
+    post_ids = set(post_ids)
+    if len(post_ids) == 0:
+        return set()
+    return post_ids - {p for (p,) in Post.select(Post.id).where(Post.id << list(post_ids)).tuples()}
+
+def create_post(link, title, author, content=None, private=False, tags=(), announce_in=0):
+    """New post with its tags, announced after `announce_in` seconds."""
+    with db.atomic():
+        p = Post.new(link, title, author, content=content, private=private)
+        tag_posts([p.id], tags)
+        events.publish("post", p.id, delay=announce_in)
+    return p
+
+def delete_post(post):
+    """Delete a post along with its comments and tagmaps.
+
+    Returns the nicks of everyone whose comments went with it.
+    """
+    with db.atomic():
+        commenters = list(User
+                          .select(User.id, User.nick, fn.COUNT(Comment.id).filter(Comment.content != DELETED))
+                          .join(Comment, on=(Comment.author_id == User.id))
+                          .where(Comment.post_id == post.id)
+                          .group_by(User.id)
+                          .tuples())
+        TagMap.delete().where(TagMap.post_id == post.id).execute()
+        inbox.drop_post(post.id)
+        # One statement, so replies pointing at each other don't get in the way.
+        Comment.delete().where(Comment.post_id == post.id).execute()
+        post.delete_instance()
+        activity.add({post.author_id_id: -1}, {id: -n for id, _, n in commenters})
+    return {nick for _, nick, _ in commenters}
+
+def tag_posts(post_ids, tag_ids):
+    """Tag every post with every tag, skipping pairs that are already there."""
+    rows = [{"post_id": p, "tag_id": t} for p in post_ids for t in tag_ids]
+    if len(rows) == 0:
+        return 0
+    return (TagMap
+            .insert_many(rows)
+            .on_conflict(conflict_target=[TagMap.post_id, TagMap.tag_id], action="IGNORE")
+            .as_rowcount()
+            .execute())
+
+class LocalDateTime(fields.DateTime):
+    """Times with an offset become naive local time, like the rest of the database."""
+    def _deserialize(self, value, attr, data, **kwargs):
+        time = super()._deserialize(value, attr, data, **kwargs)
+        if time.tzinfo is not None:
+            time = time.astimezone().replace(tzinfo=None)
+        return time
+
+class CommentSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    author = fields.Str()
+    content = fields.Str(required=True)
+    time = LocalDateTime()
+    private = fields.Bool()
+    replies = fields.List(fields.Nested(lambda: CommentSchema()))
+
+class ImportSchema(Schema):
+    class Meta:
+        unknown = EXCLUDE
+
+    title = fields.Str(allow_none=True)
+    link = fields.Str(required=True)
+    content = fields.Str(allow_none=True)
+    private = fields.Bool()
+    time = LocalDateTime()
+    author = fields.Str()
+    tags = fields.List(fields.Str(validate=str.isalnum))
+    comments = fields.List(fields.Nested(CommentSchema))
+
+class Importer:
+    def __init__(self, author, batch=None, trusted=True):
+        self.author = author
+        self.batch = batch or BATCH
+        # Untrusted imports can't pick authors.
+        self.trusted = trusted
+        self.posts = 0
+        self.comments = 0
+        self.tagmaps = 0
+        self.errors = []
+        self.authors = set()
+        # Schemas are slow to set up, so reuse the one.
+        self.schema = ImportSchema()
+
+    def report(self):
+        return {
+            "posts": self.posts,
+            "comments": self.comments,
+            "tagmaps": self.tagmaps,
+            "errors": self.errors,
+        }
+
+    def run(self, lines):
+        pending = []
+        for n, line in enumerate(lines, 1):
+            if isinstance(line, bytes):
+                line = line.decode()
+            if line.strip() == "":
+                continue
+            try:
+                record = self.schema.load(json.loads(line))
+            except ValueError as e:
+                self.errors.append({"line": n, "error": str(e)})
+                continue
+            except ValidationError as e:
+                self.errors.append({"line": n, "error": e.messages})
+                continue
+            pending.append((n, record))
+            if len(pending) == self.batch:
+                self.flush(pending)
+                pending = []
+        if len(pending) != 0:
+            self.flush(pending)
+        return self.report()
+
+    def flush(self, pending):
+        try:
+            with db.atomic():
+                counts = self.write(pending)
+        except Exception as e:
+            # Whatever it was, it's this batch's problem, not the next one's.
+            lines = [n for n, _ in pending]
+            self.errors.append({"line": lines[0], "to_line": lines[-1], "error": str(e)})
+            return
+        self.posts += counts[0]
+        self.comments += counts[1]
+        self.tagmaps += counts[2]
+
+    def nick(self, item, default):
+        return item.get("author", default) if self.trusted else self.author
+
+    def write(self, pending):
+        now = datetime.now()
+        records = [r for _, r in pending]
+
+        # Authors, for posts and comments, in one query.
+        nicks = {self.nick(r, self.author) for r in records}
+        for r in records:
+            nicks.update(self.nick(c, self.nick(r, self.author)) for c in walk(r.get("comments", [])))
+        users = dict(User.select(User.nick, User.id).where(User.nick << list(nicks)).tuples())
+        unknown = nicks - users.keys()
+        if len(unknown) != 0:
+            raise ValueError(f"No such user(s): {', '.join(sorted(unknown))}")
+        self.authors.update(nicks)
+
+        # Tags, creating whatever's missing.
+        names = {t for r in records for t in r.get("tags", [])}
+        if len(names) != 0:
+            (Tag
+             .insert_many([{"name": t} for t in names])
+             .on_conflict(conflict_target=[Tag.name], action="IGNORE")
+             .execute())
+        tags = dict(Tag.select(Tag.name, Tag.id).where(Tag.name << list(names)).tuples()) if names else {}
+
+        rows = []
+        for r in records:
+            time = r.get("time", now)
+            comments = list(walk(r.get("comments", [])))
+            rows.append({
+                "title": r.get("title") or r["link"],
+                "link": r["link"],
+                "author_id": users[self.nick(r, self.author)],
+                "time": time,
+                "content": r.get("content"),
+                "private": r.get("private", False),
+                "num_comments": len(comments),
+                "last_activity": max([time] + [c.get("time", now) for c in comments]),
+                "hot": ranking.score(len(comments), time),
+            })
+        post_ids = [id for (id,) in Post.insert_many(rows).returning(Post.id).tuples().execute()]
+
+        tagmaps = [
+            {"post_id": p, "tag_id": tags[t]}
+            for p, r in zip(post_ids, records) for t in set(r.get("tags", []))
+        ]
+        if len(tagmaps) != 0:
+            TagMap.insert_many(tagmaps).execute()
+
+        # Comments go in a level at a time, so replies know their parent's id.
+        level = [
+            (p, None, c, self.nick(r, self.author))
+            for p, r in zip(post_ids, records) for c in r.get("comments", [])
+        ]
+        comments = 0
+        commented = Counter()
+        while len(level) != 0:
+            crows = [{
+                "post_id": p,
+                "parent_id": parent,
+                "author_id": users[self.nick(c, default)],
+                "content": c["content"],
+                "time": c.get("time", now),
+                "private": c.get("private", False),
+            } for p, parent, c, default in level]
+            ids = [id for (id,) in Comment.insert_many(crows).returning(Comment.id).tuples().execute()]
+            comments += len(ids)
+            commented.update(row["author_id"] for row in crows)
+            level = [
+                (p, id, reply, default)
+                for id, (p, _, c, default) in zip(ids, level) for reply in c.get("replies", [])
+            ]
+        activity.add(Counter(row["author_id"] for row in rows), commented)
+        return len(post_ids), comments, len(tagmaps)
+
+def walk(comments):
+    for c in comments:
+        yield c
+        yield from walk(c.get("replies", []))
+
+def import_posts(lines, author, batch=None, trusted=True):
+    """Import NDJSON posts. Returns counts and a list of per-line errors."""
+    return Importer(author, batch, trusted).run(lines)
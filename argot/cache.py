@@ -0,0 +1,199 @@
+"""Read-through cache for whole GET responses.
+
+A cached route names the things its response depends on ("posts",
+"post:12", "user:alice", ...) and each of those has a generation counter.
+The cache key is the route, its arguments, the content type and compression
+the client asked for, whether the caller is logged in (they see private
+posts, so they get their own copy), and the current generations of
+everything it depends on. Entries are stored already encoded and
+compressed. Writes call `bump` after they commit, which moves the counters
+on; the old entries can't be reached anymore and just age out of the LRU.
+
+Every 200 from a cached route gets an ETag, and a request whose
+If-None-Match already has it gets an empty 304. That part works with the
+cache off too; only the storing needs a backend.
+
+RESPONSE_CACHE picks the backend: "off" (the default), a redis:// URL to
+share one between processes (needs the redis package), or "memory", an LRU
+of RESPONSE_CACHE_SIZE entries. The memory backend keeps its generations
+in the process too, so it only sees bumps made by that same process: use
+it only when a single process serves requests and nothing else writes,
+since other workers and the ranker (`manage ranker`) can't invalidate it.
+Entries also expire after RESPONSE_CACHE_TTL seconds, so anything that
+forgets to bump is only stale for so long.
+"""
+import base64
+import functools
+import hashlib
+import json
+import threading
+
+from flask import Response, make_response, request
+from flask_login import current_user
+
+from . import config, metrics, wire
+from .lru import Cache
+
+TTL = config.get("RESPONSE_CACHE_TTL", 300, int)
+# Response headers worth keeping along with the body.
+KEEP = {"Content-Type", "Content-Encoding", "X-Next-Cursor"}
+
+class Memory:
+    """Single process only: bumps from anywhere else never reach it."""
+    def __init__(self, size):
+        self.entries = Cache(size, TTL)
+        self.gens = {}
+        self.lock = threading.Lock()
+
+    def generations(self, names):
+        with self.lock:
+            return [self.gens.get(n, 0) for n in names]
+
+    def bump(self, names):
+        with self.lock:
+            for n in names:
+                self.gens[n] = self.gens.get(n, 0) + 1
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, entry):
+        self.entries.put(key, entry)
+
+class Redis:
+    PREFIX = "argot:"
+
+    def __init__(self, url):
+        import redis
+        self.redis = redis.Redis.from_url(url)
+
+    def generations(self, names):
+        if len(names) == 0:
+            return []
+        return [int(g or 0) for g in self.redis.mget([self.PREFIX + "gen:" + n for n in names])]
+
+    def bump(self, names):
+        pipe = self.redis.pipeline()
+        for n in names:
+            pipe.incr(self.PREFIX + "gen:" + n)
+        pipe.execute()
+
+    def get(self, key):
+        raw = self.redis.get(self.PREFIX + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return {**entry, "body": base64.b64decode(entry["body"])}
+
+    def put(self, key, entry):
+        # Bodies can be compressed or MessagePack, so not necessarily text.
+        entry = {**entry, "body": base64.b64encode(entry["body"]).decode()}
+        self.redis.set(self.PREFIX + key, json.dumps(entry), ex=TTL)
+
+def new_backend(kind):
+    if kind == "off":
+        return None
+    if kind.startswith("redis://") or kind.startswith("rediss://"):
+        return Redis(kind)
+    return Memory(config.get("RESPONSE_CACHE_SIZE", 1024, int))
+
+backend = new_backend(config.get("RESPONSE_CACHE", "off"))
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "not_modified": 0, "bumps": 0}
+
+    def add(self, what):
+        with self.lock:
+            self.counts[what] += 1
+
+    def __call__(self):
+        with self.lock:
+            return {**self.counts, "backend": type(backend).__name__.lower() if backend else "off"}
+
+stats = Stats()
+
+def bump(*names):
+    """Invalidate everything that depends on any of `names`. Call after commit."""
+    if backend is None:
+        return
+    stats.add("bumps")
+    try:
+        backend.bump(names)
+    except Exception as e:
+        metrics.log(event="cache_bump_failed", names=names, error=str(e))
+
+def etag(body):
+    return hashlib.blake2b(body, digest_size=12).hexdigest()
+
+def respond(entry):
+    if request.if_none_match.contains(entry["etag"]):
+        stats.add("not_modified")
+        return Response(status=304, headers={"ETag": f'"{entry["etag"]}"'})
+    return Response(entry["body"], status=200, headers={
+        **entry["headers"],
+        "ETag": f'"{entry["etag"]}"',
+        # Check back every time, it's cheap with the ETag.
+        "Cache-Control": "no-cache",
+        "Vary": "Cookie, Accept, Accept-Encoding",
+    })
+
+def render(view, kwargs):
+    """Run the view; a 200 comes back as a cache entry, anything else as is."""
+    resp = make_response(view(**kwargs))
+    if resp.status_code != 200 or resp.is_streamed:
+        return resp, None
+    # Compress once here rather than on every hit.
+    body = wire.compress_response(resp).get_data()
+    return resp, {
+        "body": body,
+        "etag": etag(body),
+        "headers": {k: v for k, v in resp.headers.items() if k in KEEP},
+    }
+
+def cached(depends):
+    """Cache a GET view's 200s. `depends(**view_args)` lists what it depends on.
+
+    With no backend nothing is stored, but 200s still get their ETag and
+    If-None-Match still gets a 304; the view just runs every time.
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            if backend is None:
+                resp, entry = render(view, kwargs)
+                return resp if entry is None else respond(entry)
+            names = depends(**kwargs)
+            try:
+                gens = backend.generations(names)
+                key = hashlib.sha1(json.dumps([
+                    request.endpoint,
+                    kwargs,
+                    sorted(request.args.items(multi=True)),
+                    request.accept_mimetypes.best,
+                    wire.negotiate(request.headers.get("Accept")),
+                    wire.encoding(request.headers.get("Accept-Encoding")),
+                    current_user.is_authenticated,
+                    dict(zip(names, gens)),
+                ], sort_keys=True).encode()).hexdigest()
+                entry = backend.get(key)
+            except Exception as e:
+                metrics.log(event="cache_unavailable", error=str(e))
+                return view(**kwargs)
+
+            if entry is not None:
+                stats.add("hits")
+                return respond(entry)
+            stats.add("misses")
+
+            resp, entry = render(view, kwargs)
+            if entry is None:
+                return resp
+            try:
+                backend.put(key, entry)
+            except Exception as e:
+                metrics.log(event="cache_put_failed", path=request.path, error=str(e))
+            return respond(entry)
+        return wrapper
+    return decorate
@@ -0,0 +1,16 @@
+"""Settings, read from the environment or from .env (the environment wins)."""
+import os
+
+from dotenv import dotenv_values
+
+values = {**dotenv_values(".env"), **os.environ}
+
+def get(key, default=None, cast=str):
+    if key not in values or values[key] == "":
+        return default
+    return cast(values[key])
+
+def flag(key, default=False):
+    if key not in values:
+        return default
+    return values[key].lower() in ("1", "true", "yes", "on")
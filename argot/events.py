@@ -0,0 +1,170 @@
+"""Post/comment events, delivered at least once through an outbox table.
+
+Writers call `publish` inside the same transaction as the change they're
+announcing, so an event exists if and only if the change committed. It
+also fires a Postgres NOTIFY, which wakes up any `Consumer` -- in this
+process or another one -- without it having to poll.
+
+A consumer claims pending events in batches and hands them to an async
+handler. Once the handler returns, the events are marked delivered. If the
+handler raises, the events are retried later with exponential backoff, so
+handlers must be fine with seeing the same event twice.
+
+Events nobody consumes, like "comment" (only argot.live tails those, and
+it reads the table directly), are published as already delivered so they
+don't sit in the pending index forever. Delivered events are kept for
+KEEP_DAYS so live clients can catch up, then `manage prune` deletes them.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import psycopg2
+
+from .models import *
+from . import config, metrics
+
+CHANNEL = "argot_events"
+MAX_BACKOFF = 600
+KEEP_DAYS = config.get("EVENTS_KEEP_DAYS", 7, int)
+
+def publish(kind, ref_id, delay=0, broadcast=False):
+    """Record an event. `delay` holds off delivery for that many seconds.
+
+    `broadcast` events have no Consumer; they're marked delivered up front
+    and only go to whoever's tailing the table.
+    """
+    now = datetime.now()
+    e = Event.create(
+        kind=kind,
+        ref_id=ref_id,
+        time=now,
+        available_at=now + timedelta(seconds=delay),
+        delivered_at=now if broadcast else None,
+    )
+    # NOTIFY only goes out on commit, which is exactly what we want.
+    db.execute_sql("SELECT pg_notify(%s, %s)", (CHANNEL, str(e.id)))
+    return e
+
+def prune(days=KEEP_DAYS):
+    """Delete events delivered more than `days` days ago. Returns how many."""
+    cutoff = datetime.now() - timedelta(days=days)
+    return Event.delete().where(Event.delivered_at < cutoff).execute()
+
+class Consumer:
+    def __init__(self, kinds, batch=10, poll=30):
+        self.kinds = kinds
+        self.batch = batch
+        self.poll = poll
+        # Peewee is blocking, so all of the DB work happens over here instead
+        # of on the event loop.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="events")
+        self.wake = None
+        self.listener = None
+
+    async def call(self, f, *args):
+        """Run blocking (DB) work on our executor and wait for it."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, in_background(f), *args)
+
+    def claim(self):
+        now = datetime.now()
+        return list(Event
+                    .select()
+                    .where(
+                        Event.delivered_at.is_null() &
+                        (Event.available_at <= now) &
+                        (Event.kind << self.kinds))
+                    .order_by(Event.id)
+                    .limit(self.batch))
+
+    def idle(self):
+        """How long to sleep for: until the next delayed event, at most `poll`."""
+        soonest = (Event
+                   .select(fn.MIN(Event.available_at))
+                   .where(Event.delivered_at.is_null() & (Event.kind << self.kinds))
+                   .scalar())
+        if soonest is None:
+            return self.poll
+        return max(0.1, min(self.poll, (soonest - datetime.now()).total_seconds()))
+
+    def ack(self, batch):
+        Event.update(
+            delivered_at=datetime.now()
+        ).where(Event.id << [e.id for e in batch]).execute()
+
+    def fail(self, batch, error):
+        for e in batch:
+            backoff = min(2 ** e.attempts, MAX_BACKOFF)
+            Event.update(
+                attempts=Event.attempts + 1,
+                available_at=datetime.now() + timedelta(seconds=backoff),
+                error=repr(error),
+            ).where(Event.id == e.id).execute()
+
+    def listen(self, loop):
+        """LISTEN on a connection of our own and poke `wake` on every NOTIFY.
+
+        If it can't be set up, we still work, just by polling.
+        """
+        try:
+            conn = psycopg2.connect(dbname=db.database, **db.connect_params)
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {CHANNEL}")
+        except psycopg2.Error as e:
+            metrics.log(event="events_listen_failed", error=str(e))
+            return
+
+        def readable():
+            try:
+                conn.poll()
+            except psycopg2.Error as e:
+                metrics.log(event="events_listener_lost", error=str(e))
+                loop.remove_reader(conn.fileno())
+                return
+            conn.notifies.clear()
+            self.wake.set()
+
+        loop.add_reader(conn.fileno(), readable)
+        self.listener = conn
+
+    async def run(self, handle):
+        """Feed batches of events to `await handle(events)` forever."""
+        loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        self.listen(loop)
+
+        while True:
+            self.wake.clear()
+            try:
+                batch = await self.call(self.claim)
+            except Exception as e:
+                metrics.log(event="events_load_failed", error=str(e))
+                batch = []
+
+            if len(batch) == 0:
+                try:
+                    wait = await self.call(self.idle)
+                    await asyncio.wait_for(self.wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                except Exception as e:
+                    metrics.log(event="events_idle_failed", error=str(e))
+                    await asyncio.sleep(self.poll)
+                continue
+
+            ids = [e.id for e in batch]
+            failure = None
+            try:
+                await handle(batch)
+            except Exception as err:
+                metrics.log(event="events_delivery_failed", ids=ids, error=repr(err))
+                failure = err
+            try:
+                if failure is None:
+                    await self.call(self.ack, batch)
+                else:
+                    await self.call(self.fail, batch, failure)
+            except Exception as err:
+                # Worst case they get delivered again.
+                metrics.log(event="events_outcome_failed", ids=ids, error=repr(err))
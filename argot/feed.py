@@ -0,0 +1,85 @@
+import math
+from datetime import datetime
+
+from peewee import *
+from .models import *
+from . import serialize, stream
+
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+def finite(text):
+    """float(), minus nan and the infinities, which no score can be."""
+    key = float(text)
+    if not math.isfinite(key):
+        raise ValueError(f"{text} isn't a score")
+    return key
+
+# What each ordering sorts on (then id), and how that shows up in cursors.
+SORTS = {
+    "new": (Post.time, datetime.isoformat, datetime.fromisoformat),
+    "hot": (Post.hot, repr, finite),
+}
+
+def encode_cursor(post, sort="new"):
+    """Opaque-ish cursor for the (key, id) keyset of the last post on a page."""
+    field, encode, _ = SORTS[sort]
+    return f"{encode(getattr(post, field.name))}_{post.id}"
+
+def decode_cursor(cursor, sort="new"):
+    _, _, decode = SORTS[sort]
+    try:
+        key, id = cursor.rsplit("_", 1)
+        return decode(key), int(id)
+    except ValueError:
+        return None
+
+def query(after=None, private=False, where=None, sort="new"):
+    """The whole feed as a query, starting after `after`.
+
+    Newest first, or hottest first (see argot.ranking) with sort="hot".
+    """
+    field, _, _ = SORTS[sort]
+    ps = (serialize.post_query()
+          .order_by(field.desc(), Post.id.desc()))
+    if not private:
+        ps = ps.where(Post.public())
+    if where is not None:
+        ps = ps.where(where)
+    if after is not None:
+        key, id = after
+        ps = ps.where(Tuple(field, Post.id) < Tuple(key, id))
+    return ps
+
+def latest(after=None, pg=0, limit=PAGE_SIZE, private=False, where=None, sort="new"):
+    """One page of the front page feed, newest (or hottest) first.
+
+    `after` is a cursor from a previous page. `pg` is only here for the old
+    page-number parameter; offsets don't stay cheap as the table grows,
+    cursors do. `where` narrows the feed down further, e.g. to a tag query.
+    Returns the post dicts and the cursor for the next page (or None).
+    """
+    limit = clamp(limit)
+    ps, cursor = cut(list(page_query(after, pg, limit, private, where, sort)), limit, sort)
+    return serialize.posts(ps), cursor
+
+def clamp(limit):
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def page_query(after=None, pg=0, limit=PAGE_SIZE, private=False, where=None, sort="new"):
+    """The query behind latest(). It asks for one post more than `limit`,
+    which is how cut() knows whether there's another page."""
+    ps = query(after, private, where, sort).limit(limit + 1)
+    if after is None and pg > 0:
+        ps = ps.offset(pg*limit)
+    return ps
+
+def cut(ps, limit, sort="new"):
+    """A page's posts and the cursor for the next one, from page_query's rows."""
+    cursor = encode_cursor(ps[limit - 1], sort) if len(ps) > limit else None
+    return ps[:limit], cursor
+
+def everything(after=None, private=False, where=None, sort="new"):
+    """All of the feed past `after`, as a stream of lists of post dicts."""
+    for rows in stream.batches(query(after, private, where, sort)):
+        yield serialize.posts(rows)
@@ -0,0 +1,92 @@
+"""Notifications: replies to your posts and comments, and how many are unread.
+
+`notify` runs inside the transaction that adds the reply, so the two
+commit (or don't) together, and every worker sees the same inbox.
+
+users.unread follows the unread rows. Everything here that adds, reads or
+deletes notifications adjusts it in the same transaction, so /inbox/size
+is a primary key lookup no matter how big the inbox gets. `manage recount`
+rebuilds it.
+"""
+from datetime import datetime
+
+from peewee import *
+from .models import *
+from . import serialize
+
+def notify(user_id, comment):
+    """Tell `user_id` about `comment`. Call inside the comment's transaction."""
+    Notification.create(user_id=user_id, comment_id=comment.id, time=comment.time)
+    User.update(unread=User.unread + 1).where(User.id == user_id).execute()
+
+def size(user_id):
+    return User.select(User.unread).where(User.id == user_id).scalar()
+
+def query(user_id, unread=True, after=None):
+    """The user's notifications past `after` (a notification id), newest first."""
+    ns = (Notification
+          .select(Notification.id, Notification.comment_id, Notification.read_at)
+          .where(Notification.user_id == user_id)
+          .order_by(Notification.id.desc()))
+    if unread:
+        ns = ns.where(Notification.read_at.is_null())
+    if after is not None:
+        ns = ns.where(Notification.id < after)
+    return ns
+
+def page(user_id, unread=True, after=None, limit=None):
+    """One page of the inbox as comment dicts, and the cursor for the next one.
+
+    Two queries: the notifications, then their comments.
+    """
+    ns = list(query(user_id, unread, after).limit(limit + 1))
+    cursor = str(ns[limit - 1].id) if len(ns) > limit else None
+    ns = ns[:limit]
+    cs = {c["id"]: c for c in serialize.comments([n.comment_id_id for n in ns])}
+    return [{**cs[n.comment_id_id], "read": n.read_at is not None} for n in ns], cursor
+
+def mark_read(user_id, comment_ids=None):
+    """Mark notifications about these comments (or all of them) read.
+
+    Returns how many that was; ones that were already read don't count.
+    """
+    with db.atomic():
+        q = (Notification
+             .update(read_at=datetime.now())
+             .where((Notification.user_id == user_id) & Notification.read_at.is_null()))
+        if comment_ids is not None:
+            q = q.where(Notification.comment_id << list(comment_ids))
+        n = q.execute()
+        if n != 0:
+            # Take away what we marked rather than setting it to zero, since
+            # replies can come in while this runs.
+            User.update(unread=User.unread - n).where(User.id == user_id).execute()
+    return n
+
+def drop_post(post_id):
+    """Delete notifications about a post's comments, before deleting them."""
+    db.execute_sql("""
+        WITH gone AS (
+          DELETE FROM notifications
+          WHERE comment_id IN (SELECT id FROM comments WHERE post_id = %s)
+          RETURNING user_id, read_at
+        )
+        UPDATE users SET unread = unread - g.n
+        FROM (SELECT user_id, count(*) AS n FROM gone WHERE read_at IS NULL GROUP BY user_id) g
+        WHERE users.id = g.user_id
+    """, (post_id,))
+
+def recount():
+    """(Re)build users.unread. Returns how many users were off."""
+    cur = db.execute_sql("""
+        UPDATE users SET unread = coalesce(n.n, 0)
+        FROM users u
+        LEFT JOIN (
+          SELECT user_id, count(*) AS n
+          FROM notifications
+          WHERE read_at IS NULL
+          GROUP BY user_id
+        ) n ON n.user_id = u.id
+        WHERE users.id = u.id AND users.unread IS DISTINCT FROM coalesce(n.n, 0)
+    """)
+    return cur.rowcount
@@ -0,0 +1,134 @@
+"""Password hashing on a small, bounded pool of worker threads.
+
+scrypt is deliberately slow and memory hungry, so letting every request
+run it at once means a burst of logins eats all the CPU and memory there
+is. Here at most KDF_WORKERS hashes run at once (hashlib.scrypt drops the
+GIL, so threads are enough) and at most KDF_QUEUE can be running or
+waiting; past that we raise Busy and the caller should tell the client to
+back off. The pool only bounds that: `hash_password` and `verify` still
+block the calling request thread until its hash is done.
+
+Hashes are stored as `scrypt$n$r$p$hex` so the cost can change over time.
+Bare hex digests are from before that and use the old fixed parameters.
+When a login verifies against stale parameters, `verify` says so and the
+hash gets redone in the background with the current ones.
+"""
+import hashlib
+import hmac
+import secrets
+import string
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import config
+
+LEGACY = (16384, 8, 1)
+COST = (
+    config.get("SCRYPT_N", 16384, int),
+    config.get("SCRYPT_R", 8, int),
+    config.get("SCRYPT_P", 1, int),
+)
+
+class Busy(Exception):
+    """Too many hashes already queued up."""
+
+def new_salt():
+    alphabet = string.ascii_letters + string.digits
+    return ''.join(secrets.choice(alphabet) for i in range(8))
+
+def scrypt(password, salt, n, r, p):
+    # OpenSSL refuses anything over 32 MiB unless told otherwise.
+    maxmem = 128 * r * (n + p + 2) + 1024 * 1024
+    return hashlib.scrypt(password.encode(), salt=salt.encode(), n=n, r=r, p=p, maxmem=maxmem).hex()
+
+def encode(cost, digest):
+    n, r, p = cost
+    return f"scrypt${n}${r}${p}${digest}"
+
+def decode(stored):
+    if not stored.startswith("scrypt$"):
+        return LEGACY, stored
+    _, n, r, p, digest = stored.split("$")
+    return (int(n), int(r), int(p)), digest
+
+class Pool:
+    def __init__(self, workers, queue):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kdf")
+        self.slots = threading.BoundedSemaphore(queue)
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.hashes = 0
+        self.rejected = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+
+    def submit(self, f, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise Busy()
+        with self.lock:
+            self.depth += 1
+
+        def run():
+            start = time.perf_counter()
+            try:
+                return f(*args)
+            finally:
+                took = time.perf_counter() - start
+                with self.lock:
+                    self.depth -= 1
+                    self.hashes += 1
+                    self.seconds += took
+                    self.slowest = max(self.slowest, took)
+                self.slots.release()
+
+        return self.executor.submit(run)
+
+    def run(self, f, *args):
+        return self.submit(f, *args).result()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "queue_depth": self.depth,
+                "hashes": self.hashes,
+                "rejected": self.rejected,
+                "hash_seconds_total": self.seconds,
+                "hash_seconds_max": self.slowest,
+            }
+
+pool = Pool(config.get("KDF_WORKERS", 2, int), config.get("KDF_QUEUE", 16, int))
+
+def hash_password(password):
+    """New (hash, salt) pair at the current cost. Raises Busy."""
+    salt = new_salt()
+    return encode(COST, pool.run(scrypt, password, salt, *COST)), salt
+
+def verify(password, salt, stored):
+    """Returns (matches, needs_rehash). Raises Busy."""
+    cost, digest = decode(stored)
+    ok = hmac.compare_digest(pool.run(scrypt, password, salt, *cost), digest)
+    return ok, ok and cost != COST
+
+def rehash(password, save):
+    """Hash again at the current cost in the background, then save(hash, salt).
+
+    Best effort: if the pool is busy we just try again on the next login.
+    """
+    def job():
+        salt = new_salt()
+        save(encode(COST, scrypt(password, salt, *COST)), salt)
+    try:
+        pool.submit(job).add_done_callback(report)
+    except Busy:
+        pass
+
+def report(future):
+    """Log what went wrong with a background rehash; nobody's waiting on it."""
+    # Not at the top: models imports us, and metrics imports models.
+    from . import metrics
+    e = future.exception()
+    if e is not None:
+        metrics.log(event="rehash_failed", error=repr(e))
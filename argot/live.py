@@ -0,0 +1,229 @@
+"""Live updates: new posts and comments pushed to clients as Server-Sent Events.
+
+The write paths already publish "post" and "comment" events in the same
+transaction as the change (see argot.events), along with a NOTIFY. The hub
+LISTENs for those on an async connection, reads whatever's new from the
+events table, builds each delta once and drops the finished SSE text into
+the queue of every client subscribed to it. A client is an asyncio queue
+and an open response, not a thread, so idle connections cost next to
+nothing. It runs in async_server.py.
+
+Topics are "posts" (every new post and comment, for the front page) and
+"post:<id>" (new comments on that post). Private posts, private comments
+and comments on private posts only go to logged-in clients.
+
+Each delta's SSE id is its event id. The last BUFFER deltas are kept, so
+a client that reconnects with Last-Event-ID gets what it missed replayed.
+If it's been gone longer than that, or since before the server started,
+it gets a "reset" event telling it to refetch. Event ids come from a
+sequence, so they can commit out of order; the hub waits up to GAP seconds
+for a missing id before giving up on it, and delivery is at least once.
+"""
+import asyncio
+import contextlib
+from collections import defaultdict, deque
+
+import psycopg2
+
+from .models import *
+from . import adb, config, events, metrics, serialize, wire
+
+BUFFER = config.get("LIVE_BUFFER", 10000, int)
+# Deltas a slow client can fall behind by before it's cut off. It'll
+# reconnect and catch up from the buffer.
+QUEUE = config.get("LIVE_QUEUE", 256, int)
+HEARTBEAT = config.get("LIVE_HEARTBEAT", 15, float)
+GAP = 5
+POLL = 30
+BATCH = 1000
+
+def sse(id, kind, data):
+    return f"id: {id}\nevent: {kind}\ndata: ".encode() + wire.dumps(data) + b"\n\n"
+
+RESET = b"event: reset\ndata: {}\n\n"
+PING = b": ping\n\n"
+
+class Delta:
+    def __init__(self, id, topics, private, chunk):
+        self.id = id
+        self.topics = topics
+        self.private = private
+        self.chunk = chunk
+
+class Subscriber:
+    def __init__(self, topic, private):
+        self.topic = topic
+        self.private = private
+        self.queue = asyncio.Queue(QUEUE)
+
+    def send(self, chunk):
+        try:
+            self.queue.put_nowait(chunk)
+        except asyncio.QueueFull:
+            self.close()
+
+    def close(self):
+        """Make the next get() return None, i.e. hang up."""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+class Hub:
+    def __init__(self, buffer=BUFFER):
+        self.subscribers = defaultdict(set)
+        self.recent = deque(maxlen=buffer)
+        # Every event up to `cursor` has been dealt with, and so have the
+        # ones in `seen`. Deltas up to `floor` are gone from `recent`.
+        self.cursor = None
+        self.floor = None
+        self.seen = set()
+        self.gap_since = None
+        self.wake = None
+
+    @contextlib.contextmanager
+    def subscribe(self, topic, private, last=None):
+        """Yields (backlog, subscriber). The backlog is what's newer than the
+        event id `last`, or None if some of that is no longer around."""
+        s = Subscriber(topic, private)
+        self.subscribers[topic].add(s)
+        try:
+            yield self.backlog(topic, private, last), s
+        finally:
+            self.subscribers[topic].discard(s)
+            if len(self.subscribers[topic]) == 0:
+                del self.subscribers[topic]
+
+    def backlog(self, topic, private, last):
+        if last is None:
+            return []
+        if self.floor is None or last < self.floor:
+            return None
+        return [d.chunk for d in self.recent
+                if d.id > last and topic in d.topics and (private or not d.private)]
+
+    def publish(self, delta):
+        if len(self.recent) == self.recent.maxlen:
+            self.floor = max(self.floor, self.recent[0].id)
+        self.recent.append(delta)
+        for topic in delta.topics:
+            for s in list(self.subscribers.get(topic, ())):
+                if s.private or not delta.private:
+                    s.send(delta.chunk)
+
+    def clients(self):
+        return sum(len(s) for s in self.subscribers.values())
+
+    def stats(self):
+        return {"clients": self.clients(), "topics": len(self.subscribers), "buffered": len(self.recent)}
+
+    async def listen(self):
+        """LISTEN for events on a connection of our own, waking the hub on
+        every NOTIFY. Without it we still work, by polling."""
+        loop = asyncio.get_running_loop()
+        try:
+            conn = psycopg2.connect(dbname=db.web.database, async_=True, **db.web.connect_params)
+            await adb.wait(conn)
+            cursor = conn.cursor()
+            cursor.execute(f"LISTEN {events.CHANNEL}")
+            await adb.wait(conn)
+        except psycopg2.Error as e:
+            metrics.log(event="live_listen_failed", error=str(e))
+            return None
+
+        def readable():
+            try:
+                conn.poll()
+            except psycopg2.Error as e:
+                metrics.log(event="live_listener_lost", error=str(e))
+                loop.remove_reader(conn.fileno())
+                return
+            conn.notifies.clear()
+            self.wake.set()
+
+        loop.add_reader(conn.fileno(), readable)
+        return conn
+
+    async def run(self):
+        """Turn events into deltas, forever."""
+        self.wake = asyncio.Event()
+        listener = await self.listen()
+        start = await adb.scalar(Event.select(fn.MAX(Event.id)))
+        self.cursor = self.floor = start or 0
+        try:
+            while True:
+                self.wake.clear()
+                try:
+                    await self.catch_up()
+                except Exception as e:
+                    metrics.log(event="live_load_failed", error=repr(e))
+                try:
+                    # Check back soon if we're waiting on a gap.
+                    await asyncio.wait_for(self.wake.wait(), GAP if self.seen else POLL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if listener is not None:
+                asyncio.get_running_loop().remove_reader(listener.fileno())
+                listener.close()
+
+    async def catch_up(self):
+        while True:
+            rows = await adb.run(Event
+                                 .select(Event.id, Event.kind, Event.ref_id)
+                                 .where(Event.id > self.cursor)
+                                 .order_by(Event.id)
+                                 .limit(BATCH))
+            new = [e for e in rows if e.id not in self.seen]
+            for delta in await deltas(new):
+                self.publish(delta)
+            self.seen.update(e.id for e in new)
+            self.advance()
+            if len(rows) < BATCH:
+                return
+
+    def advance(self):
+        """Move the cursor up past everything that's been seen, and past
+        holes that have been there for more than GAP seconds (rolled back,
+        most likely)."""
+        now = asyncio.get_running_loop().time()
+        while len(self.seen) != 0:
+            if self.cursor + 1 in self.seen:
+                self.seen.remove(self.cursor + 1)
+                self.cursor += 1
+                self.gap_since = None
+            elif self.gap_since is None:
+                self.gap_since = now
+                return
+            elif now - self.gap_since > GAP:
+                self.cursor += 1
+            else:
+                return
+
+async def deltas(batch):
+    """Deltas for the post and comment events in `batch`, in the same order."""
+    post_ids = [e.ref_id for e in batch if e.kind == "post"]
+    comment_ids = [e.ref_id for e in batch if e.kind == "comment"]
+    posts, comments = {}, {}
+    if len(post_ids) != 0:
+        ps = await adb.run(serialize.post_query().where(Post.id << post_ids))
+        posts = {p["id"]: p for p in await adb.posts(ps)}
+    if len(comment_ids) != 0:
+        cs = await adb.run(serialize.comment_query()
+                           .select_extend(Post.id, Post.private)
+                           .join_from(Comment, Post, on=(Comment.post_id == Post.id))
+                           .where(Comment.id << comment_ids))
+        comments = {c.id: c for c in cs}
+
+    out = []
+    for e in batch:
+        if e.kind == "post" and e.ref_id in posts:
+            p = posts[e.ref_id]
+            out.append(Delta(e.id, ["posts"], p["private"], sse(e.id, "post", p)))
+        elif e.kind == "comment" and e.ref_id in comments:
+            c = comments[e.ref_id]
+            data = {**serialize.comment_dict(c, c.author_id.nick), "parent": c.parent_id_id}
+            private = c.private or c.post_id.private
+            out.append(Delta(e.id, ["posts", f"post:{c.post_id_id}"], private, sse(e.id, "comment", data)))
+    return out
+
+hub = Hub()
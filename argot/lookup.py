@@ -0,0 +1,70 @@
+"""Fetching single rows for the routes, in one query each.
+
+`get` remembers what it found for the rest of the request, so asking for
+the same post twice (say, once to check it exists and once to render it)
+only hits the database once. `get_or_404` does the same but bails out of
+the request with the usual "does not exist" message instead of returning
+None.
+
+Logged-in users get looked up on every request, so `user` keeps them
+around for USER_CACHE_TTL seconds across requests as well. Anything that
+changes a user row should `forget_user` it.
+"""
+from flask import abort, g, has_app_context, make_response
+
+from .models import *
+from . import config
+from .lru import Cache
+
+NAMES = {Post: "post", Comment: "comment", User: "user", Tag: "tag"}
+
+users = Cache(config.get("USER_CACHE_SIZE", 1024, int), config.get("USER_CACHE_TTL", 30, int))
+
+def _seen():
+    if not has_app_context():
+        return {}
+    if "identity" not in g:
+        g.identity = {}
+    return g.identity
+
+def remember(row):
+    _seen()[type(row), row.id] = row
+    return row
+
+def get(model, id, query=None):
+    """The `model` row with this id, or None. `query` can join extra columns in."""
+    seen = _seen()
+    key = (model, int(id))
+    if key not in seen:
+        q = query if query is not None else model.select()
+        seen[key] = q.where(model.id == key[1]).get_or_none()
+    return seen[key]
+
+def find(model, *where):
+    """Like `get`, by anything other than the id. Only the result is remembered."""
+    row = model.get_or_none(*where)
+    if row is not None:
+        remember(row)
+    return row
+
+def not_found(model, id):
+    abort(make_response(f"A {NAMES[model]} with the ID {id} does not exist!", 404))
+
+def get_or_404(model, id, query=None):
+    row = get(model, id, query)
+    if row is None:
+        not_found(model, id)
+    return row
+
+def user(id):
+    """User by id for flask_login, cached across requests."""
+    id = int(id)
+    u = users.get(id)
+    if u is None:
+        u = User.get_or_none(User.id == id)
+        if u is not None:
+            users.put(id, u)
+    return u
+
+def forget_user(id):
+    users.drop(int(id))
@@ -0,0 +1,98 @@
+"""Maintenance commands, e.g. `python -m argot.manage migrate`."""
+import argparse
+import sys
+
+from .models import *
+from . import migrate as schema
+from . import activity, bulk, events, inbox, ranking
+
+def recount(args):
+    """(Re)build the comment counts and last activity on posts, and users' counts.
+
+    Safe to run at any time; only rows that have drifted get written.
+    """
+    with db.atomic():
+        cur = db.execute_sql("""
+            UPDATE posts SET
+              num_comments = coalesce(c.n, 0),
+              last_activity = greatest(p.time, c.latest)
+            FROM posts p
+            LEFT JOIN (
+              SELECT post_id, count(*) AS n, max(time) AS latest
+              FROM comments
+              WHERE content <> %s
+              GROUP BY post_id
+            ) c ON c.post_id = p.id
+            WHERE posts.id = p.id AND (
+              posts.num_comments IS DISTINCT FROM coalesce(c.n, 0) OR
+              posts.last_activity IS DISTINCT FROM greatest(p.time, c.latest)
+            )
+        """, (DELETED,))
+        users = activity.recount()
+        inboxes = inbox.recount()
+    print(f"Fixed {cur.rowcount} post(s), {users} user(s), {inboxes} unread count(s).")
+
+def load(args):
+    """Import posts from an NDJSON file (see argot/bulk.py)."""
+    lines = sys.stdin if args.file == "-" else open(args.file)
+    report = bulk.import_posts(lines, args.author, batch=args.batch)
+    for e in report["errors"]:
+        print(f"line {e['line']}: {e['error']}")
+    print(f"Imported {report['posts']} post(s), {report['comments']} comment(s), {report['tagmaps']} tag(s).")
+
+def rerank(args):
+    """Recompute every post's hot score (see argot/ranking.py)."""
+    print(f"Rescored {ranking.rerank()} post(s).")
+
+def ranker(args):
+    """Keep hot scores up to date as comments come in. Runs until killed."""
+    ranking.run()
+
+def notifier(args):
+    """Announce new posts on Discord. Runs until killed."""
+    # Only this process needs discord.py.
+    from . import notifier
+    if notifier.secret() is None:
+        raise SystemExit("DISCORD_SECRET isn't set.")
+    notifier.run()
+
+def prune(args):
+    """Delete delivered events older than --days (see argot/events.py)."""
+    print(f"Deleted {events.prune(args.days)} event(s).")
+
+def migrate(args):
+    """Bring the schema up to date (see migrations/)."""
+    schema.migrate(to=args.to)
+
+def status(args):
+    """List migrations and whether they've been applied."""
+    schema.status()
+
+COMMANDS = {
+    "migrate": migrate,
+    "status": status,
+    "recount": recount,
+    "import": load,
+    "rerank": rerank,
+    "ranker": ranker,
+    "notifier": notifier,
+    "prune": prune,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="argot.manage")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, f in COMMANDS.items():
+        sub.add_parser(name, help=f.__doc__.splitlines()[0])
+    sub.choices["migrate"].add_argument("--to", help="stop after this migration")
+    sub.choices["import"].add_argument("file", help="NDJSON, or - for stdin")
+    sub.choices["import"].add_argument("--author", required=True, help="nick to post as by default")
+    sub.choices["import"].add_argument("--batch", type=int, help="posts per transaction")
+    sub.choices["prune"].add_argument("--days", type=int, default=events.KEEP_DAYS,
+                                      help=f"keep this many days (default {events.KEEP_DAYS})")
+
+    args = parser.parse_args(argv)
+    COMMANDS[args.command](args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Where the time goes: per-route latency, queries per request, slow queries.
+
+`init_app` hooks a Flask app so that every request gets timed and has its
+queries counted and timed (through Pool.observers). What comes out:
+
+- Prometheus text on /metrics: request latency histograms and counts per
+  route, method and status, plus queries and DB time per request.
+- One JSON line per request on stdout, if REQUEST_LOG is on.
+- A warning line for every query slower than SLOW_QUERY_MS, with the SQL
+  and the line of our code that ran it.
+- A warning when the same query shape runs NPLUSONE_THRESHOLD times in one
+  request, which is nearly always a loop that should've been one query.
+
+Queries from background threads aren't tied to a request, so they only
+show up in the slow query log.
+"""
+import json
+import os
+import re
+import threading
+import time
+import traceback
+
+from flask import g, request
+
+from . import config
+from .models import Pool
+
+SLOW_QUERY = config.get("SLOW_QUERY_MS", 100, float) / 1000
+NPLUSONE_THRESHOLD = config.get("NPLUSONE_THRESHOLD", 10, int)
+REQUEST_LOG = config.flag("REQUEST_LOG", True)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            s = self.series.setdefault(labels, [[0] * len(self.buckets), 0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    s[0][i] += 1
+            s[1] += 1
+            s[2] += value
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, n, total) in sorted(self.series.items()):
+                for bound, c in zip(self.buckets, counts):
+                    out.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {c}')
+                out.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {n}')
+                out.append(f"{self.name}_sum{{{labels}}} {total}")
+                out.append(f"{self.name}_count{{{labels}}} {n}")
+        return out
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def add(self, labels, value=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.series.items()):
+                out.append(f"{self.name}{{{labels}}} {value}")
+        return out
+
+latency = Histogram("argot_request_seconds", "Time to handle a request.", LATENCY_BUCKETS)
+queries = Histogram("argot_request_queries", "Queries run per request.", QUERY_BUCKETS)
+db_time = Histogram("argot_request_db_seconds", "Time spent in the database per request.", LATENCY_BUCKETS)
+slow = Counter("argot_slow_queries_total", "Queries slower than SLOW_QUERY_MS.")
+repeated = Counter("argot_nplusone_total", "Requests that ran one query shape too many times.")
+
+# What the current thread's request has done so far, if it's handling one.
+local = threading.local()
+
+# Collapse IN (%s, %s, ...) lists so they count as one shape.
+PARAMS = re.compile(r"%s(, %s)+")
+
+def shape(sql):
+    return PARAMS.sub("%s, ...", sql)
+
+# Frames from these don't count as the call site.
+LIBRARY = ("peewee.py", "playhouse", "psycopg2", os.path.join("argot", "metrics.py"))
+
+def call_site():
+    """file:line of the innermost frame that isn't the ORM or this module."""
+    for frame in reversed(traceback.extract_stack()):
+        if any(part in frame.filename for part in LIBRARY):
+            continue
+        if frame.name == "execute_sql" and frame.filename.endswith("models.py"):
+            continue
+        return f"{os.path.relpath(frame.filename)}:{frame.lineno} in {frame.name}"
+    return "?"
+
+def log(**fields):
+    print(json.dumps(fields, default=str), flush=True)
+
+def observe(sql, seconds):
+    stats = getattr(local, "request", None)
+    if seconds >= SLOW_QUERY:
+        log(event="slow_query", ms=round(seconds * 1000, 2), sql=sql, site=call_site(),
+            route=stats["route"] if stats else None)
+        slow.add(f'route="{stats["route"] if stats else "background"}"')
+    if stats is None:
+        return
+    stats["queries"] += 1
+    stats["db_seconds"] += seconds
+    key = shape(sql)
+    n = stats["shapes"][key] = stats["shapes"].get(key, 0) + 1
+    if n == NPLUSONE_THRESHOLD:
+        log(event="n_plus_one", route=stats["route"], times=n, sql=key, site=call_site())
+        stats["n_plus_one"] += 1
+
+CONVERTER = re.compile(r"<\w+:")
+
+def route():
+    if request.url_rule is None:
+        return "unmatched"
+    # "/posts/<post_id>" rather than "/posts/<int:post_id>", so the labels
+    # match the async server's.
+    return CONVERTER.sub("<", request.url_rule.rule)
+
+def start():
+    local.request = {
+        "route": route(),
+        "start": time.perf_counter(),
+        "queries": 0,
+        "db_seconds": 0.0,
+        "shapes": {},
+        "n_plus_one": 0,
+    }
+
+def record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+def finish(exc):
+    stats = getattr(local, "request", None)
+    if stats is None:
+        return
+    local.request = None
+    took = time.perf_counter() - stats["start"]
+    status = g.get("metrics_status", 500)
+
+    labels = f'route="{stats["route"]}",method="{request.method}"'
+    latency.observe(f'{labels},status="{status}"', took)
+    queries.observe(labels, stats["queries"])
+    db_time.observe(labels, stats["db_seconds"])
+    if stats["n_plus_one"] != 0:
+        repeated.add(labels)
+
+    if REQUEST_LOG:
+        log(
+            event="request",
+            method=request.method,
+            route=stats["route"],
+            path=request.path,
+            status=status,
+            ms=round(took * 1000, 2),
+            queries=stats["queries"],
+            db_ms=round(stats["db_seconds"] * 1000, 2),
+        )
+
+def init_app(app):
+    """Instrument `app`. Register this before anything else that hooks requests.
+
+    Safe to call for any number of apps: queries are observed once however
+    many there are.
+    """
+    if observe not in Pool.observers:
+        Pool.observers.append(observe)
+    app.before_request(start)
+    app.after_request(record_status)
+    app.teardown_request(finish)
+
+def gauges(prefix, stats):
+    """Prometheus lines for a nested dict of numbers, e.g. db.stats()."""
+    out = []
+    for k, v in stats.items():
+        name = f"{prefix}_{k}"
+        if isinstance(v, dict):
+            out.extend(gauges(name, v))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out.append(f"{name} {v}")
+    return out
+
+def render(**extra):
+    """Everything in the Prometheus text format. `extra` are dicts of gauges."""
+    out = []
+    for m in (latency, queries, db_time, slow, repeated):
+        out.extend(m.render())
+    for prefix, stats in extra.items():
+        out.extend(gauges(f"argot_{prefix}", stats))
+    return "\n".join(out) + "\n"
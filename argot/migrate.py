@@ -0,0 +1,67 @@
+"""Versioned schema migrations.
+
+Migrations are the .sql files in migrations/, applied in filename order,
+each in its own transaction together with its row in schema_migrations.
+A database that doesn't have any tables yet gets up.sql first.
+"""
+import os
+from datetime import datetime
+
+from .models import *
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+DIR = os.path.join(ROOT, "migrations")
+
+def available():
+    """(version, path) for every migration, oldest first."""
+    out = []
+    for name in sorted(os.listdir(DIR)):
+        if name.endswith(".sql"):
+            out.append((name[:-len(".sql")], os.path.join(DIR, name)))
+    return out
+
+def run_file(path):
+    # Straight to the cursor: with no params, psycopg2 leaves any literal %
+    # signs in the SQL alone.
+    db.cursor().execute(open(path).read())
+
+def bootstrap():
+    db.execute_sql(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "  version    TEXT PRIMARY KEY,"
+        "  applied_at TIMESTAMP NOT NULL"
+        ")"
+    )
+    if not db.table_exists("users"):
+        print("Empty database, loading up.sql.")
+        run_file(os.path.join(ROOT, "up.sql"))
+
+def applied():
+    return {v for v, in db.execute_sql("SELECT version FROM schema_migrations")}
+
+def pending(to=None):
+    done = applied()
+    return [(v, path) for v, path in available() if v not in done and (to is None or v <= to)]
+
+def migrate(to=None):
+    """Apply pending migrations, up to and including `to` if given."""
+    with db.atomic():
+        bootstrap()
+    todo = pending(to)
+    if len(todo) == 0:
+        print("Already up to date.")
+    for version, path in todo:
+        print(f"Applying {version}...")
+        with db.atomic():
+            run_file(path)
+            db.execute_sql(
+                "INSERT INTO schema_migrations (version, applied_at) VALUES (%s, %s)",
+                (version, datetime.now())
+            )
+
+def status():
+    with db.atomic():
+        bootstrap()
+    done = applied()
+    for version, _ in available():
+        print(f"[{'x' if version in done else ' '}] {version}")
@@ -1,12 +1,15 @@
 from datetime import datetime
-import secrets
-import hashlib
-import string
+import functools
+import threading
+import time
 
 from peewee import *
 from playhouse.postgres_ext import *
+from playhouse.pool import PooledPostgresqlExtDatabase
 from flask_login import UserMixin
 
+from . import config, kdf
+
 # def date_str(dt):
 #     """Scuffed func to convert datetime to relative time in natural language.
 #     E.g. dt -> '3 hours ago'
@@ -27,7 +30,99 @@ from flask_login import UserMixin
 #     return "just now" # you don't need microsecond precision.
 
 
-db = PostgresqlExtDatabase('argot', host="/var/run/postgresql")
+# What a comment's content gets replaced with when its author deletes it.
+DELETED = "[deleted]"
+
+class Pool(PooledPostgresqlExtDatabase):
+    # Each gets called with (sql, seconds) after every query, see metrics.py.
+    observers = []
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        if len(self.observers) == 0:
+            return super().execute_sql(sql, params, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params, *args, **kwargs)
+        finally:
+            took = time.perf_counter() - start
+            for f in self.observers:
+                f(sql, took)
+
+    def stats(self):
+        with self._pool_lock:
+            return {
+                "in_use": len(self._in_use),
+                "idle": len(self._connections),
+                "max": self._max_connections,
+            }
+
+class Pools(DatabaseProxy):
+    """Two connection pools behind the one database handle the models use.
+
+    Threads get connections from `web` by default. Threads that only do
+    background work (notifier, title fetches, rehashing) call `background()`
+    once -- usually as a ThreadPoolExecutor initializer -- and draw from
+    `worker` from then on, so they can't eat up the connections requests
+    need.
+    """
+    __slots__ = ('obj', '_callbacks', '_Model', 'web', 'worker', 'local')
+
+    def __init__(self, web, worker):
+        super().__init__()
+        self.initialize(web)
+        self.web = web
+        self.worker = worker
+        self.local = threading.local()
+
+    def current(self):
+        return self.worker if getattr(self.local, "background", False) else self.web
+
+    def background(self):
+        self.local.background = True
+
+    def init(self, database, **kwargs):
+        self.web.init(database, **kwargs)
+        self.worker.init(database, **kwargs)
+
+    def stats(self):
+        return {"web": self.web.stats(), "worker": self.worker.stats()}
+
+    def __getattr__(self, attr):
+        return getattr(self.current(), attr)
+
+    def __enter__(self):
+        return self.current().__enter__()
+
+    def __exit__(self, *args):
+        return self.current().__exit__(*args)
+
+def new_pool(max_connections):
+    return Pool(
+        config.get("DB_NAME", "argot"),
+        host=config.get("DB_HOST", "/var/run/postgresql"),
+        max_connections=max_connections,
+        # Connections older than this get recycled when they're handed back.
+        stale_timeout=config.get("DB_STALE_TIMEOUT", 300, int),
+        # How long to wait for a free connection before giving up.
+        timeout=config.get("DB_POOL_TIMEOUT", 10, int),
+    )
+
+db = Pools(
+    new_pool(config.get("DB_MAX_CONNECTIONS", 20, int)),
+    new_pool(config.get("DB_WORKER_MAX_CONNECTIONS", 8, int)),
+)
+
+def in_background(f):
+    """Wrap a function that runs off the request path, e.g. on an executor.
+
+    It gets a connection from the worker pool for the duration of the call.
+    """
+    @functools.wraps(f)
+    def inner(*args, **kwargs):
+        db.background()
+        with db.connection_context():
+            return f(*args, **kwargs)
+    return inner
 
 class User(UserMixin, Model):
     class Meta:
@@ -40,16 +135,19 @@ class User(UserMixin, Model):
     email = TextField(null=True)
     hash = TextField()
     salt = TextField()
+    # Maintained alongside posts.num_comments, fixed up by `manage recount`.
+    # Deleted comments don't count.
+    num_posts = IntegerField(default=0)
+    num_comments = IntegerField(default=0)
+    # Unread notifications, maintained by argot.inbox.
+    unread = IntegerField(default=0)
 
     def new(nick, password, bio=None, email=None):
-        alphabet = string.ascii_letters + string.digits
-        salt = ''.join(secrets.choice(alphabet) for i in range(8))
-
-        dk = hashlib.scrypt(password.encode(), salt=salt.encode(), n=16384, r=8, p=1)
+        hash, salt = kdf.hash_password(password)
 
         return User.create(
             nick=nick,
-            hash=dk.hex(),
+            hash=hash,
             salt=salt,
             email=email,
             bio=bio
@@ -71,53 +169,36 @@ class Post(Model):
     author_id = ForeignKeyField(User, backref="posts")
     time = DateTimeField()
     content = TextField(null=True)
-    private = BooleanField()
+    private = BooleanField(default=False)
+    # Maintained by Comment.new/Comment.remove, fixed up by `manage recount`.
+    num_comments = IntegerField(default=0)
+    last_activity = DateTimeField(null=True)
+    # Front page ranking, see argot.ranking.
+    hot = DoubleField(null=True)
 
     class Meta:
         database = db
         table_name = "posts"
 
     def new(link, title, author, time=None, content=None, tags=None, private=False):
-        return Post.create(
+        # Two statements; bulk.create_post runs them in its transaction.
+        time = time if time is not None else datetime.now()
+        p = Post.create(
             title=title,
             link=link,
             author_id=author,
-            time=time if time is not None else datetime.now(),
+            time=time,
             content=content,
-            private=private
+            private=private,
+            last_activity=time,
+            hot=ranking.score(0, time)
         )
+        User.update(num_posts=User.num_posts + 1).where(User.id == author).execute()
+        return p
 
-    def tag_exclude(excl_tags):
-        """For handling the case where it's just exclusions."""
-        
-        excl_posts = Post.select().join(TagMap).join(Tag).where(
-            (Post.id == TagMap.post_id) &
-            (TagMap.tag_id == Tag.id) &
-            (Tag.name << excl_tags)
-        ).group_by(Post.id)
-        
-        posts = Post.select().where(~(Post.id << excl_posts))
-        return [p.to_dict() for p in posts]
-
-    def tag_query(tag_names, excl_tags, intersection=False):
-        tags = tuple([str(tag) for tag in tag_names])
-
-        excl_posts = Post.select().join(TagMap).join(Tag).where(
-            (Post.id == TagMap.post_id) &
-            (TagMap.tag_id == Tag.id) &
-            (Tag.name << excl_tags)
-        ).group_by(Post.id)
-                
-        posts = Post.select().join(TagMap).join(Tag).where(
-            (TagMap.tag_id == Tag.id) &
-            (Tag.name << tags) &
-            (Post.id == TagMap.post_id) &
-            ~(Post.id << excl_posts)
-        ).group_by(Post.id)
-        if intersection:
-            posts = posts.having(fn.Count(Post.id) == len(tags))
-
-        return [p.to_dict() for p in posts]
+    def public():
+        """Where-clause for posts anonymous users are allowed to see."""
+        return Post.private == False
 
     def to_dict(self):
         return {
@@ -127,7 +208,8 @@ class Post(Model):
             "author": self.author_id.nick,
             "time": self.time.timestamp(),
             "content": self.content,
-            "num_comments": sum(c.tree_size() for c in self.comments),
+            "num_comments": self.num_comments,
+            "last_activity": (self.last_activity or self.time).timestamp(),
             "tags": [t.tag_id.name for t in self.tags],
             "private": self.private
         }
@@ -156,21 +238,52 @@ class Comment(Model):
     parent_id = ForeignKeyField('self', null=True, backref="children")
     author_id = ForeignKeyField(User, backref="comments")
     content = TextField()
-    private = BooleanField()
+    private = BooleanField(default=False)
+    # Ids from the top-level comment down to this one, and how far down
+    # that is. Both are filled in by a trigger, see 0007_comment_paths.sql.
+    path = ArrayField(IntegerField)
+    depth = IntegerField()
 
     class Meta:
         database = db
         table_name = "comments"
 
     def new(post, author, content, parent=None, time=None, private=False):
-        return Comment.create(
-            post_id=post,
-            author_id=author,
-            content=content,
-            parent_id=parent,
-            time=time if time is not None else datetime.now(),
-            private=private
-        )
+        time = time if time is not None else datetime.now()
+        with db.atomic():
+            c = Comment.create(
+                post_id=post,
+                author_id=author,
+                content=content,
+                parent_id=parent,
+                time=time,
+                private=private
+            )
+            Post.update(
+                num_comments=Post.num_comments + 1,
+                last_activity=fn.GREATEST(Post.last_activity, time)
+            ).where(Post.id == post).execute()
+            User.update(num_comments=User.num_comments + 1).where(User.id == author).execute()
+            ranking.changed(post)
+        return c
+
+    def remove(self):
+        """Soft delete: the comment stays so its replies keep their place."""
+        if self.content == DELETED:
+            return
+        with db.atomic():
+            self.content = DELETED
+            self.save()
+            Post.update(
+                num_comments=Post.num_comments - 1
+            ).where(Post.id == self.post_id_id).execute()
+            User.update(
+                num_comments=User.num_comments - 1
+            ).where(User.id == self.author_id_id).execute()
+            ranking.changed(self.post_id_id)
+
+    def public():
+        return Comment.private == False
 
     def to_flat_dict(self):            
         return {
@@ -183,17 +296,42 @@ class Comment(Model):
         }        
     
     def to_mini_dict(self):
-        return {
-            "id": self.id,
-            "author": self.author_id.nick,
-            "time": self.time.timestamp(),
-            "content": self.content,
-            "children": [c.to_mini_dict() for c in self.children],
-            "private": self.private
-        }        
+        out = tree.node(self)
+        out["children"], _ = tree.load(self.post_id_id, parent=self.id, private=True)
+        return out
 
     def tree_size(self):
-        if len(self.children) == 0:
-            return 1
-        return sum(c.tree_size() for c in self.children)
+        return tree.size(self.id)
+
+class Event(Model):
+    """Outbox row for something that happened, e.g. a new post.
+
+    Written in the same transaction as the change itself; see argot.events.
+    """
+    id = BigAutoField(primary_key=True)
+    kind = TextField()
+    ref_id = IntegerField()
+    time = DateTimeField()
+    available_at = DateTimeField()
+    delivered_at = DateTimeField(null=True)
+    attempts = IntegerField(default=0)
+    error = TextField(null=True)
+
+    class Meta:
+        database = db
+        table_name = "events"
+
+class Notification(Model):
+    """Someone replied to `user_id`'s post or comment with `comment_id`."""
+    id = AutoField(primary_key=True)
+    user_id = ForeignKeyField(User, backref="notifications")
+    comment_id = ForeignKeyField(Comment, backref="notifications")
+    time = DateTimeField()
+    read_at = DateTimeField(null=True)
+
+    class Meta:
+        database = db
+        table_name = "notifications"
+
+from . import tree, serialize, ranking
             
@@ -0,0 +1,69 @@
+"""The Discord bot, which announces new posts in a channel.
+
+It reads "post" events off the outbox (see argot.events), so it doesn't
+need to run inside the web server and doesn't miss anything posted while
+it was down. Run it as its own process:
+
+    python -m argot.manage notifier
+
+async_server.py can also run it on its own loop, when DISCORD_SECRET is
+set. Nothing else imports this module, so web workers never load
+discord.py.
+"""
+import asyncio
+
+import discord
+
+from .models import *
+from . import config, events, serialize
+
+CHANNEL = 1194118320660680846
+
+intents = discord.Intents.default()
+intents.message_content = True
+client = discord.Client(intents=intents)
+
+# @client.event
+# async def on_guild_join(guild):
+#     pass
+
+# @client.event
+# async def on_guild_remove(guild):
+#     pass
+
+def post_to_embed(p):
+    embed = discord.Embed(
+        title=p["title"],
+        url=p["link"],
+        description=f"{p['content']}\n\n[(discuss)](https://argot.jklsnt.com/posts/{p['id']})"
+    )
+    embed.set_author(name=p["author"], url=f"https://argot.jklsnt.com/users/{p['author']}")
+    if len(p["tags"]) != 0:
+        embed.add_field(name="tags", value=", ".join(p["tags"]))
+    return embed
+
+# Discord takes up to 10 embeds per message, so one batch is one message.
+notifier = events.Consumer(["post"], batch=10)
+
+async def notify_people(batch):
+    posts = await notifier.call(serialize.posts, [e.ref_id for e in batch])
+    if len(posts) == 0:
+        return
+    channel = client.get_channel(CHANNEL)
+    await channel.send(embeds=[post_to_embed(p) for p in posts])
+    # discord.py already backs off on 429s; this just keeps us from
+    # running into them in the first place.
+    await asyncio.sleep(1)
+
+@client.event
+async def on_ready():
+    await client.wait_until_ready()
+    if not hasattr(client, "notifier_task"):
+        client.notifier_task = asyncio.create_task(notifier.run(notify_people))
+
+def secret():
+    return config.get("DISCORD_SECRET")
+
+def run():
+    """Run the bot until killed."""
+    client.run(secret())
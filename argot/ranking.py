@@ -0,0 +1,79 @@
+"""The "hot" ordering of the front page, kept up to date in the background.
+
+A post's hotness is
+
+    log10(1 + comments) + seconds since 1970 / HOT_TIMESCALE
+
+so every tenfold in comments is worth HOT_TIMESCALE seconds of being newer
+(12.5 hours by default). Age never has to be applied after the fact: newer
+posts simply start out higher. A post's score only moves when its comment
+count does, so posts.hot is stored, indexed and paged through with a
+(hot, id) keyset just like the newest-first feed.
+
+New posts get their score as they're inserted. Comments only publish a
+"rank" event (in their own transaction, see argot.events) and the ranker
+rescores the posts they're on in batches, so a burst of comments on a
+popular thread turns into one UPDATE instead of a row lock per comment.
+Run it with `python -m argot.manage ranker`; `manage rerank` rescores
+everything, e.g. after changing HOT_TIMESCALE.
+"""
+import asyncio
+import math
+from datetime import datetime
+
+from peewee import *
+from .models import *
+from . import cache, config, events
+
+TIMESCALE = config.get("HOT_TIMESCALE", 45000, float)
+EPOCH = datetime(1970, 1, 1)
+RERANK_BATCH = 10000
+
+def score(comments, time):
+    """Hotness of a post, in Python. Agrees with `expression`."""
+    return math.log10(1 + max(comments, 0)) + (time - EPOCH).total_seconds() / TIMESCALE
+
+def expression():
+    """Hotness of a post, in SQL."""
+    return (fn.log(1 + fn.GREATEST(Post.num_comments, 0)) +
+            fn.date_part("epoch", Post.time) / TIMESCALE)
+
+def changed(post_id):
+    """Queue `post_id` to be rescored. Call inside the transaction that changed it."""
+    events.publish("rank", post_id)
+
+def rescore(post_ids):
+    """Bring the given posts' scores up to date. Returns how many moved."""
+    hot = expression()
+    return (Post
+            .update(hot=hot)
+            .where((Post.id << list(post_ids)) & (Post.hot != hot))
+            .execute())
+
+def rerank(batch=RERANK_BATCH):
+    """Rescore every post, a batch of ids per transaction."""
+    hot = expression()
+    top = Post.select(fn.MAX(Post.id)).scalar() or 0
+    moved = 0
+    for start in range(0, top + 1, batch):
+        with db.atomic():
+            moved += (Post
+                      .update(hot=hot)
+                      .where(Post.id.between(start, start + batch - 1) &
+                             (Post.hot.is_null() | (Post.hot != hot)))
+                      .execute())
+    return moved
+
+# A batch of events can be a lot of comments on a few posts, so take plenty.
+ranker = events.Consumer(["rank"], batch=500, poll=60)
+
+async def handle(batch):
+    moved = await ranker.call(rescore, {e.ref_id for e in batch})
+    if moved != 0:
+        # Only reaches other processes' caches if they share a backend, e.g.
+        # Redis. Otherwise they catch up within RESPONSE_CACHE_TTL.
+        cache.bump("posts")
+
+def run():
+    """The ranker, forever."""
+    asyncio.run(ranker.run(handle))
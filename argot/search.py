@@ -0,0 +1,107 @@
+"""Full-text search over posts and comments.
+
+Both tables carry a stored `search` tsvector that Postgres keeps up to date
+itself (it's a generated column, see migrations/0003_search.sql). Posts weight the title over
+the content over the link. Queries use websearch_to_tsquery, so users can
+write things like `rust -async "error handling"`.
+"""
+from peewee import *
+from .models import *
+from . import serialize, stream
+
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+HEADLINE = "MaxFragments=2, MaxWords=20, MinWords=5, StartSel=<b>, StopSel=</b>"
+
+# (kind, id, rank, document text) for everything matching %(q)s.
+POST_HITS = """
+    SELECT 'post' AS kind, p.id, ts_rank(p.search, q) AS rank,
+           concat_ws(' ', p.title, p.content, p.link) AS doc
+    FROM posts p, websearch_to_tsquery('english', %(q)s) q
+    WHERE p.search @@ q {private}
+"""
+
+COMMENT_HITS = """
+    SELECT 'comment' AS kind, c.id, ts_rank(c.search, q) AS rank,
+           c.content AS doc
+    FROM comments c
+    JOIN posts p ON p.id = c.post_id,
+    websearch_to_tsquery('english', %(q)s) q
+    WHERE c.search @@ q {private}
+"""
+
+PUBLIC_POST = "AND p.private = false"
+PUBLIC_COMMENT = "AND p.private = false AND c.private = false"
+
+def sql(sources, limit, offset):
+    """The ranked query; only rows that come back get snippets. No limit if None."""
+    return f"""
+        WITH hits AS (
+            {" UNION ALL ".join(sources)}
+            ORDER BY rank DESC, id DESC
+            LIMIT {"ALL" if limit is None else "%(limit)s"} OFFSET %(offset)s
+        )
+        SELECT kind, id, rank,
+               ts_headline('english', doc, websearch_to_tsquery('english', %(q)s), %(headline)s)
+        FROM hits
+        ORDER BY rank DESC, id DESC
+    """
+
+def params(term, limit, offset):
+    return {"q": term, "limit": limit, "offset": max(0, offset), "headline": HEADLINE}
+
+def hits(sources, term, limit, offset):
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    return list(db.execute_sql(sql(sources, limit, offset), params(term, limit, offset)))
+
+def sources(kind, private):
+    post = POST_HITS.format(private="" if private else PUBLIC_POST)
+    comment = COMMENT_HITS.format(private="" if private else PUBLIC_COMMENT)
+    return {"posts": [post], "comments": [comment], "everything": [post, comment]}[kind]
+
+def annotate(dicts, rows):
+    by_id = {row[1]: row for row in rows}
+    for d in dicts:
+        d["rank"] = by_id[d["id"]][2]
+        d["snippet"] = by_id[d["id"]][3]
+    return dicts
+
+def post_results(rows):
+    return annotate(serialize.posts([row[1] for row in rows]), rows)
+
+def comment_results(rows):
+    return annotate(serialize.comments([row[1] for row in rows]), rows)
+
+def mixed_results(rows):
+    """Posts and comments ranked against each other, tagged with a "type"."""
+    post_rows = [r for r in rows if r[0] == "post"]
+    comment_rows = [r for r in rows if r[0] == "comment"]
+    found = {}
+    for p in post_results(post_rows):
+        found["post", p["id"]] = p
+    for c in comment_results(comment_rows):
+        found["comment", c["id"]] = c
+
+    return [{"type": kind, **found[kind, id]} for kind, id, _, _ in rows if (kind, id) in found]
+
+RESULTS = {"posts": post_results, "comments": comment_results, "everything": mixed_results}
+
+def run(kind, term, limit=PAGE_SIZE, offset=0, private=False):
+    """One page of results for `kind`: "posts", "comments" or "everything"."""
+    return RESULTS[kind](hits(sources(kind, private), term, limit, offset))
+
+def posts(term, limit=PAGE_SIZE, offset=0, private=False):
+    return run("posts", term, limit, offset, private)
+
+def comments(term, limit=PAGE_SIZE, offset=0, private=False):
+    return run("comments", term, limit, offset, private)
+
+def everything(term, limit=PAGE_SIZE, offset=0, private=False):
+    return run("everything", term, limit, offset, private)
+
+def results(kind, term, offset=0, private=False):
+    """Every result past `offset`, best first, as a stream of lists of dicts."""
+    query = sql(sources(kind, private), None, offset)
+    for rows in stream.raw_batches(query, params(term, None, offset)):
+        yield RESULTS[kind](rows)
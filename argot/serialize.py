@@ -0,0 +1,102 @@
+"""Bulk versions of the to_dict methods on the models.
+
+Each function takes a list of model instances (or plain ids) and returns the
+same dicts the per-instance methods do, but fetches related rows for the
+whole list at once. That keeps the number of queries fixed no matter how
+many rows come back.
+"""
+from collections import defaultdict
+
+from peewee import *
+from .models import *
+
+def _rows(model, items, query):
+    """Turn a mixed list of instances/ids into instances, in the same order."""
+    ids = [i for i in items if not isinstance(i, model)]
+    if len(ids) == 0:
+        return list(items)
+    fetched = {r.id: r for r in query.where(model.id << ids)}
+    out = []
+    for i in items:
+        if isinstance(i, model):
+            out.append(i)
+        elif i in fetched:
+            out.append(fetched[i])
+    return out
+
+def _nicks(rows):
+    """Author nick by user id, skipping rows that already had the author joined in."""
+    nicks = {r.author_id_id: r.author_id.nick for r in rows if "author_id" in r.__rel__}
+    missing = {r.author_id_id for r in rows} - nicks.keys()
+    if len(missing) != 0:
+        nicks.update(User.select(User.id, User.nick).where(User.id << missing).tuples())
+    return nicks
+
+def tag_query(post_ids):
+    """(post id, tag name) for the given posts, in the order they were tagged."""
+    return (TagMap
+            .select(TagMap.post_id, Tag.name)
+            .join(Tag, on=(TagMap.tag_id == Tag.id))
+            .where(TagMap.post_id << post_ids)
+            .order_by(TagMap.id)
+            .tuples())
+
+def group_tags(rows):
+    tags = defaultdict(list)
+    for post_id, name in rows:
+        tags[post_id].append(name)
+    return tags
+
+def _tags(post_ids):
+    if len(post_ids) == 0:
+        return defaultdict(list)
+    return group_tags(tag_query(post_ids))
+
+def post_query():
+    """Posts with their author joined in, ready for `posts`."""
+    return Post.select(Post, User.id, User.nick).join(User, on=(Post.author_id == User.id))
+
+def comment_query():
+    return Comment.select(Comment, User.id, User.nick).join(User, on=(Comment.author_id == User.id))
+
+def post_dict(p, nick, tags):
+    return {
+        "id": p.id,
+        "title": p.title,
+        "link": p.link,
+        "author": nick,
+        "time": p.time.timestamp(),
+        "content": p.content,
+        "num_comments": p.num_comments,
+        "last_activity": (p.last_activity or p.time).timestamp(),
+        "tags": tags,
+        "private": p.private
+    }
+
+def comment_dict(c, nick):
+    return {
+        "id": c.id,
+        "post_id": c.post_id_id,
+        "author": nick,
+        "time": c.time.timestamp(),
+        "content": c.content,
+        "private": c.private
+    }
+
+def posts(items):
+    """Bulk Post.to_dict. At most three queries: posts, authors, tags."""
+    ps = _rows(Post, items, post_query())
+    nicks = _nicks(ps)
+    tags = _tags([p.id for p in ps])
+    return [post_dict(p, nicks[p.author_id_id], tags[p.id]) for p in ps]
+
+def comments(items):
+    """Bulk Comment.to_flat_dict. At most two queries: comments, authors."""
+    cs = _rows(Comment, items, comment_query())
+    nicks = _nicks(cs)
+    return [comment_dict(c, nicks[c.author_id_id]) for c in cs]
+
+def users(items):
+    """Bulk User.to_dict. At most one query."""
+    us = _rows(User, items, User.select())
+    return [u.to_dict() for u in us]
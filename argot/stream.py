@@ -0,0 +1,123 @@
+"""Streaming list responses, for when a client wants everything at once.
+
+List endpoints normally return one page, built as a list and serialized in
+one go. With `?stream=json` (or `?stream=ndjson`, or an Accept header
+asking for application/x-ndjson) they instead walk a server-side cursor
+STREAM_CHUNK rows at a time, serialize each chunk with the bulk
+serializers, and send it off before fetching the next. Memory use is
+bounded by the chunk size, not the result, and the first bytes go out as
+soon as the first chunk is ready.
+
+"json" is a plain JSON array, same as the paged responses. "ndjson" is one
+object per line, which is easier to consume incrementally.
+
+The cursor lives inside a transaction, so a streaming response holds on to
+its database connection until it's done sending.
+"""
+from flask import Response, abort, current_app, make_response, request, stream_with_context
+from playhouse.postgres_ext import ServerSide
+
+from .models import *
+from . import config, wire
+
+CHUNK = config.get("STREAM_CHUNK", 500, int)
+FORMATS = {"json": "application/json", "ndjson": "application/x-ndjson"}
+
+def wanted():
+    """The stream format asked for, or None for a normal paged response."""
+    if "stream" in request.args:
+        fmt = request.args["stream"] or "json"
+        if fmt not in FORMATS:
+            abort(make_response(f"Can't stream as {fmt}, try one of {', '.join(FORMATS)}.", 400))
+        return fmt
+    if request.accept_mimetypes.best == FORMATS["ndjson"]:
+        return "ndjson"
+    return None
+
+def batches(query, size=None):
+    """Rows of a peewee query, `size` at a time, off a server-side cursor."""
+    size = size or CHUNK
+    with db.atomic():
+        batch = []
+        for row in ServerSide(query, array_size=size):
+            batch.append(row)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if len(batch) != 0:
+            yield batch
+
+def raw_batches(sql, params, size=None):
+    """Same as `batches`, for raw SQL. Rows are tuples."""
+    size = size or CHUNK
+    with db.atomic():
+        cursor = db.execute_sql(sql, params, named_cursor=True)
+        try:
+            while True:
+                rows = cursor.fetchmany(size)
+                if len(rows) == 0:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+def dumps(obj):
+    return current_app.json.dumps(obj, separators=(",", ":"))
+
+def encode(chunks, fmt, kind=None):
+    """Turn lists of dicts into text, one string per list.
+
+    For ndjson, `kind` gets added to every object as its "type".
+    """
+    first = True
+    for items in chunks:
+        if len(items) == 0:
+            continue
+        if fmt == "ndjson":
+            if kind is not None:
+                items = [{"type": kind, **item} for item in items]
+            yield "".join(dumps(item) + "\n" for item in items)
+        else:
+            yield ("" if first else ",") + ",".join(dumps(item) for item in items)
+        first = False
+
+def array(chunks, fmt):
+    if fmt == "ndjson":
+        yield from encode(chunks, fmt)
+        return
+    body = encode(chunks, fmt)
+    # Send the bracket along with the first chunk rather than on its own.
+    yield "[" + next(body, "")
+    yield from body
+    yield "]"
+
+def document(head, fields, fmt):
+    """An object made of `head` plus streamed lists.
+
+    `fields` is a list of (key, kind, chunks). As ndjson, that's `head` on
+    the first line, then every item tagged with its kind.
+    """
+    if fmt == "ndjson":
+        yield dumps(head) + "\n"
+        for _, kind, chunks in fields:
+            yield from encode(chunks, fmt, kind)
+        return
+
+    yield dumps(head)[:-1]
+    sep = "," if len(head) != 0 else ""
+    for key, _, chunks in fields:
+        yield f"{sep}{dumps(key)}:["
+        yield from encode(chunks, fmt)
+        yield "]"
+        sep = ","
+    yield "}"
+
+def respond(body, fmt, status=200):
+    """A chunked response for the strings `body` yields, compressed as it
+    goes if the client takes that."""
+    headers = {"Vary": "Accept-Encoding"}
+    enc = wire.encoding(request.headers.get("Accept-Encoding"))
+    if enc is not None:
+        body = wire.compress_chunks(body, enc)
+        headers["Content-Encoding"] = enc
+    return Response(stream_with_context(body), status=status, mimetype=FORMATS[fmt], headers=headers)
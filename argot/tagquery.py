@@ -0,0 +1,210 @@
+"""Tag expressions for /posts/query, e.g. `(rust|go)+tutorial-video`.
+
+    a+b     posts tagged both a and b
+    a|b     posts tagged a or b (or both)
+    a-b     posts tagged a but not b
+    -a, !a  posts not tagged a
+    (...)   grouping
+
+`-` binds loosest and `+` tightest, so `a|b-c` is `(a|b)-c` and `a+b|c` is
+`(a+b)|c`, which keeps the meaning of the old `a+b-c` style queries.
+
+Queries are capped at MAX_TAGS tags and MAX_DEPTH levels of parentheses
+and negation, which keeps the parser and the SQL it builds well clear of
+Python's recursion limit.
+
+Expressions parse into little tuples -- ("tag", name), ("and", l, r),
+("or", l, r), ("not", x) -- that compile into a single WHERE clause over
+tagmaps, or get evaluated against the in-process bitmap index if it's on.
+"""
+import re
+import threading
+import time
+from collections import defaultdict
+
+from peewee import *
+from .models import *
+from . import config, feed
+
+class ParseError(ValueError):
+    pass
+
+TOKEN = re.compile(r"\s*(?:(\w+)|(.))")
+MAX_LENGTH = 1000
+MAX_TAGS = 32
+MAX_DEPTH = 16
+
+def tokenize(text):
+    out = []
+    for name, op in TOKEN.findall(text):
+        if name:
+            out.append(("tag", name))
+        elif op.strip():
+            if op not in "+|-!()":
+                raise ParseError(f"Unexpected character '{op}'.")
+            out.append((op, op))
+    return out
+
+def parse(text):
+    """Parse an expression into a tree of tuples, or raise ParseError."""
+    if len(text) > MAX_LENGTH:
+        raise ParseError(f"Query too long, the most is {MAX_LENGTH} characters.")
+    tokens = tokenize(text)
+    if sum(1 for kind, _ in tokens if kind == "tag") > MAX_TAGS:
+        raise ParseError(f"Too many tags, the most is {MAX_TAGS}.")
+    pos = 0
+    depth = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def take(kind):
+        nonlocal pos
+        if peek() != kind:
+            got = "end of query" if peek() is None else f"'{tokens[pos][1]}'"
+            raise ParseError(f"Expected {'a tag' if kind == 'tag' else repr(kind)}, got {got}.")
+        pos += 1
+        return tokens[pos - 1]
+
+    def difference():
+        node = union()
+        while peek() == "-":
+            take("-")
+            node = ("and", node, ("not", union()))
+        return node
+
+    def union():
+        node = intersection()
+        while peek() == "|":
+            take("|")
+            node = ("or", node, intersection())
+        return node
+
+    def intersection():
+        node = unary()
+        while peek() == "+":
+            take("+")
+            node = ("and", node, unary())
+        return node
+
+    def unary():
+        nonlocal depth
+        if peek() not in ("-", "!", "("):
+            return ("tag", take("tag")[1])
+        depth += 1
+        if depth > MAX_DEPTH:
+            raise ParseError(f"Nested too deeply, the most is {MAX_DEPTH} levels.")
+        if peek() == "(":
+            take("(")
+            node = difference()
+            take(")")
+        else:
+            take(peek())
+            node = ("not", unary())
+        depth -= 1
+        return node
+
+    if len(tokens) == 0:
+        raise ParseError("Empty query.")
+    node = difference()
+    if pos != len(tokens):
+        raise ParseError(f"Unexpected '{tokens[pos][1]}'.")
+    return node
+
+def to_sql(node):
+    """Turn a parsed expression into a peewee expression over Post."""
+    kind = node[0]
+    if kind == "tag":
+        tagged = (TagMap
+                  .select(TagMap.post_id)
+                  .join(Tag, on=(TagMap.tag_id == Tag.id))
+                  .where(Tag.name == node[1]))
+        return Post.id << tagged
+    if kind == "not":
+        return ~to_sql(node[1])
+    if kind == "and":
+        return to_sql(node[1]) & to_sql(node[2])
+    return to_sql(node[1]) | to_sql(node[2])
+
+class TagIndex:
+    """Tag name -> bitmap of post ids, kept in memory.
+
+    Evaluating an expression is then a handful of big-int ands/ors. Each
+    worker keeps its own copy, so writes from this process invalidate it
+    right away and writes from elsewhere show up after `ttl` seconds.
+    """
+    # Past this many matches, an IN list stops being worth it and we let
+    # Postgres do the work instead.
+    MAX_IDS = 5000
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.built = None
+        self.bits = {}
+        self.universe = 0
+
+    def invalidate(self):
+        self.built = None
+
+    def refresh(self):
+        with self.lock:
+            if self.built is not None and time.monotonic() - self.built < self.ttl:
+                return
+            def bitmap(ids):
+                buf = bytearray()
+                for i in ids:
+                    if i // 8 >= len(buf):
+                        buf.extend(bytes(i // 8 - len(buf) + 1))
+                    buf[i // 8] |= 1 << (i % 8)
+                return int.from_bytes(buf, "little")
+
+            by_tag = defaultdict(list)
+            tq = (TagMap
+                  .select(Tag.name, TagMap.post_id)
+                  .join(Tag, on=(TagMap.tag_id == Tag.id))
+                  .tuples())
+            for name, post_id in tq:
+                by_tag[name].append(post_id)
+
+            self.universe = bitmap(id for id, in Post.select(Post.id).tuples())
+            self.bits = {name: bitmap(ids) for name, ids in by_tag.items()}
+            self.built = time.monotonic()
+
+    def evaluate(self, node):
+        kind = node[0]
+        if kind == "tag":
+            return self.bits.get(node[1], 0)
+        if kind == "not":
+            return self.universe & ~self.evaluate(node[1])
+        if kind == "and":
+            return self.evaluate(node[1]) & self.evaluate(node[2])
+        return self.evaluate(node[1]) | self.evaluate(node[2])
+
+    def ids(self, node):
+        """Matching post ids, or None if there are too many to bother."""
+        self.refresh()
+        bits = self.evaluate(node)
+        if bits.bit_count() > self.MAX_IDS:
+            return None
+        digits = bin(bits)[:1:-1]
+        return [i for i, d in enumerate(digits) if d == "1"]
+
+index = TagIndex(ttl=config.get("TAG_INDEX_TTL", 60, int)) if config.flag("TAG_INDEX") else None
+
+def changed():
+    """Call after anything that adds or removes posts or tagmaps."""
+    if index is not None:
+        index.invalidate()
+
+def where(node):
+    """Where-clause for posts matching a parsed expression."""
+    if index is not None:
+        ids = index.ids(node)
+        if ids is not None:
+            return Post.id << ids
+    return to_sql(node)
+
+def query(node, after=None, pg=0, limit=feed.PAGE_SIZE, private=False, sort="new"):
+    """One page of posts matching a parsed expression, like feed.latest."""
+    return feed.latest(after=after, pg=pg, limit=limit, private=private, where=where(node), sort=sort)
@@ -0,0 +1,165 @@
+"""Background fetching of page titles for posts submitted without one.
+
+Only the start of the page gets read: we stop at </head>, at <body>, or
+after TITLE_MAX_BYTES, whichever comes first. Connecting and each read have
+their own timeouts, and the whole fetch has a deadline so a server
+trickling bytes can't hold a worker forever. Results (including failures)
+are cached per URL in a small LRU with a TTL.
+"""
+import codecs
+import http.client
+import ssl
+import time
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+from . import config, metrics
+from .lru import Cache
+
+CONNECT_TIMEOUT = config.get("TITLE_CONNECT_TIMEOUT", 3.0, float)
+READ_TIMEOUT = config.get("TITLE_READ_TIMEOUT", 5.0, float)
+DEADLINE = config.get("TITLE_DEADLINE", 10.0, float)
+MAX_BYTES = config.get("TITLE_MAX_BYTES", 64 * 1024, int)
+MAX_REDIRECTS = 5
+CHUNK = 4096
+USER_AGENT = "argot (+https://argot.jklsnt.com)"
+
+class HeadParser(HTMLParser):
+    """Picks the title and description out of a document's <head>.
+
+    Fed incrementally; `done` flips once there's nothing more worth reading.
+    """
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.meta = {}
+        self.in_title = False
+        self.title = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "title":
+            self.in_title = True
+        elif tag == "meta":
+            key = attrs.get("property") or attrs.get("name")
+            if key in ("og:title", "og:description", "description") and attrs.get("content"):
+                self.meta.setdefault(key, attrs["content"].strip())
+        elif tag == "body":
+            self.done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self.in_title = False
+        elif tag == "head":
+            self.done = True
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title.append(data)
+
+    def result(self):
+        title = " ".join("".join(self.title).split()) or self.meta.get("og:title")
+        return {
+            "title": title or None,
+            "description": self.meta.get("og:description") or self.meta.get("description"),
+        }
+
+def open_url(url, deadline):
+    """GET a URL following redirects; returns the connection and the response."""
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Can't fetch {url}")
+        if parts.scheme == "https":
+            conn = http.client.HTTPSConnection(
+                parts.hostname, parts.port, timeout=CONNECT_TIMEOUT,
+                context=ssl.create_default_context()
+            )
+        else:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=CONNECT_TIMEOUT)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        conn.connect()
+        conn.sock.settimeout(READ_TIMEOUT)
+        conn.request("GET", path, headers={
+            "User-Agent": USER_AGENT,
+            "Accept": "text/html,application/xhtml+xml",
+        })
+        resp = conn.getresponse()
+        if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+            url = urljoin(url, resp.getheader("Location"))
+            conn.close()
+            if time.monotonic() > deadline:
+                raise TimeoutError(url)
+            continue
+        return conn, resp
+    raise ValueError(f"Too many redirects for {url}")
+
+def fetch(url):
+    """Title and description of the page at `url`. Values are None if unknown.
+
+    Raises on network errors, bad statuses and non-HTML responses.
+    """
+    deadline = time.monotonic() + DEADLINE
+    conn, resp = open_url(url, deadline)
+    try:
+        if resp.status != 200:
+            raise ValueError(f"{url} returned {resp.status}")
+        kind = resp.getheader("Content-Type", "text/html")
+        if "html" not in kind:
+            raise ValueError(f"{url} isn't HTML ({kind})")
+        charset = resp.headers.get_content_charset() or "utf-8"
+        try:
+            decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+        except LookupError:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        parser = HeadParser()
+        read = 0
+        while not parser.done and read < MAX_BYTES:
+            if time.monotonic() > deadline:
+                raise TimeoutError(url)
+            chunk = resp.read1(min(CHUNK, MAX_BYTES - read))
+            if not chunk:
+                break
+            read += len(chunk)
+            parser.feed(decoder.decode(chunk))
+        return parser.result()
+    finally:
+        conn.close()
+
+cache = Cache(config.get("TITLE_CACHE_SIZE", 1024, int), config.get("TITLE_CACHE_TTL", 3600, int))
+# Failures are cached too, but not for as long.
+FAILURE_TTL = 60
+
+executor = ThreadPoolExecutor(max_workers=config.get("TITLE_WORKERS", 4, int), thread_name_prefix="titles")
+
+def lookup(url):
+    """fetch() through the cache. Never raises; failures give all-None values."""
+    hit = cache.get(url)
+    if hit is not None:
+        return hit
+    try:
+        meta = fetch(url)
+        cache.put(url, meta)
+    except Exception as e:
+        metrics.log(event="title_fetch_failed", url=url, error=str(e))
+        meta = {"title": None, "description": None}
+        cache.put(url, meta, ttl=FAILURE_TTL)
+    return meta
+
+def fetch_later(url, done):
+    """Look `url` up on a worker thread and call done(meta) with the result.
+
+    `done` always runs on the worker, even for cache hits, so it never has
+    to worry about which thread it's on.
+    """
+    def job():
+        try:
+            done(lookup(url))
+        except Exception as e:
+            metrics.log(event="title_callback_failed", url=url, error=str(e))
+    executor.submit(job)
@@ -0,0 +1,178 @@
+from collections import defaultdict, deque
+
+from peewee import *
+from .models import *
+
+def node(c):
+    return {
+        "id": c.id,
+        "author": c.author_id.nick,
+        "time": c.time.timestamp(),
+        "content": c.content,
+        "children": [],
+        "private": c.private
+    }
+
+def comment_query(where, private):
+    """Comments matching `where` with their authors' nicks, oldest first."""
+    cs = (Comment
+          .select(Comment, User.id, User.nick)
+          .join(User, on=(Comment.author_id == User.id))
+          .where(where)
+          .order_by(Comment.time, Comment.id))
+    if not private:
+        # Private comments take their replies down with them, since nothing
+        # will point at the replies' parent.
+        cs = cs.where(Comment.public())
+    return cs
+
+def group(cs):
+    """Comments by the id of the comment they reply to (None for top-level)."""
+    kids = defaultdict(list)
+    for c in cs:
+        kids[c.parent_id_id].append(c)
+    return kids
+
+def fetch(where, private):
+    return group(comment_query(where, private))
+
+# Most comments one request can ask for with `limit`.
+MAX_LIMIT = 1000
+
+# Bigger than any comment id, so path || LAST sorts after everything
+# in that path's subtree.
+LAST = 2 ** 31 - 1
+
+def subtree(comment_id):
+    """A comment and everything under it.
+
+    Paths compare element by element, so a subtree is one contiguous range
+    of the path index: from the comment's own path up to path || LAST. The
+    bounds are plain SQL because peewee takes longer to build them as
+    subqueries than Postgres takes to run the whole thing.
+    """
+    path = SQL("(SELECT path FROM comments WHERE id = %s)", [comment_id])
+    end = SQL("(SELECT path || %s FROM comments WHERE id = %s)", [LAST, comment_id])
+    return (Comment.path >= path) & (Comment.path < end)
+
+def public_path(comment_id):
+    """True if neither the comment nor anything it's replying to is private."""
+    return SQL(
+        "NOT EXISTS (SELECT 1 FROM comments WHERE private AND "
+        "id = ANY((SELECT path FROM comments WHERE id = %s)::INTEGER[]))",
+        [comment_id]
+    )
+
+def below(parent, depth):
+    """`parent`'s subtree, at most `depth` + 1 levels down.
+
+    The extra level is there so the cut off replies can be counted.
+    """
+    where = subtree(parent)
+    if depth is not None:
+        where &= Comment.depth <= SQL("(SELECT depth + %s FROM comments WHERE id = %s)", [depth + 1, parent])
+    return where
+
+def stitch(kids, top, depth=None, limit=None):
+    # Breadth first, so that a size limit trims the deepest replies rather
+    # than whole top-level threads.
+    budget = limit
+    root = {"children": []}
+    queue = deque([(root, top, 1)])
+    while len(queue) != 0:
+        owner, siblings, d = queue.popleft()
+        if depth is not None and d > depth:
+            owner["more"] = len(siblings)
+            continue
+        for i, c in enumerate(siblings):
+            if budget == 0:
+                owner["more"] = len(siblings) - i
+                break
+            n = node(c)
+            owner["children"].append(n)
+            if budget is not None:
+                budget -= 1
+            if len(kids[c.id]) != 0:
+                queue.append((n, kids[c.id], d + 1))
+
+    return root["children"], root.get("more", 0)
+
+def load(post_id, parent=None, after=None, private=False, depth=None, limit=None):
+    """Nested comment dicts (same shape as Comment.to_mini_dict) for a post.
+
+    Grabs the comments and their authors' nicks in a single query and
+    stitches the tree together in memory. With `parent` you get that
+    comment's replies instead of the top-level comments, and `after` skips
+    siblings up to and including that comment id.
+
+    `depth` and `limit` cap how deep and how many comments get returned.
+    Anything cut off shows up as a "more" count on the comment whose replies
+    were truncated; load those with parent=<that comment's id> and
+    after=<the id of the last reply you got>. Returns the comments and the
+    "more" count for the level you asked for.
+    """
+    kids = fetch(scope(post_id, parent, depth, private), private)
+    return stitch(kids, pick(kids, parent, after), depth, limit)
+
+def scope(post_id, parent=None, depth=None, private=False):
+    """Where-clause for what load() needs to look at."""
+    if parent is not None:
+        # Just the subtree, off the path index. The post doesn't narrow it
+        # down any further, but it keeps the planner's row estimate sane.
+        where = (Comment.post_id == post_id) & below(parent, depth)
+        if not private:
+            # The replies to a private comment are gone along with it, even
+            # when they're asked for by the parent's id.
+            where &= public_path(parent)
+        return where
+    where = Comment.post_id == post_id
+    if depth is not None:
+        where &= Comment.depth <= depth
+    return where
+
+def pick(kids, parent=None, after=None):
+    """The replies to `parent` (or the top-level comments), past `after`."""
+    top = kids[parent]
+    if after is not None:
+        ids = [c.id for c in top]
+        top = top[ids.index(after) + 1:] if after in ids else []
+    return top
+
+def context(comment_id, private=False, depth=None, limit=None):
+    """A comment with the chain of comments it's replying to, in one query.
+
+    Returns the post's id and a list holding the top-level comment, whose
+    only child is the next comment down the chain, and so on down to the
+    comment itself, which gets its replies like load() would. None if
+    there's no such comment or some of the chain is private.
+    """
+    return thread(fetch(lineage(comment_id, depth), private), comment_id, depth, limit)
+
+def lineage(comment_id, depth=None):
+    """Where-clause for a comment, its ancestors, and its replies."""
+    # = ANY of the path rather than IN, so both halves come off an index.
+    path = SQL("(SELECT path FROM comments WHERE id = %s)::INTEGER[]", [comment_id])
+    ancestors = Comment.id == fn.ANY(path)
+    return ancestors | below(comment_id, depth)
+
+def thread(kids, comment_id, depth=None, limit=None):
+    """What context() returns, out of the comments lineage() matched."""
+    chain = kids[None]
+    root = {"children": []}
+    owner = root
+    while len(chain) == 1:
+        c = chain[0]
+        n = node(c)
+        owner["children"].append(n)
+        if c.id == comment_id:
+            n["children"], more = stitch(kids, kids[c.id], depth, limit)
+            if more != 0:
+                n["more"] = more
+            return c.post_id_id, root["children"]
+        owner = n
+        chain = kids[c.id]
+    return None
+
+def size(comment_id):
+    """Number of comments in the subtree rooted at a comment, itself included."""
+    return Comment.select().where(subtree(comment_id)).count()
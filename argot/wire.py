@@ -0,0 +1,155 @@
+"""What goes over the wire: JSON or MessagePack, compressed or not.
+
+Views keep returning dicts and lists. `init_app` swaps in a JSON provider
+that turns them into the format the client's Accept header asks for --
+application/msgpack if the msgpack package is installed, JSON otherwise --
+and compresses anything over COMPRESS_MIN_SIZE bytes with whatever the
+Accept-Encoding header allows: brotli if the brotli package is installed,
+then gzip. Smaller than that isn't worth the CPU.
+
+JSON goes through orjson when it's installed, which is several times
+faster than the json module, and sends non-ASCII text as UTF-8 rather than
+\\u escapes either way. Keys are still sorted, same as Flask does, so the
+same data always comes out as the same bytes (and the same ETag).
+
+async_server.py uses `negotiate`, `encode` and `compress` directly, so both
+servers send the same thing.
+"""
+import json
+import zlib
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from . import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# Worth compressing; the rest (images, 304s, ...) isn't or can't be.
+COMPRESSIBLE = {JSON, MSGPACK, "application/x-ndjson", "text/plain", "text/html"}
+
+MIN_SIZE = config.get("COMPRESS_MIN_SIZE", 1024, int)
+GZIP_LEVEL = config.get("COMPRESS_GZIP_LEVEL", 5, int)
+BROTLI_QUALITY = config.get("COMPRESS_BROTLI_QUALITY", 4, int)
+
+FORMATS = [JSON] + ([MSGPACK] if msgpack else [])
+ENCODINGS = (["br"] if brotli else []) + ["gzip"]
+
+# Dates and such, the way Flask would send them.
+default = DefaultJSONProvider.default
+
+def dumps(obj, sort_keys=True):
+    """Compact JSON, as bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=(
+            orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            | (orjson.OPT_SORT_KEYS if sort_keys else 0)))
+    return json.dumps(obj, default=default, sort_keys=sort_keys, separators=(",", ":"),
+                      ensure_ascii=False).encode()
+
+def encode(obj, fmt=JSON):
+    if fmt == MSGPACK:
+        return msgpack.packb(obj, default=default)
+    return dumps(obj) + b"\n"
+
+def negotiate(accept):
+    """The format to answer an Accept header with."""
+    if accept is None or msgpack is None:
+        return JSON
+    return parse_accept_header(accept, MIMEAccept).best_match(FORMATS, default=JSON)
+
+def encoding(accept_encoding):
+    """The Content-Encoding to answer an Accept-Encoding header with, or None."""
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding).best_match(ENCODINGS)
+
+def compressor(encoding):
+    """(compress, flush, finish) for a streamed body."""
+    if encoding == "br":
+        c = brotli.Compressor(quality=BROTLI_QUALITY)
+        return c.process, c.flush, c.finish
+    # gzip framing, no file name or mtime, so the output's the same every time.
+    z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return z.compress, lambda: z.flush(zlib.Z_SYNC_FLUSH), z.flush
+
+def compress(body, encoding):
+    put, _, finish = compressor(encoding)
+    return put(body) + finish()
+
+def compress_chunks(chunks, encoding):
+    """Compress a streamed body, flushing after every chunk so nothing sits
+    in the compressor waiting for the next one."""
+    put, flush, finish = compressor(encoding)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        out = put(chunk) + flush()
+        if len(out) != 0:
+            yield out
+    yield finish()
+
+def wants_compressing(status, mimetype, size):
+    return status == 200 and mimetype in COMPRESSIBLE and size >= MIN_SIZE
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's provider, but with orjson underneath and MessagePack for
+    clients that ask for it."""
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and kwargs.keys() <= {"separators"}:
+            return dumps(obj, self.sort_keys).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and len(kwargs) == 0:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        fmt = negotiate(request.headers.get("Accept"))
+        if fmt == JSON and (self.compact is False or (self.compact is None and self._app.debug)):
+            # Pretty printed for debugging, leave it to Flask.
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        resp = self._app.response_class(encode(obj, fmt), mimetype=fmt)
+        if msgpack is not None:
+            resp.vary.add("Accept")
+        return resp
+
+def compress_response(resp):
+    """after_request: compress the body if it's big enough and the client
+    takes it. Streamed responses compress themselves, see argot.stream."""
+    if resp.direct_passthrough or resp.is_streamed or "Content-Encoding" in resp.headers:
+        return resp
+    if resp.mimetype in COMPRESSIBLE:
+        resp.vary.add("Accept-Encoding")
+    if not wants_compressing(resp.status_code, resp.mimetype, resp.content_length or 0):
+        return resp
+    enc = encoding(request.headers.get("Accept-Encoding"))
+    if enc is None:
+        return resp
+    resp.set_data(compress(resp.get_data(), enc))
+    resp.headers["Content-Encoding"] = enc
+    return resp
+
+def init_app(app):
+    app.json = JSONProvider(app)
+    app.after_request(compress_response)
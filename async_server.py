@@ -0,0 +1,403 @@
+"""Async serving mode: one event loop for the web server, the bot and the ranker.
+
+    python async_server.py [--host H] [--port P] [--threads N] [--reuse-port]
+
+The read-heavy routes (the front page, threads, comments, tags, and the
+inbox size that clients keep polling) are answered on the loop itself,
+with their queries going through argot.adb, so a request waiting on
+Postgres doesn't tie up a thread. Everything else
+-- writes, logins, search, streamed responses -- is handed to the Flask
+app in server.py on a pool of --threads threads, and behaves exactly as it
+does under a WSGI server. The ranker runs as a task on the same loop, and
+so does the Discord bot (see argot.notifier) if DISCORD_SECRET is set.
+
+Live updates are only served here, since every client holds a connection
+open: /live is a Server-Sent Events stream of new posts and comments, and
+/live/posts/<id> of new comments on one post. See argot.live.
+
+The web server is aiohttp's, which discord.py already depends on.
+--reuse-port lets several of these share a port, one per core.
+"""
+import argparse
+import asyncio
+import io
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+
+from aiohttp import web
+
+import server
+from argot.models import *
+from argot import adb, config, feed, live, lookup, metrics, ranking, serialize, tree, wire
+
+flask = server.app
+
+def json(request, obj, headers=None):
+    """`obj` encoded and compressed the way the request asks, which is byte
+    for byte what Flask would send (see argot.wire)."""
+    fmt = wire.negotiate(request.headers.get("Accept"))
+    body = wire.encode(obj, fmt)
+    headers = {**(headers or {}), "Vary": "Accept, Accept-Encoding" if wire.msgpack else "Accept-Encoding"}
+    if wire.wants_compressing(200, fmt, len(body)):
+        enc = wire.encoding(request.headers.get("Accept-Encoding"))
+        if enc is not None:
+            body = wire.compress(body, enc)
+            headers["Content-Encoding"] = enc
+    return web.Response(body=body, content_type=fmt, headers=headers)
+
+def text(body, status):
+    return web.Response(text=body, status=status, content_type="text/html")
+
+def not_found(model, id):
+    return text(f"A {lookup.NAMES[model]} with the ID {id} does not exist!", 404)
+
+class BadRequest(Exception):
+    pass
+
+def ints(values, names):
+    """The `names` present in `values`, as ints."""
+    try:
+        return {k: int(values[k]) for k in names if k in values}
+    except ValueError:
+        raise BadRequest()
+
+def thread_args(values, names):
+    """ints() for the comment tree routes, with ThreadQuerySchema's bounds."""
+    args = ints(values, names)
+    if "limit" in args and not 1 <= args["limit"] <= tree.MAX_LIMIT:
+        raise BadRequest()
+    return args
+
+def user_id(request):
+    """The logged-in user's id from the session cookie, if there is one."""
+    session = flask.session_interface.open_session(flask, request)
+    if session is None or "_user_id" not in session:
+        return None
+    return int(session["_user_id"])
+
+def logged_in(request):
+    """Whether Flask-Login would find a user, or None if only Flask can tell."""
+    if user_id(request) is not None:
+        return True
+    if "remember_token" in request.cookies:
+        # An expired session that Flask-Login would bring back to life.
+        return None
+    return False
+
+def wants_stream(request):
+    return "stream" in request.query or "application/x-ndjson" in request.headers.get("Accept", "")
+
+# (Flask-style rule, handler) for every route served on the loop.
+ROUTES = []
+
+def reads(rule):
+    """Register an async view. It gets the request and whether the user's
+    logged in, and hands the request on to Flask when it'd have to stream."""
+    def register(handler):
+        async def view(request):
+            private = logged_in(request)
+            if private is None or wants_stream(request):
+                return await wsgi(request)
+            start = time.perf_counter()
+            try:
+                response = await handler(request, private)
+            except BadRequest:
+                response = text("Type check failed!", 400)
+            took = time.perf_counter() - start
+            metrics.latency.observe(f'route="{rule}",method="GET",status="{response.status}"', took)
+            if metrics.REQUEST_LOG:
+                metrics.log(event="request", method="GET", route=rule, path=request.path,
+                            status=response.status, ms=round(took * 1000, 2), mode="async")
+            return response
+        ROUTES.append((rule, view))
+        return handler
+    return register
+
+@reads("/posts")
+async def get_posts(request, private):
+    args = ints(request.query, ["pg", "limit"])
+    sort = request.query.get("sort", "new")
+    if sort not in feed.SORTS:
+        return text(f"Can't sort by {sort}.", 400)
+    after = None
+    if "after" in request.query:
+        after = feed.decode_cursor(request.query["after"], sort)
+        if after is None:
+            return text("Bad cursor!", 400)
+
+    limit = feed.clamp(args.get("limit", feed.PAGE_SIZE))
+    rows = await adb.run(feed.page_query(after, args.get("pg", 0), limit, private, sort=sort))
+    ps, cursor = feed.cut(rows, limit, sort)
+    headers = {"X-Next-Cursor": cursor} if cursor is not None else {}
+    return json(request, await adb.posts(ps), headers)
+
+@reads("/posts/<post_id>")
+async def get_post(request, private):
+    post_id = ints(request.match_info, ["post_id"])["post_id"]
+    args = thread_args(request.query, ["depth", "limit"])
+    depth = args.get("depth")
+
+    # The post and its comments at the same time; the comments get thrown
+    # away if the post turns out to be off limits.
+    ps, cs = await asyncio.gather(
+        adb.run(serialize.post_query().where(Post.id == post_id)),
+        adb.run(tree.comment_query(tree.scope(post_id, depth=depth), private)),
+    )
+    if len(ps) == 0 or (ps[0].private == True and not private):
+        return not_found(Post, post_id)
+    p = (await adb.posts(ps))[0]
+    kids = tree.group(cs)
+    p["comments"], p["more"] = tree.stitch(kids, tree.pick(kids), depth, args.get("limit"))
+    return json(request, p)
+
+@reads("/posts/<post_id>/comments")
+async def get_post_comments(request, private):
+    post_id = ints(request.match_info, ["post_id"])["post_id"]
+    args = thread_args(request.query, ["parent", "after", "depth", "limit"])
+    parent, depth = args.get("parent"), args.get("depth")
+
+    ps, cs = await asyncio.gather(
+        adb.run(Post.select(Post.private).where(Post.id == post_id)),
+        adb.run(tree.comment_query(tree.scope(post_id, parent, depth, private), private)),
+    )
+    if len(ps) == 0 or (ps[0].private == True and not private):
+        return not_found(Post, post_id)
+    kids = tree.group(cs)
+    top = tree.pick(kids, parent, args.get("after"))
+    cs, more = tree.stitch(kids, top, depth, args.get("limit"))
+    return json(request, {"comments": cs, "more": more})
+
+@reads("/comments/<comment_id>")
+async def get_comment(request, private):
+    comment_id = ints(request.match_info, ["comment_id"])["comment_id"]
+    cs = await adb.run(serialize.comment_query().where(Comment.id == comment_id))
+    if len(cs) == 0 or (cs[0].private == True and not private):
+        return not_found(Comment, comment_id)
+    if not private and await adb.scalar(Post.select(Post.private).where(Post.id == cs[0].post_id_id)):
+        return not_found(Comment, comment_id)
+    return json(request, serialize.comment_dict(cs[0], cs[0].author_id.nick))
+
+@reads("/comments/<comment_id>/context")
+async def get_comment_context(request, private):
+    comment_id = ints(request.match_info, ["comment_id"])["comment_id"]
+    args = thread_args(request.query, ["depth", "limit"])
+    cs = await adb.run(tree.comment_query(tree.lineage(comment_id, args.get("depth")), private))
+    found = tree.thread(tree.group(cs), comment_id, args.get("depth"), args.get("limit"))
+    if found is None:
+        return not_found(Comment, comment_id)
+    post_id, cs = found
+    if await adb.scalar(Post.select(Post.private).where(Post.id == post_id)) and not private:
+        return not_found(Comment, comment_id)
+    return json(request, {"post": post_id, "comments": cs})
+
+@reads("/tags")
+async def get_tags(request, private):
+    return json(request, [{"name": t.name, "id": t.id} for t in await adb.run(Tag.select())])
+
+@reads("/inbox/size")
+async def get_inbox_size(request, private):
+    # Polled all the time by logged-in clients, so worth keeping off the threads.
+    if not private:
+        # The 401 is Flask-Login's to give.
+        return await wsgi(request)
+    size = await adb.scalar(User.select(User.unread).where(User.id == user_id(request)))
+    if size is None:
+        return await wsgi(request)
+    return json(request, {"size": size})
+
+async def subscribe(request, topic):
+    """An event stream of `topic`'s deltas, see argot.live."""
+    last = request.headers.get("Last-Event-ID", request.query.get("last_event_id"))
+    if last is not None:
+        try:
+            last = int(last)
+        except ValueError:
+            return text("Bad event id!", 400)
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        # Don't let a proxy sit on the events.
+        "X-Accel-Buffering": "no",
+    })
+    await response.prepare(request)
+    with live.hub.subscribe(topic, logged_in(request) == True, last) as (backlog, sub):
+        await response.write(b"retry: 3000\n\n" + (live.RESET if backlog is None else b"".join(backlog)))
+        while True:
+            try:
+                chunk = await asyncio.wait_for(sub.queue.get(), live.HEARTBEAT)
+            except asyncio.TimeoutError:
+                chunk = live.PING
+            if chunk is None:
+                break
+            try:
+                await response.write(chunk)
+            except ConnectionError:
+                break
+    return response
+
+async def get_live(request):
+    return await subscribe(request, "posts")
+
+async def get_live_post(request):
+    try:
+        post_id = int(request.match_info["post_id"])
+    except ValueError:
+        return text("Type check failed!", 400)
+    private = await adb.scalar(Post.select(Post.private).where(Post.id == post_id))
+    if private is None or (private and logged_in(request) != True):
+        return not_found(Post, post_id)
+    return await subscribe(request, f"post:{post_id}")
+
+# Flask runs on these. Each request keeps one thread from start to finish,
+# since peewee's connections (and stream_with_context) belong to a thread.
+threads = None
+
+def serve(environ, out, loop, gone):
+    """Run one request through Flask, on a pool thread.
+
+    Puts (status, headers), then each chunk of the body, then None on `out`.
+    Stops early if `gone` gets set, i.e. the client went away.
+    """
+    def put(item):
+        asyncio.run_coroutine_threadsafe(out.put(item), loop).result()
+
+    head = None
+    def start_response(status, headers, exc_info=None):
+        nonlocal head
+        head = (status, headers)
+
+    body = flask(environ, start_response)
+    try:
+        sent = False
+        for chunk in body:
+            if not sent:
+                put(head)
+                sent = True
+            if gone.is_set():
+                break
+            if len(chunk) != 0:
+                put(chunk)
+        if not sent:
+            put(head)
+    finally:
+        if hasattr(body, "close"):
+            body.close()
+        put(None)
+
+def environ_for(request, body):
+    path = request.raw_path.split("?", 1)[0]
+    host, _, port = request.host.partition(":")
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote(path, encoding="latin-1"),
+        "QUERY_STRING": request.query_string,
+        "SERVER_NAME": host,
+        "SERVER_PORT": port or ("443" if request.secure else "80"),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for key, value in request.headers.items():
+        if key.lower() == "content-type":
+            environ["CONTENT_TYPE"] = value
+        elif key.lower() == "content-length":
+            environ["CONTENT_LENGTH"] = value
+        else:
+            name = "HTTP_" + key.upper().replace("-", "_")
+            environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+async def wsgi(request):
+    """Hand a request to the Flask app, and stream back what it says."""
+    loop = asyncio.get_running_loop()
+    environ = environ_for(request, await request.read())
+    out = asyncio.Queue(maxsize=8)
+    gone = threading.Event()
+    done = loop.run_in_executor(threads, serve, environ, out, loop, gone)
+
+    try:
+        head = await out.get()
+        if head is None:
+            return text("Internal Server Error", 500)
+        status, headers = head
+        code, _, reason = status.partition(" ")
+        response = web.StreamResponse(status=int(code), reason=reason)
+        for key, value in headers:
+            response.headers.add(key, value)
+        await response.prepare(request)
+        while (chunk := await out.get()) is not None:
+            await response.write(chunk)
+        await response.write_eof()
+        await done
+        return response
+    finally:
+        if not done.done():
+            # The client went away, or we did. Let the thread wind down
+            # rather than leave it blocked on a full queue.
+            gone.set()
+            asyncio.ensure_future(drain(out, done))
+
+async def drain(out, done):
+    while not done.done():
+        get = asyncio.ensure_future(out.get())
+        await asyncio.wait({get, done}, return_when=asyncio.FIRST_COMPLETED)
+        get.cancel()
+
+async def fallback(request):
+    return await wsgi(request)
+
+def make_app():
+    app = web.Application(client_max_size=64 * 1024 ** 2)
+    for rule, view in ROUTES:
+        app.router.add_get(rule.replace("<", "{").replace(">", "}"), view)
+    app.router.add_get("/live", get_live)
+    app.router.add_get("/live/posts/{post_id}", get_live_post)
+    app.router.add_route("*", "/{tail:.*}", fallback)
+    return app
+
+async def main(args):
+    global threads
+    threads = ThreadPoolExecutor(args.threads, thread_name_prefix="wsgi")
+
+    runner = web.AppRunner(make_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, args.host, args.port, reuse_port=args.reuse_port or None)
+    await site.start()
+    print(f"Serving on http://{args.host}:{args.port}", flush=True)
+
+    tasks = [
+        asyncio.create_task(ranking.ranker.run(ranking.handle)),
+        asyncio.create_task(live.hub.run()),
+    ]
+    if config.get("DISCORD_SECRET"):
+        # on_ready starts the notifier, also on this loop.
+        from argot import notifier
+        tasks.append(asyncio.create_task(notifier.client.start(notifier.secret())))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await runner.cleanup()
+        adb.pool.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=8, help="for the routes Flask serves")
+    parser.add_argument("--reuse-port", action="store_true")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,94 @@
+"""Rows/sec for the NDJSON import, against one-row-at-a-time inserts.
+
+Generates a synthetic backlog (a few tags and a small comment thread per
+post), imports it with bulk.import_posts, then does a slice of it the old
+way, with one Post.new/TagMap.create/Comment.new per row, for comparison.
+
+    python bench/bulk.py [--posts N] [--batch N] [--json out.json] [dbname]
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import *
+from argot import bulk
+
+USERS = 50
+TAGS = 200
+
+def records(n, seed=0):
+    rng = random.Random(seed)
+    start = datetime(2020, 1, 1)
+    for i in range(n):
+        t = start + timedelta(minutes=i)
+        yield json.dumps({
+            "title": f"bookmark {i}",
+            "link": f"https://example.com/{i}",
+            "content": f"saved on {t:%Y-%m-%d}",
+            "time": t.isoformat(),
+            "author": f"user{rng.randrange(USERS)}",
+            "tags": [f"tag{rng.randrange(TAGS)}" for _ in range(rng.randrange(1, 4))],
+            "comments": [{
+                "author": f"user{rng.randrange(USERS)}",
+                "content": "nice",
+                "time": (t + timedelta(minutes=1)).isoformat(),
+                "replies": [{"content": "thanks", "time": (t + timedelta(minutes=2)).isoformat()}],
+            } for _ in range(rng.randrange(3))],
+        })
+
+def counts():
+    return {"posts": Post.select().count(), "tagmaps": TagMap.select().count(), "comments": Comment.select().count()}
+
+def one_at_a_time(lines):
+    users = dict(User.select(User.nick, User.id).tuples())
+    for line in lines:
+        r = json.loads(line)
+        with db.atomic():
+            p = Post.new(r["link"], r["title"], users[r["author"]], content=r["content"],
+                         time=datetime.fromisoformat(r["time"]))
+            for name in set(r["tags"]):
+                tag, _ = Tag.get_or_create(name=name)
+                TagMap.create(post_id=p.id, tag_id=tag.id)
+            for c in r["comments"]:
+                top = Comment.new(p.id, users[c["author"]], c["content"])
+                for reply in c["replies"]:
+                    Comment.new(p.id, users[r["author"]], reply["content"], parent=top.id)
+
+def timed(f, *args):
+    before = counts()
+    start = time.perf_counter()
+    f(*args)
+    took = time.perf_counter() - start
+    after = counts()
+    rows = {k: after[k] - before[k] for k in after}
+    total = sum(rows.values())
+    return {**rows, "seconds": took, "rows_per_sec": total / took, "posts_per_sec": rows["posts"] / took}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbname", nargs="?", default="argot_bench")
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=bulk.BATCH)
+    parser.add_argument("--slow", type=int, default=2000, help="posts for the one-at-a-time run")
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    use(args.dbname)
+    reset()
+    User.insert_many([{"nick": f"user{i}", "hash": "", "salt": ""} for i in range(USERS)]).execute()
+
+    def run():
+        report = bulk.import_posts(records(args.posts), "user0", batch=args.batch)
+        assert len(report["errors"]) == 0, report["errors"][:5]
+    results = {
+        "import": timed(run),
+        "one at a time": timed(one_at_a_time, records(args.slow, seed=1)),
+    }
+    print(f"{'':14} {'posts':>7} {'tagmaps':>8} {'comments':>9} {'seconds':>8} {'rows/s':>8} {'posts/s':>8}")
+    for name, r in results.items():
+        print(f"{name:14} {r['posts']:7} {r['tagmaps']:8} {r['comments']:9} {r['seconds']:8.1f} "
+              f"{r['rows_per_sec']:8.0f} {r['posts_per_sec']:8.0f}")
+    if args.json:
+        save(args.json, "bulk", {"posts": args.posts, "batch": args.batch}, results)
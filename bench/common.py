@@ -0,0 +1,65 @@
+"""Shared bits for the scripts in bench/.
+
+Everything here runs against a scratch database (argot_bench by default,
+create it with `createdb argot_bench`), which gets wiped on every run.
+"""
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from argot.models import *
+from argot import migrate as schema
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+def use(name="argot_bench"):
+    if name == "argot":
+        raise SystemExit("Refusing to wipe the real database.")
+    db.init(name, **db.web.connect_params)
+
+def reset(to=None):
+    """Drop everything and migrate back up from nothing (to `to`, if given)."""
+    db.execute_sql("DROP SCHEMA public CASCADE")
+    db.execute_sql("CREATE SCHEMA public")
+    schema.migrate(to=to)
+
+@contextlib.contextmanager
+def count_queries():
+    """Collects (sql, params) for every query run inside the block."""
+    seen = []
+    pool = db.current()
+    execute_sql = pool.execute_sql
+    def counting(sql, params=None, *args, **kwargs):
+        seen.append((sql, params))
+        return execute_sql(sql, params, *args, **kwargs)
+    pool.execute_sql = counting
+    try:
+        yield seen
+    finally:
+        del pool.execute_sql
+
+def commit():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def save(path, bench, params, results):
+    """Write results as JSON, stamped with the commit and time, for compare.py."""
+    with open(path, "w") as f:
+        json.dump({
+            "bench": bench,
+            "commit": commit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "params": params,
+            "results": results,
+        }, f, indent=2)
+    print(f"Saved to {path}")
@@ -0,0 +1,64 @@
+"""Compare two results files saved by the other scripts' --json.
+
+Lines up every number in them and prints old, new and the change. Changes
+for the worse beyond --threshold percent are flagged, and make the exit
+status non-zero with --fail, e.g. to check a branch against main:
+
+    python bench/compare.py main.json branch.json [--threshold 10] [--fail]
+"""
+import argparse
+import json
+import sys
+
+# Bigger is better for these, smaller for everything else (times, counts, memory).
+HIGHER_IS_BETTER = ("rps", "rows_per_sec", "posts_per_sec", "runs", "hits")
+# Not measurements.
+IGNORE = ("requests", "posts", "tagmaps", "comments", "bytes", "errors")
+
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        name = f"{prefix}{k}"
+        if isinstance(v, dict):
+            out.update(flatten(v, name + " / "))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[name] = v
+    return out
+
+def worse(name, change):
+    leaf = name.rsplit(" / ", 1)[-1]
+    return change < 0 if leaf in HIGHER_IS_BETTER else change > 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10, help="percent")
+    parser.add_argument("--fail", action="store_true", help="exit 1 on regressions")
+    args = parser.parse_args()
+
+    old, new = json.load(open(args.old)), json.load(open(args.new))
+    if old["bench"] != new["bench"]:
+        raise SystemExit(f"Can't compare {old['bench']} results with {new['bench']} results.")
+    if old["params"] != new["params"]:
+        print(f"Warning: different parameters, {old['params']} vs {new['params']}")
+    print(f"{old['bench']}: {old['commit']} ({old['time']}) -> {new['commit']} ({new['time']})\n")
+
+    a, b = flatten(old["results"]), flatten(new["results"])
+    regressions = 0
+    width = max(map(len, a.keys() | b.keys()), default=0)
+    for name in sorted(a.keys() & b.keys()):
+        if name.rsplit(" / ", 1)[-1] in IGNORE:
+            continue
+        before, after = a[name], b[name]
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ""
+        if abs(change) >= args.threshold:
+            flag = "WORSE" if worse(name, change) else "better"
+            regressions += flag == "WORSE"
+        print(f"{name:{width}} {before:12.3f} {after:12.3f} {change:+8.1f}% {flag}")
+    for name in sorted(a.keys() ^ b.keys()):
+        print(f"{name:{width}} only in {'old' if name in a else 'new'}")
+
+    print(f"\n{regressions} regression(s) over {args.threshold}%")
+    sys.exit(1 if args.fail and regressions else 0)
@@ -0,0 +1,107 @@
+"""Counts the queries each endpoint runs, and fails if any goes over budget.
+
+Seeds a small dataset, then hits every route through Flask's test client
+(logged out and logged in) and counts what reaches the database. Budgets
+are per request, after the first one has warmed the user cache, and
+with the response cache off.
+
+    python bench/endpoints.py [dbname]
+"""
+import os
+import sys
+
+from common import *
+from argot import inbox
+
+BUDGET = {
+    "GET /posts/<id>": 3,
+    "GET /posts/<id> (anon)": 3,
+    "GET /posts/<id>/comments": 2,
+    "GET /comments/<id>": 1,
+    "GET /comments/<id>/context": 2,
+    "PUT /posts/<id>": 3,
+    "PUT /comments/<id>": 2,
+    "DELETE /comments/<id>": 7,
+    "DELETE /posts/<id>": 7,
+    "POST /comments": 13,
+    "POST /posts": 6,
+    "PUT /posts/<id>/tags": 5,
+    "GET /users/<nick>": 5,
+    "GET /posts": 2,
+    "GET /tags": 1,
+    "POST /tags/<name>": 2,
+    "GET /inbox": 2,
+    "GET /inbox/size": 1,
+    "POST /inbox/read/<id>": 2,
+    "POST /inbox/read": 2,
+}
+
+def seed():
+    reset()
+    User.new("alice", "pw")
+    User.new("bob", "pw")
+    for name in ["py", "rust"]:
+        Tag.create(name=name)
+    for i in range(30):
+        p = Post.new(f"https://example.com/{i}", f"post {i}", 1 + i % 2,
+                     content="hello", private=i % 5 == 0)
+        TagMap.create(post_id=p.id, tag_id=1)
+    for i in range(10):
+        Comment.new(1, 1 + i % 2, f"comment {i}", parent=i or None)
+    for c in Comment.select().where(Comment.author_id == 2):
+        inbox.notify(1, c)
+
+def cases():
+    return [
+        ("GET /posts/<id> (anon)", False, "get", "/posts/2", {}),
+        ("GET /posts/<id>", True, "get", "/posts/1", {}),
+        ("GET /posts/<id>/comments", True, "get", "/posts/1/comments?parent=1", {}),
+        ("GET /comments/<id>", True, "get", "/comments/3", {}),
+        ("GET /comments/<id>/context", True, "get", "/comments/5/context?depth=2", {}),
+        ("PUT /posts/<id>", True, "put", "/posts/2", {"json": {
+            "title": "edited", "link": "https://example.com/", "content": "x",
+            "private": False, "tags": []}}),
+        ("PUT /comments/<id>", True, "put", "/comments/3", {"json": {"content": "edited"}}),
+        ("DELETE /comments/<id>", True, "delete", "/comments/3", {}),
+        ("DELETE /posts/<id>", True, "delete", "/posts/3", {}),
+        ("POST /comments", True, "post", "/comments", {"json": {
+            "post": 1, "parent": 2, "content": "reply"}}),
+        ("POST /posts", True, "post", "/posts", {"json": {
+            "title": "new", "link": "https://example.com/new", "content": "x",
+            "private": False, "tags": [1, 2]}}),
+        ("PUT /posts/<id>/tags", True, "put", "/posts/4/tags?name=rust", {}),
+        ("GET /users/<nick>", True, "get", "/users/alice", {}),
+        ("GET /posts", True, "get", "/posts", {}),
+        ("GET /tags", True, "get", "/tags", {}),
+        ("POST /tags/<name>", True, "post", "/tags/go", {}),
+        ("GET /inbox", True, "get", "/inbox", {}),
+        ("GET /inbox/size", True, "get", "/inbox/size", {}),
+        ("POST /inbox/read/<id>", True, "post", "/inbox/read/2", {}),
+        ("POST /inbox/read", True, "post", "/inbox/read", {}),
+    ]
+
+if __name__ == "__main__":
+    use(*sys.argv[1:])
+    seed()
+
+    # server.py wants to be run from the repo root.
+    os.chdir(ROOT)
+    import server
+    server.metrics.REQUEST_LOG = False
+    server.app.config["TESTING"] = True
+    # Count what the views themselves cost, not what the response cache saves.
+    server.cache.backend = None
+    anon = server.app.test_client()
+    alice = server.app.test_client()
+    alice.post("/login", json={"nick": "alice", "password": "pw"})
+    alice.get("/posts")
+
+    ok = True
+    for name, logged_in, method, url, kw in cases():
+        client = alice if logged_in else anon
+        with count_queries() as qs:
+            r = getattr(client, method)(url, **kw)
+        fine = r.status_code == 200 and len(qs) <= BUDGET[name]
+        ok = ok and fine
+        print(f"{name:26} {r.status_code} {len(qs):3} / {BUDGET[name]:<3} {'ok' if fine else 'OVER'}")
+    sys.exit(0 if ok else 1)
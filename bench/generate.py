@@ -0,0 +1,143 @@
+"""Deterministic synthetic data, from a thousand rows up to millions.
+
+Everything is generated in SQL with generate_series, so a million posts
+takes seconds rather than hours, and the same scale always produces the
+same rows with the same ids. For `posts` posts you get:
+
+- max(10, posts / 100) users. user1 can log in with PASSWORD.
+- TAGS tags, two per post.
+- 3 comments per post, most of them replies to the one before on the same
+  post, so threads go several levels deep.
+- One extra thread of DEPTH comments, each replying to the last, on post 1.
+- A notification for every comment that replies to someone else, two in
+  three of them already read.
+
+Titles and contents are drawn from a small vocabulary so search terms hit a
+realistic fraction of rows. One in ten posts and one in twenty comments are
+private.
+
+    python bench/generate.py [--posts N] [dbname]
+"""
+import argparse
+import time
+
+from common import *
+from argot import activity, inbox, kdf, ranking
+
+TAGS = 50
+DEPTH = 100
+PASSWORD = "hunter2"
+
+WORDS = [
+    "rust", "python", "async", "postgres", "linux", "compiler", "garbage",
+    "collector", "lisp", "haskell", "types", "emacs", "vim", "kernel",
+    "network", "latency", "cache", "index", "query", "parser",
+]
+
+def scale(posts):
+    return {
+        "posts": posts,
+        "users": max(10, posts // 100),
+        "tags": TAGS,
+        "comments": posts * 3,
+        "depth": DEPTH,
+    }
+
+def sequences():
+    """Explicit ids skip the sequences, so catch them up."""
+    for table in ["users", "tags", "posts", "tagmaps", "comments"]:
+        db.execute_sql(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+            f"coalesce((SELECT max(id) FROM {table}), 0) + 1, false)")
+
+def seed(posts):
+    """Fill an empty (freshly reset) database. Returns the row counts."""
+    n = scale(posts)
+    words = "ARRAY[" + ",".join(f"'{w}'" for w in WORDS) + "]"
+    hash, salt = kdf.hash_password(PASSWORD)
+
+    db.execute_sql("""
+        INSERT INTO users (id, nick, hash, salt)
+        SELECT i, 'user' || i, CASE WHEN i = 1 THEN %s ELSE '' END, CASE WHEN i = 1 THEN %s ELSE '' END
+        FROM generate_series(1, %s) i
+    """, (hash, salt, n["users"]))
+    db.execute_sql(
+        "INSERT INTO tags (id, name) SELECT i, 'tag' || i FROM generate_series(1, %s) i", (n["tags"],))
+    db.execute_sql(f"""
+        INSERT INTO posts (id, time, title, link, author_id, content, private)
+        SELECT i,
+               timestamp '2024-01-01' + (i || ' minutes')::interval,
+               'post ' || i || ' about ' || ({words})[1 + i %% 20] || ' and ' || ({words})[1 + (i / 20) %% 20],
+               'https://example.com/' || i,
+               1 + (i::bigint * 7919) %% %(users)s,
+               'some words on ' || ({words})[1 + (i * 7) %% 20] || ' ' || md5(i::text),
+               i %% 10 = 0
+        FROM generate_series(1, %(posts)s) i
+    """, n)
+    db.execute_sql("""
+        INSERT INTO tagmaps (id, post_id, tag_id)
+        SELECT i, i, 1 + i %% %(tags)s FROM generate_series(1, %(posts)s) i
+        UNION ALL
+        SELECT %(posts)s + i, i, 1 + (i + 1 + i %% 7) %% %(tags)s FROM generate_series(1, %(posts)s) i
+    """, n)
+    # Comment i is on post 1 + (i - 1) % posts. Three out of four reply to the
+    # comment before them on the same post, which is i - posts.
+    db.execute_sql(f"""
+        INSERT INTO comments (id, time, post_id, parent_id, author_id, content, private)
+        SELECT i,
+               timestamp '2024-01-01' + ((1 + (i - 1) %% %(posts)s) || ' minutes')::interval
+                 + (i || ' seconds')::interval,
+               1 + (i - 1) %% %(posts)s,
+               CASE WHEN i > %(posts)s AND i %% 4 <> 0 THEN i - %(posts)s END,
+               1 + (i::bigint * 13) %% %(users)s,
+               'a comment on ' || ({words})[1 + (i * 3) %% 20] || ' ' || md5(i::text),
+               i %% 20 = 0
+        FROM generate_series(1, %(comments)s) i
+        ORDER BY i
+    """, n)
+    db.execute_sql("""
+        INSERT INTO comments (id, time, post_id, parent_id, author_id, content, private)
+        SELECT %(comments)s + i,
+               timestamp '2024-01-02' + (i || ' seconds')::interval,
+               1,
+               CASE WHEN i > 1 THEN %(comments)s + i - 1 END,
+               1 + i %% %(users)s,
+               'deep reply ' || i,
+               false
+        FROM generate_series(1, %(depth)s) i
+        ORDER BY i
+    """, n)
+    db.execute_sql("""
+        UPDATE posts SET num_comments = c.n, last_activity = greatest(posts.time, c.latest)
+        FROM (SELECT post_id, count(*) n, max(time) latest FROM comments GROUP BY post_id) c
+        WHERE c.post_id = posts.id
+    """)
+    db.execute_sql("UPDATE posts SET last_activity = time WHERE last_activity IS NULL")
+    db.execute_sql("""
+        INSERT INTO notifications (user_id, comment_id, time, read_at)
+        SELECT coalesce(parent.author_id, p.author_id), c.id, c.time,
+               CASE WHEN c.id %% 3 <> 0 THEN c.time END
+        FROM comments c
+        JOIN posts p ON p.id = c.post_id
+        LEFT JOIN comments parent ON parent.id = c.parent_id
+        WHERE coalesce(parent.author_id, p.author_id) <> c.author_id
+        ORDER BY c.id
+    """)
+    ranking.rerank()
+    activity.recount()
+    inbox.recount()
+    sequences()
+    db.execute_sql("ANALYZE")
+    return n
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbname", nargs="?", default="argot_bench")
+    parser.add_argument("--posts", type=int, default=10000)
+    args = parser.parse_args()
+
+    use(args.dbname)
+    reset()
+    start = time.perf_counter()
+    n = seed(args.posts)
+    print(f"{n} in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,98 @@
+"""The hot feed's cost as the corpus grows, and how fast the ranker keeps up.
+
+For each size, generates that many posts and times GET /posts?sort=hot
+(first page, and 20 pages in through cursors) against ranking the posts at
+request time, i.e. ORDER BY the score expression. The stored score should
+stay flat; ranking on the fly grows with the table. Then adds a burst of
+comments through Comment.new and times the ranker draining their events.
+
+    python bench/hot.py [--sizes 10000,100000] [--comments N] [--json out.json] [dbname]
+"""
+import argparse
+import statistics
+import time
+
+from common import *
+from generate import seed
+from argot import feed, ranking, serialize
+
+RUNS = 20
+DEEP = 20
+
+def timed(f, runs=RUNS):
+    f()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        f()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def on_the_fly():
+    """What sort=hot would cost without posts.hot."""
+    ids = [p.id for p in Post
+           .select(Post.id)
+           .where(Post.public())
+           .order_by(ranking.expression().desc(), Post.id.desc())
+           .limit(feed.PAGE_SIZE)]
+    return serialize.posts(ids)
+
+def measure(client):
+    cursor = None
+    for _ in range(DEEP):
+        r = client.get("/posts?sort=hot" + (f"&after={cursor}" if cursor else ""))
+        cursor = r.headers["X-Next-Cursor"]
+    with count_queries() as qs:
+        client.get("/posts?sort=hot")
+    return {
+        "first_page_ms": timed(lambda: client.get("/posts?sort=hot")),
+        f"page_{DEEP}_ms": timed(lambda: client.get(f"/posts?sort=hot&after={cursor}")),
+        "queries": len(qs),
+        "on_the_fly_ms": timed(on_the_fly, runs=3),
+    }
+
+def drain(comments, posts):
+    """Comments spread over a few hundred posts, then time the ranker on them."""
+    for i in range(comments):
+        Comment.new(1 + (i * 7919) % min(posts, 300), 1, f"burst {i}")
+    pending = Event.select().where(Event.kind == "rank", Event.delivered_at.is_null()).count()
+    start = time.perf_counter()
+    while True:
+        batch = ranking.ranker.claim()
+        if len(batch) == 0:
+            break
+        ranking.rescore({e.ref_id for e in batch})
+        ranking.ranker.ack(batch)
+    seconds = time.perf_counter() - start
+    return {"events": pending, "drain_s": seconds, "events_per_s": pending / seconds}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbname", nargs="?", default="argot_bench")
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--comments", type=int, default=5000)
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    use(args.dbname)
+    os.chdir(ROOT)
+    import server
+    server.metrics.REQUEST_LOG = False
+    # on_the_fly is slow on purpose.
+    server.metrics.SLOW_QUERY = float("inf")
+    server.cache.backend = None
+    client = server.app.test_client()
+
+    results = {}
+    for size in [int(s) for s in args.sizes.split(",")]:
+        reset()
+        seed(size)
+        r = results[size] = measure(client)
+        r.update(drain(args.comments, size))
+
+    print(f"{'posts':>9} {'page 1 ms':>10} {f'page {DEEP} ms':>11} {'queries':>8} {'on the fly ms':>14} {'ranker ev/s':>12}")
+    for size, r in results.items():
+        print(f"{size:9} {r['first_page_ms']:10.2f} {r[f'page_{DEEP}_ms']:11.2f} {r['queries']:8} "
+              f"{r['on_the_fly_ms']:14.2f} {r['events_per_s']:12.0f}")
+    if args.json:
+        save(args.json, "hot", {"sizes": args.sizes, "comments": args.comments}, results)
@@ -0,0 +1,114 @@
+"""Live updates fanned out to lots of idle clients.
+
+Starts async_server.py (see load.py), opens --clients Server-Sent Events
+connections to /live, a tenth of them to /live/posts/1 instead, and waits
+until they're all idle. Then writes --events comments on post 1, one every
+--interval seconds, and records when each one reaches each client.
+
+Reports the server's memory per connection, and how long comments took
+from being posted to reaching clients (p50/p95/p99).
+
+    python bench/live.py [--posts N] [--clients N] [--events N] [--json out.json] [dbname]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from common import *
+from generate import seed, PASSWORD
+from load import percentile, serve, stop
+
+def rss(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+
+async def listen(session, url, ready, received):
+    async with session.get(url) as r:
+        buf = b""
+        async for chunk in r.content.iter_any():
+            buf += chunk
+            while b"\n\n" in buf:
+                event, buf = buf.split(b"\n\n", 1)
+                if event.startswith(b"retry:"):
+                    ready.release()
+                for line in event.split(b"\n"):
+                    if line.startswith(b"data: "):
+                        received.append((json.loads(line[6:])["id"], time.perf_counter()))
+
+async def run(url, pid, clients, events, interval):
+    # One connection per client, and no cap on how many.
+    connector = aiohttp.TCPConnector(limit=0)
+    session = aiohttp.ClientSession(connector=connector)
+    writer = aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True))
+    await writer.post(url + "/login", json={"nick": "user1", "password": PASSWORD})
+
+    before = rss(pid)
+    ready = asyncio.Semaphore(0)
+    received = [[] for _ in range(clients)]
+    tasks = [asyncio.create_task(listen(session, url + ("/live/posts/1" if i % 10 == 0 else "/live"), ready, received[i]))
+             for i in range(clients)]
+    for _ in range(clients):
+        await ready.acquire()
+    await asyncio.sleep(1)
+    after = rss(pid)
+
+    sent = {}
+    for i in range(events):
+        start = time.perf_counter()
+        r = await writer.post(url + "/comments", json={"post": 1, "content": f"live {i}"})
+        sent[int(await r.text())] = start
+        await asyncio.sleep(interval)
+    await asyncio.sleep(2)
+
+    for t in tasks:
+        t.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await session.close()
+    await writer.close()
+
+    times = sorted((at - sent[id]) * 1000 for r in received for id, at in r if id in sent)
+    return {
+        "clients": clients,
+        "events": events,
+        "delivered": len(times),
+        "expected": clients * events,
+        "rss_per_client_kb": (after - before) / clients / 1024,
+        "p50_ms": percentile(times, 0.50),
+        "p95_ms": percentile(times, 0.95),
+        "p99_ms": percentile(times, 0.99),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbname", nargs="?", default="argot_bench")
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument("--port", type=int, default=5098)
+    parser.add_argument("--no-seed", action="store_true", help="keep what's in the database")
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    use(args.dbname)
+    if not args.no_seed:
+        reset()
+        seed(args.posts)
+
+    procs = serve(args.dbname, args.port, "async")
+    try:
+        r = asyncio.run(run(f"http://127.0.0.1:{args.port}", procs[0].pid,
+                            args.clients, args.events, args.interval))
+    finally:
+        stop(procs)
+
+    print(f"{r['clients']} clients, {r['delivered']} / {r['expected']} deliveries")
+    print(f"server memory per client: {r['rss_per_client_kb']:.1f} KiB")
+    print(f"posted to delivered: p50 {r['p50_ms']:.1f} ms, p95 {r['p95_ms']:.1f} ms, p99 {r['p99_ms']:.1f} ms")
+    if args.json:
+        save(args.json, "live", vars(args), r)
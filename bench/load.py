@@ -0,0 +1,214 @@
+"""Concurrent HTTP load against the Flask app.
+
+Starts the app in --workers separate processes sharing --port against a
+generated dataset, unless --url points at one that's already running, e.g.
+under gunicorn. --server picks werkzeug's threaded server ("sync") or
+async_server.py ("async"), so the two can be compared at the same number
+of processes. Then --clients threads each hold a keep-alive connection
+and fire a weighted mix of requests at it for --duration seconds. A few
+clients are logged in and also write comments.
+
+Reports throughput and p50/p95/p99 latency, overall and per request kind.
+
+    python bench/load.py [--posts N] [--clients N] [--duration S]
+                         [--server sync|async] [--workers N] [--json out.json] [dbname]
+"""
+import argparse
+import http.client
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+from common import *
+from generate import seed, scale, PASSWORD
+
+# (name, weight, logged in only, request maker)
+MIX = [
+    ("GET /posts", 30, False, lambda rng, n: ("GET", "/posts", None)),
+    ("GET /posts/<id>", 25, False, lambda rng, n: ("GET", f"/posts/{rng.randint(1, n['posts'])}", None)),
+    ("GET /users/<nick>", 10, False, lambda rng, n: ("GET", f"/users/user{rng.randint(1, n['users'])}", None)),
+    ("GET /tags", 5, False, lambda rng, n: ("GET", "/tags", None)),
+    ("PUT /posts/query", 10, False, lambda rng, n: ("PUT", "/posts/query", f"tag{rng.randint(1, n['tags'])}+tag{rng.randint(1, n['tags'])}")),
+    ("PUT /posts/search", 10, False, lambda rng, n: ("PUT", "/posts/search", rng.choice(["rust", "python async", "linux -kernel"]))),
+    ("POST /comments", 10, True, lambda rng, n: ("POST", "/comments", f'{{"post": {rng.randint(1, n["posts"])}, "content": "load test"}}')),
+    ("GET /inbox/size", 20, True, lambda rng, n: ("GET", "/inbox/size", None)),
+    ("GET /inbox", 5, True, lambda rng, n: ("GET", "/inbox", None)),
+]
+
+def percentile(sorted_times, p):
+    if len(sorted_times) == 0:
+        return None
+    return sorted_times[min(len(sorted_times) - 1, int(len(sorted_times) * p))]
+
+def summarize(times, errors, seconds):
+    times = sorted(times)
+    return {
+        "requests": len(times),
+        "errors": errors,
+        "rps": len(times) / seconds,
+        "p50_ms": percentile(times, 0.50),
+        "p95_ms": percentile(times, 0.95),
+        "p99_ms": percentile(times, 0.99),
+    }
+
+class Client(threading.Thread):
+    def __init__(self, url, n, seed, logged_in, until):
+        super().__init__(daemon=True)
+        self.url = urlsplit(url)
+        self.n = n
+        self.rng = random.Random(seed)
+        self.logged_in = logged_in
+        self.until = until
+        self.cookie = None
+        self.times = {}
+        self.errors = {}
+        mix = [m for m in MIX if logged_in or not m[2]]
+        self.names = [m[0] for m in mix]
+        self.weights = [m[1] for m in mix]
+        self.makers = {m[0]: m[3] for m in mix}
+
+    def connect(self):
+        self.conn = http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=30)
+
+    def request(self, method, path, body):
+        headers = {"Content-Type": "application/json"}
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        self.conn.request(method, path, body=body, headers=headers)
+        r = self.conn.getresponse()
+        r.read()
+        return r
+
+    def login(self):
+        r = self.request("POST", "/login", f'{{"nick": "user1", "password": "{PASSWORD}"}}')
+        cookies = [c.split(";")[0] for c in r.headers.get_all("Set-Cookie") or []]
+        self.cookie = "; ".join(cookies)
+
+    def run(self):
+        self.connect()
+        if self.logged_in:
+            self.login()
+        while time.monotonic() < self.until:
+            name = self.rng.choices(self.names, self.weights)[0]
+            method, path, body = self.makers[name](self.rng, self.n)
+            start = time.perf_counter()
+            try:
+                r = self.request(method, path, body)
+                ok = r.status < 500
+            except (OSError, http.client.HTTPException):
+                ok = False
+                self.conn.close()
+                self.connect()
+            took = (time.perf_counter() - start) * 1000
+            if ok:
+                self.times.setdefault(name, []).append(took)
+            else:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+# werkzeug won't set SO_REUSEPORT itself, but it'll serve on a socket it's given.
+SYNC = """
+import logging, socket, server
+from werkzeug.serving import make_server
+logging.getLogger("werkzeug").setLevel(logging.ERROR)
+s = socket.socket()
+s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+s.bind(("127.0.0.1", {port}))
+s.listen(128)
+make_server("127.0.0.1", {port}, server.app, threaded=True, fd=s.fileno()).serve_forever()
+"""
+
+def serve(dbname, port, kind="sync", workers=1):
+    """The app in its own processes, so it doesn't fight the clients for the GIL."""
+    env = {**os.environ, "DB_NAME": dbname, "REQUEST_LOG": "0"}
+    if kind == "sync":
+        command = [sys.executable, "-c", SYNC.format(port=port)]
+    else:
+        command = [sys.executable, "async_server.py", "--port", str(port), "--reuse-port"]
+    procs = [subprocess.Popen(command, cwd=ROOT, env=env) for _ in range(workers)]
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            http.client.HTTPConnection("127.0.0.1", port, timeout=1).request("GET", "/tags")
+            if workers > 1:
+                # One of them is up. Give the rest a moment, or the kernel
+                # hands every connection to that one.
+                time.sleep(1)
+            return procs
+        except OSError:
+            time.sleep(0.2)
+    stop(procs)
+    raise SystemExit("Server didn't come up.")
+
+def stop(procs):
+    for proc in procs:
+        proc.terminate()
+    for proc in procs:
+        proc.wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbname", nargs="?", default="argot_bench")
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--writers", type=int, default=2, help="how many of the clients log in")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--port", type=int, default=5099)
+    parser.add_argument("--server", choices=["sync", "async"], default="sync")
+    parser.add_argument("--workers", type=int, default=1, help="server processes")
+    parser.add_argument("--url", help="use an already running server instead")
+    parser.add_argument("--no-seed", action="store_true", help="keep what's in the database")
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    use(args.dbname)
+    if not args.no_seed:
+        reset()
+        seed(args.posts)
+    n = scale(args.posts)
+
+    procs = []
+    url = args.url
+    if url is None:
+        procs = serve(args.dbname, args.port, args.server, args.workers)
+        url = f"http://127.0.0.1:{args.port}"
+
+    try:
+        until = time.monotonic() + args.duration
+        clients = [Client(url, n, i, i < args.writers, until) for i in range(args.clients)]
+        start = time.monotonic()
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+        seconds = time.monotonic() - start
+    finally:
+        stop(procs)
+
+    results = {}
+    for name, *_ in MIX:
+        times = [t for c in clients for t in c.times.get(name, [])]
+        errors = sum(c.errors.get(name, 0) for c in clients)
+        results[name] = summarize(times, errors, seconds)
+    results["all"] = summarize(
+        [t for c in clients for ts in c.times.values() for t in ts],
+        sum(sum(c.errors.values()) for c in clients),
+        seconds,
+    )
+
+    print(f"{'':20} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, r in results.items():
+        if r["requests"] == 0:
+            continue
+        print(f"{name:20} {r['requests']:9} {r['errors']:7} {r['rps']:8.1f} "
+              f"{r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f}")
+    if args.json:
+        save(args.json, "load", {
+            "posts": args.posts, "clients": args.clients, "writers": args.writers,
+            "duration": args.duration, "url": args.url,
+            "server": args.server, "workers": args.workers,
+        }, results)
@@ -0,0 +1,120 @@
+"""Micro-benchmarks for the serializers, comment trees, tag queries, search,
+user pages and the inbox.
+
+Generates data at the given scale (see generate.py) and times each case
+in-process, straight against the database, with no HTTP in the way. Each
+case runs for at least --min-time seconds and reports median and p95 ms.
+
+Post.tag_query is gone, so the tag query cases cover the parser and both
+ways tagquery can evaluate an expression (SQL, and the in-memory index).
+
+    python bench/micro.py [--posts N] [--only NAME] [--json out.json] [dbname]
+"""
+import argparse
+import statistics
+import time
+
+from common import *
+from generate import seed, scale
+from argot import activity, feed, inbox, search, serialize, tagquery, tree
+
+EXPR = "tag3+tag4|tag9-tag10"
+
+def cases(n):
+    page = list(feed.query(private=True).limit(feed.PAGE_SIZE))
+    page_ids = [p.id for p in page]
+    # Top of the DEPTH-long thread on post 1, and an ordinary thread.
+    deep = Comment.get(Comment.id == n["comments"] + 1)
+    shallow = Comment.get((Comment.parent_id.is_null()) & (Comment.post_id == 2))
+    middle = n["comments"] + n["depth"] // 2
+    bottom = n["comments"] + n["depth"]
+    parsed = tagquery.parse(EXPR)
+    index = tagquery.TagIndex(ttl=3600)
+    # The busiest user, and a cursor halfway down their timeline.
+    busiest = User.select().order_by((User.num_posts + User.num_comments).desc()).first()
+    timeline = list(activity.query(busiest.id, private=True))
+    kind, id, at = timeline[len(timeline) // 2]
+    halfway = (at, kind, id)
+
+    def with_index(f):
+        def run():
+            old, tagquery.index = tagquery.index, index
+            try:
+                return f()
+            finally:
+                tagquery.index = old
+        return run
+
+    def without_index(f):
+        def run():
+            old, tagquery.index = tagquery.index, None
+            try:
+                return f()
+            finally:
+                tagquery.index = old
+        return run
+
+    return {
+        "Post.to_dict x25": lambda: [Post.get_by_id(id).to_dict() for id in page_ids],
+        "serialize.posts x25": lambda: serialize.posts(page_ids),
+        "feed.latest": lambda: feed.latest(private=True),
+        "Comment.to_mini_dict (deep)": lambda: deep.to_mini_dict(),
+        "Comment.to_mini_dict (shallow)": lambda: shallow.to_mini_dict(),
+        "tree.load post 1": lambda: tree.load(1, private=True),
+        "tree.load post 1, depth 5": lambda: tree.load(1, private=True, depth=5, limit=10),
+        "tree.load subtree, depth 5": lambda: tree.load(1, parent=middle, private=True, depth=5),
+        "tree.size (deep)": lambda: tree.size(middle),
+        "tree.context (deep)": lambda: tree.context(bottom, private=True),
+        "tagquery.parse": lambda: tagquery.parse(EXPR),
+        "tagquery.query (sql)": without_index(lambda: tagquery.query(parsed)),
+        "tagquery.query (index)": with_index(lambda: tagquery.query(parsed)),
+        "search.posts": lambda: search.posts("rust async"),
+        "search.comments": lambda: search.comments("postgres"),
+        "search.everything": lambda: search.everything("linux -kernel"),
+        "user page, everything": lambda: (
+            serialize.posts(list(serialize.post_query().where(Post.author_id == busiest.id))),
+            serialize.comments(list(serialize.comment_query().where(Comment.author_id == busiest.id)))),
+        "activity.page": lambda: activity.page(busiest.id, True, None, feed.PAGE_SIZE),
+        "activity.page (halfway)": lambda: activity.page(busiest.id, True, halfway, feed.PAGE_SIZE),
+        "inbox.size": lambda: inbox.size(busiest.id),
+        "inbox size, counted": lambda: inbox.query(busiest.id).count(),
+        "inbox.page": lambda: inbox.page(busiest.id, limit=feed.PAGE_SIZE),
+    }
+
+def timeit(f, min_time):
+    f()
+    times = []
+    deadline = time.perf_counter() + min_time
+    while len(times) < 5 or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        f()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        "median_ms": statistics.median(times),
+        "p95_ms": times[int(len(times) * 0.95) - 1],
+        "runs": len(times),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbname", nargs="?", default="argot_bench")
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--min-time", type=float, default=1.0)
+    parser.add_argument("--only", help="just the cases containing this")
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    use(args.dbname)
+    reset()
+    seed(args.posts)
+
+    results = {}
+    print(f"{'':32} {'median ms':>10} {'p95 ms':>10} {'runs':>6}")
+    for name, f in cases(scale(args.posts)).items():
+        if args.only and args.only not in name:
+            continue
+        r = results[name] = timeit(f, args.min_time)
+        print(f"{name:32} {r['median_ms']:10.3f} {r['p95_ms']:10.3f} {r['runs']:6}")
+    if args.json:
+        save(args.json, "micro", {"posts": args.posts}, results)
@@ -0,0 +1,98 @@
+"""Payload size and encode time per endpoint, for each wire format.
+
+Seeds the given scale (see generate.py), fetches each endpoint's response
+through Flask's test client (logged in, response cache off) and then
+times, in-process, turning that same data into bytes:
+
+- json: the json module the way Flask's default provider does it, which
+  is what every response went out as before argot.wire
+- orjson: argot.wire's JSON (if orjson is installed)
+- msgpack (if msgpack is installed)
+
+and compressing the JSON with gzip and brotli (if installed) at the
+levels argot.wire uses. Sizes are in bytes, times are medians in ms.
+
+    python bench/payload.py [--posts N] [--min-time S] [--json out.json] [dbname]
+"""
+import argparse
+import json
+import os
+
+from common import *
+from generate import seed, scale, PASSWORD
+from micro import timeit
+from argot import wire
+
+def endpoints(n, nick):
+    deep = n["comments"] + n["depth"]
+    return {
+        "GET /posts": "/posts",
+        "GET /posts?limit=100": "/posts?limit=100",
+        "GET /posts?sort=hot": "/posts?sort=hot",
+        "GET /posts/1 (deep thread)": "/posts/1",
+        "GET /posts/2": "/posts/2",
+        "GET /comments/<id>/context": f"/comments/{deep}/context",
+        "GET /users/<nick>": f"/users/{nick}",
+        "GET /inbox?all": "/inbox?all=true",
+        "GET /tags": "/tags",
+        "GET /posts?stream (all)": "/posts?stream=json",
+    }
+
+def stdlib(obj):
+    # What Flask's DefaultJSONProvider sends.
+    return json.dumps(obj, default=wire.default, sort_keys=True, separators=(",", ":")).encode() + b"\n"
+
+def measure(obj, min_time):
+    out = {}
+    encoders = {"json": stdlib}
+    if wire.orjson is not None:
+        encoders["orjson"] = lambda o: wire.encode(o, wire.JSON)
+    if wire.msgpack is not None:
+        encoders["msgpack"] = lambda o: wire.encode(o, wire.MSGPACK)
+    for name, f in encoders.items():
+        out[name] = {"bytes": len(f(obj)), "ms": timeit(lambda: f(obj), min_time)["median_ms"]}
+
+    body = wire.encode(obj, wire.JSON)
+    for enc in wire.ENCODINGS:
+        name = {"gzip": "gzip", "br": "brotli"}[enc]
+        out[name] = {"bytes": len(wire.compress(body, enc)),
+                     "ms": timeit(lambda: wire.compress(body, enc), min_time)["median_ms"]}
+    return out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbname", nargs="?", default="argot_bench")
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--min-time", type=float, default=0.5)
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    use(args.dbname)
+    reset()
+    seed(args.posts)
+
+    # server.py wants to be run from the repo root.
+    os.chdir(ROOT)
+    import server
+    server.metrics.REQUEST_LOG = False
+    server.cache.backend = None
+    # Log in as whoever has the most notifications, so the inbox isn't empty.
+    user1 = User.get_by_id(1)
+    busiest = User.select().order_by(User.unread.desc()).first()
+    User.update(hash=user1.hash, salt=user1.salt).where(User.id == busiest.id).execute()
+    client = server.app.test_client()
+    client.post("/login", json={"nick": busiest.nick, "password": PASSWORD})
+
+    print(f"available: {', '.join(['json'] + [m for m in ['orjson', 'msgpack', 'brotli'] if getattr(wire, m) is not None])}")
+    results = {}
+    for name, url in endpoints(scale(args.posts), busiest.nick).items():
+        r = client.get(url)
+        assert r.status_code == 200, (url, r.status_code)
+        results[name] = measure(json.loads(r.data), args.min_time)
+
+    kinds = list(next(iter(results.values())))
+    print(f"{'':28}" + "".join(f"{k:>21}" for k in kinds))
+    for name, r in results.items():
+        print(f"{name:28}" + "".join(f"{r[k]['bytes']:>10} {r[k]['ms']:8.3f}ms" for k in kinds))
+    if args.json:
+        save(args.json, "payload", {"posts": args.posts}, results)
@@ -0,0 +1,102 @@
+"""Per-endpoint query plans and timings, before and after the index migrations.
+
+Seeds a large synthetic dataset with the schema as of BEFORE, hits each
+endpoint through Flask's test client, and EXPLAIN ANALYZEs every query it
+ran. Then applies the remaining migrations and does it all again.
+
+    python bench/plans.py [--posts N] [--json out.json] [dbname]
+"""
+import argparse
+import statistics
+import time
+
+from common import *
+from generate import seed, PASSWORD
+
+# Last migration before the indexes and constraints went in.
+BEFORE = "0004_events"
+RUNS = 5
+
+def endpoints(client, posts):
+    cursor = client.get("/posts").headers.get("X-Next-Cursor", "")
+    return {
+        "GET /posts": ("get", "/posts", {}),
+        "GET /posts?after=": ("get", f"/posts?after={cursor}", {}),
+        "GET /posts/<id>": ("get", f"/posts/{posts // 2}", {}),
+        "GET /users/<nick>": ("get", "/users/user7", {}),
+        "PUT /posts/query": ("put", "/posts/query", {"data": "tag3+tag4|tag9-tag10"}),
+        "PUT /posts/search": ("put", "/posts/search", {"data": "content"}),
+        "POST /login": ("post", "/login", {"json": {"nick": "user1", "password": PASSWORD}}),
+    }
+
+def explain(sql, params):
+    plan = db.execute_sql("EXPLAIN (ANALYZE, FORMAT JSON) " + sql, params).fetchone()[0][0]
+    scans = []
+    def walk(node):
+        how = node["Node Type"]
+        if "Index Name" in node:
+            how += f" using {node['Index Name']}"
+        if "Relation Name" in node:
+            scans.append(f"{how} on {node['Relation Name']}")
+        elif "Index Name" in node:
+            scans.append(how)
+        for child in node.get("Plans", []):
+            walk(child)
+    walk(plan["Plan"])
+    return plan["Execution Time"], scans
+
+def measure(posts):
+    import server
+    server.metrics.REQUEST_LOG = False
+    client = server.app.test_client()
+    out = {}
+    for name, (method, url, kwargs) in endpoints(client, posts).items():
+        call = lambda: getattr(client, method)(url, **kwargs)
+        call()
+        times = []
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            call()
+            times.append((time.perf_counter() - start) * 1000)
+        with count_queries() as qs:
+            call()
+        plans = [explain(sql, params) for sql, params in qs if sql.lstrip().upper().startswith("SELECT")]
+        out[name] = {
+            "request_ms": statistics.median(times),
+            "queries": len(qs),
+            "db_ms": sum(ms for ms, _ in plans),
+            "scans": sorted({s for _, scans in plans for s in scans}),
+        }
+    return out
+
+def report(before, after):
+    print(f"{'endpoint':22} {'before ms':>10} {'after ms':>10} {'db before':>10} {'db after':>10}")
+    for name in before:
+        b, a = before[name], after[name]
+        print(f"{name:22} {b['request_ms']:10.2f} {a['request_ms']:10.2f} {b['db_ms']:10.2f} {a['db_ms']:10.2f}")
+    for name in before:
+        print(f"\n{name}")
+        for label, r in (("before", before[name]), ("after", after[name])):
+            print(f"  {label}:")
+            for s in r["scans"]:
+                print(f"    {s}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbname", nargs="?", default="argot_bench")
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    use(args.dbname)
+    reset(to=BEFORE)
+    seed(args.posts)
+    before = measure(args.posts)
+
+    schema.migrate()
+    db.execute_sql("ANALYZE")
+    after = measure(args.posts)
+
+    report(before, after)
+    if args.json:
+        save(args.json, "plans", {"posts": args.posts}, {"before": before, "after": after})
@@ -0,0 +1,44 @@
+"""Checks that the bulk serializers do a fixed number of queries.
+
+Seeds lists of a few sizes and makes sure serializing each of them costs
+the same number of queries. Exits non-zero if anything scales with size.
+
+    python bench/queries.py [dbname]
+"""
+import sys
+
+from common import *
+from generate import seed
+from argot import serialize
+
+SIZES = [10, 100, 1000]
+
+def measure():
+    out = {}
+    cases = {
+        "posts (instances)": lambda: serialize.posts(list(Post.select())),
+        "posts (ids)": lambda: serialize.posts([p.id for p in Post.select(Post.id)]),
+        "comments": lambda: serialize.comments(list(Comment.select())),
+        "users": lambda: serialize.users([u.id for u in User.select(User.id)]),
+    }
+    for name, f in cases.items():
+        with count_queries() as qs:
+            f()
+        out[name] = len(qs)
+    return out
+
+if __name__ == "__main__":
+    use(*sys.argv[1:])
+    results = {}
+    for n in SIZES:
+        reset()
+        seed(n)
+        results[n] = measure()
+
+    ok = True
+    for name in results[SIZES[0]]:
+        counts = [results[n][name] for n in SIZES]
+        flat = len(set(counts)) == 1
+        ok = ok and flat
+        print(f"{name:20} {counts} {'ok' if flat else 'GROWS WITH SIZE'}")
+    sys.exit(0 if ok else 1)
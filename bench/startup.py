@@ -0,0 +1,65 @@
+"""Startup time and memory for each kind of process.
+
+Starts each one --runs times in a fresh interpreter and reports the median
+time to import it, the time until it could serve (for the web server,
+answering its first request), and resident memory at that point:
+
+- python: a bare interpreter, for scale
+- web: server.py, what each gunicorn worker loads
+- async: async_server.py with its aiohttp app built
+- notifier: the Discord bot (argot.notifier)
+
+Nothing gets seeded; the web server's first request is /stats, which
+only needs a connection.
+
+    python bench/startup.py [--runs N] [--json out.json] [dbname]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from common import *
+
+KINDS = {
+    "python": ("", ""),
+    "web": ("import server", 'server.app.test_client().get("/stats")'),
+    "async": ("import async_server", "async_server.make_app()"),
+    "notifier": ("from argot import notifier", ""),
+}
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+{imports}
+imported = time.perf_counter()
+{ready}
+ready = time.perf_counter()
+with open("/proc/self/status") as f:
+    rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+print(json.dumps({{"import_ms": (imported - start) * 1000, "ready_ms": (ready - start) * 1000, "rss_kb": rss}}))
+"""
+
+def probe(dbname, imports, ready):
+    env = {**os.environ, "DB_NAME": dbname, "REQUEST_LOG": "0"}
+    out = subprocess.run([sys.executable, "-c", PROBE.format(imports=imports, ready=ready)],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbname", nargs="?", default="argot_bench")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'':10} {'import ms':>10} {'ready ms':>10} {'RSS MiB':>10}")
+    for name, (imports, ready) in KINDS.items():
+        runs = [probe(args.dbname, imports, ready) for _ in range(args.runs)]
+        r = results[name] = {k: statistics.median(run[k] for run in runs) for k in runs[0]}
+        print(f"{name:10} {r['import_ms']:10.1f} {r['ready_ms']:10.1f} {r['rss_kb'] / 1024:10.1f}")
+    if args.json:
+        save(args.json, "startup", vars(args), results)
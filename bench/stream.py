@@ -0,0 +1,71 @@
+"""Buffered vs streamed responses: time to first byte, total time, peak memory.
+
+Seeds a big dataset where one user wrote half of the posts, then fetches
+that user's page and the whole feed both ways. Memory is the peak of
+Python allocations (tracemalloc) while the response is produced.
+
+    python bench/stream.py [--posts N] [--json out.json] [dbname]
+"""
+import argparse
+import time
+import tracemalloc
+
+from common import *
+from generate import seed
+
+def fetch(client, url, **kwargs):
+    tracemalloc.start()
+    start = time.perf_counter()
+    r = client.get(url, buffered=False, **kwargs)
+    first = None
+    size = 0
+    for chunk in r.response:
+        if first is None and len(chunk) != 0:
+            first = time.perf_counter()
+        size += len(chunk)
+    end = time.perf_counter()
+    r.close()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "ttfb_ms": ((first or end) - start) * 1000,
+        "total_ms": (end - start) * 1000,
+        "peak_mb": peak / 2**20,
+        "bytes": size,
+    }
+
+CASES = {
+    "user page, buffered": "/users/user1",
+    "user page, json stream": "/users/user1?stream=json",
+    "user page, ndjson stream": "/users/user1?stream=ndjson",
+    "feed, one page": "/posts?limit=100",
+    "feed, json stream": "/posts?stream=json",
+    "feed, ndjson stream": "/posts?stream=ndjson",
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dbname", nargs="?", default="argot_bench")
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--json")
+    args = parser.parse_args()
+
+    use(args.dbname)
+    reset()
+    seed(args.posts)
+    db.execute_sql("UPDATE posts SET author_id = 1 WHERE id %% 2 = 0")
+    db.execute_sql("ANALYZE")
+
+    import server
+    server.metrics.REQUEST_LOG = False
+    server.cache.backend = None
+    client = server.app.test_client()
+
+    results = {}
+    print(f"{'':26} {'ttfb ms':>9} {'total ms':>9} {'peak MB':>8} {'MB out':>7}")
+    for name, url in CASES.items():
+        fetch(client, url)
+        r = results[name] = fetch(client, url)
+        print(f"{name:26} {r['ttfb_ms']:9.1f} {r['total_ms']:9.1f} {r['peak_mb']:8.1f} {r['bytes'] / 2**20:7.1f}")
+    if args.json:
+        save(args.json, "stream", {"posts": args.posts}, results)
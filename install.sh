@@ -2,3 +2,4 @@
 
 createdb argot -U postgres
 psql argot -f up.sql -U postgres
+python -m argot.manage migrate
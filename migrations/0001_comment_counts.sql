@@ -0,0 +1,17 @@
+-- Per-post comment count and last activity, maintained by Comment.new and
+-- Comment.remove. `python -m argot.manage recount` repairs them if needed.
+ALTER TABLE posts
+  ADD COLUMN IF NOT EXISTS num_comments INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS last_activity TIMESTAMP;
+
+UPDATE posts SET
+  num_comments = coalesce(c.n, 0),
+  last_activity = greatest(p.time, c.latest)
+FROM posts p
+LEFT JOIN (
+  SELECT post_id, count(*) AS n, max(time) AS latest
+  FROM comments
+  WHERE content <> '[deleted]'
+  GROUP BY post_id
+) c ON c.post_id = p.id
+WHERE posts.id = p.id;
@@ -0,0 +1,3 @@
+-- Tag expressions resolve names to tags and tags to posts.
+CREATE INDEX IF NOT EXISTS tags_name_idx ON tags(name);
+CREATE INDEX IF NOT EXISTS tagmaps_tag_post_idx ON tagmaps(tag_id, post_id);
@@ -0,0 +1,17 @@
+-- Stored, weighted search vectors, kept current by Postgres itself.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+  setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+  setweight(to_tsvector('english', coalesce(content, '')), 'B') ||
+  setweight(to_tsvector('english', coalesce(link, '')), 'C')
+) STORED;
+
+ALTER TABLE comments ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+  setweight(to_tsvector('english', content), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS post_search_idx ON posts USING gin(search);
+CREATE INDEX IF NOT EXISTS comment_search_idx ON comments USING gin(search);
+
+-- Superseded by the above.
+DROP INDEX IF EXISTS post_content_idx;
+DROP INDEX IF EXISTS comment_content_idx;
@@ -0,0 +1,13 @@
+-- Outbox for post/comment events, see argot/events.py.
+CREATE TABLE IF NOT EXISTS events (
+  id           BIGSERIAL PRIMARY KEY,
+  kind         TEXT NOT NULL,
+  ref_id       INTEGER NOT NULL,
+  time         TIMESTAMP NOT NULL,
+  available_at TIMESTAMP NOT NULL,
+  delivered_at TIMESTAMP,
+  attempts     INTEGER NOT NULL DEFAULT 0,
+  error        TEXT
+);
+
+CREATE INDEX IF NOT EXISTS events_pending_idx ON events(available_at, id) WHERE delivered_at IS NULL;
@@ -0,0 +1,17 @@
+-- Privacy used to be nullable, with NULL meaning public. Pin it down so the
+-- partial indexes below can match `private = false` exactly.
+UPDATE posts SET private = false WHERE private IS NULL;
+ALTER TABLE posts ALTER COLUMN private SET DEFAULT false, ALTER COLUMN private SET NOT NULL;
+UPDATE comments SET private = false WHERE private IS NULL;
+ALTER TABLE comments ALTER COLUMN private SET DEFAULT false, ALTER COLUMN private SET NOT NULL;
+
+-- Front page, newest first; the partial one is what anonymous users hit.
+CREATE INDEX IF NOT EXISTS posts_time_idx ON posts(time DESC, id DESC);
+CREATE INDEX IF NOT EXISTS posts_public_time_idx ON posts(time DESC, id DESC) WHERE private = false;
+
+-- User pages.
+CREATE INDEX IF NOT EXISTS posts_author_time_idx ON posts(author_id, time DESC);
+CREATE INDEX IF NOT EXISTS comments_author_time_idx ON comments(author_id, time DESC);
+
+-- Threads, and replies under a given comment.
+CREATE INDEX IF NOT EXISTS comments_post_parent_idx ON comments(post_id, parent_id);
@@ -0,0 +1,33 @@
+-- Duplicate tag mappings carry no information, so just drop the extras.
+DELETE FROM tagmaps a USING tagmaps b
+WHERE a.post_id = b.post_id AND a.tag_id = b.tag_id AND a.id > b.id;
+
+-- Fold duplicate tags into the oldest one with that name.
+UPDATE tagmaps SET tag_id = keep.id
+FROM tags dup
+JOIN (SELECT name, min(id) AS id FROM tags GROUP BY name) keep ON keep.name = dup.name
+WHERE tagmaps.tag_id = dup.id AND dup.id <> keep.id;
+
+DELETE FROM tagmaps a USING tagmaps b
+WHERE a.post_id = b.post_id AND a.tag_id = b.tag_id AND a.id > b.id;
+
+DELETE FROM tags a USING tags b WHERE a.name = b.name AND a.id > b.id;
+
+-- Duplicate users can't be merged automatically; somebody has to decide.
+DO $$
+DECLARE dups TEXT;
+BEGIN
+  SELECT string_agg(DISTINCT nick, ', ') INTO dups
+  FROM users u WHERE (SELECT count(*) FROM users v WHERE v.nick = u.nick) > 1;
+  IF dups IS NOT NULL THEN
+    RAISE EXCEPTION 'Duplicate user nicks need fixing by hand first: %', dups;
+  END IF;
+END $$;
+
+ALTER TABLE users ADD CONSTRAINT users_nick_key UNIQUE (nick);
+ALTER TABLE tags ADD CONSTRAINT tags_name_key UNIQUE (name);
+-- Also serves lookups of a post's tags by post_id.
+ALTER TABLE tagmaps ADD CONSTRAINT tagmaps_post_tag_key UNIQUE (post_id, tag_id);
+
+-- The unique constraint's index covers this now.
+DROP INDEX IF EXISTS tags_name_idx;
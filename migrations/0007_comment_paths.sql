@@ -0,0 +1,45 @@
+-- Every comment carries its materialized path: the ids from its top-level
+-- comment down to itself. depth is 0 for top-level comments. With these,
+-- a subtree, its size or a comment's ancestors is a single indexed query.
+ALTER TABLE comments
+  ADD COLUMN IF NOT EXISTS path INTEGER[],
+  ADD COLUMN IF NOT EXISTS depth INTEGER;
+
+-- Backfill, walking down from the top-level comments.
+WITH RECURSIVE t AS (
+  SELECT id, ARRAY[id] AS path FROM comments WHERE parent_id IS NULL
+  UNION ALL
+  SELECT c.id, t.path || c.id FROM comments c JOIN t ON c.parent_id = t.id
+)
+UPDATE comments SET path = t.path, depth = cardinality(t.path) - 1
+FROM t WHERE comments.id = t.id;
+
+ALTER TABLE comments ALTER COLUMN path SET NOT NULL, ALTER COLUMN depth SET NOT NULL;
+
+-- Filled in from the parent on the way in. Comments never move, but a
+-- save() that writes the path back gets it recomputed rather than trusted.
+CREATE OR REPLACE FUNCTION comments_set_path() RETURNS TRIGGER AS $$
+DECLARE
+  parent comments%ROWTYPE;
+BEGIN
+  IF NEW.parent_id IS NULL THEN
+    NEW.path := ARRAY[NEW.id];
+  ELSE
+    SELECT * INTO parent FROM comments WHERE id = NEW.parent_id;
+    IF parent.post_id <> NEW.post_id THEN
+      RAISE EXCEPTION 'Comment % is on post %, not %', parent.id, parent.post_id, NEW.post_id;
+    END IF;
+    NEW.path := parent.path || NEW.id;
+  END IF;
+  NEW.depth := cardinality(NEW.path) - 1;
+  RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS comments_path ON comments;
+CREATE TRIGGER comments_path BEFORE INSERT OR UPDATE OF parent_id, path ON comments
+  FOR EACH ROW EXECUTE FUNCTION comments_set_path();
+
+-- Arrays sort element by element, so a subtree is a range of this index:
+-- see tree.subtree.
+CREATE INDEX IF NOT EXISTS comments_path_idx ON comments(path);
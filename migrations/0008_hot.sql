@@ -0,0 +1,10 @@
+-- Front page "hot" score, see argot/ranking.py. New posts get it on insert
+-- and the ranker keeps it up to date as comments come in. This backfill
+-- uses the default HOT_TIMESCALE; run `manage rerank` if you've changed it.
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS hot DOUBLE PRECISION;
+
+UPDATE posts SET hot = log(1 + greatest(num_comments, 0)) + date_part('epoch', time) / 45000;
+
+-- Hot feed paging, same as the newest-first indexes in 0005.
+CREATE INDEX IF NOT EXISTS posts_hot_idx ON posts(hot DESC, id DESC);
+CREATE INDEX IF NOT EXISTS posts_public_hot_idx ON posts(hot DESC, id DESC) WHERE private = false;
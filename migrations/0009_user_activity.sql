@@ -0,0 +1,26 @@
+-- Per-user post and comment counts for user pages, maintained by Post.new,
+-- Comment.new, Comment.remove and bulk.delete_post, like posts.num_comments.
+-- `python -m argot.manage recount` repairs them if needed.
+ALTER TABLE users
+  ADD COLUMN IF NOT EXISTS num_posts INTEGER NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS num_comments INTEGER NOT NULL DEFAULT 0;
+
+UPDATE users SET
+  num_posts = coalesce(p.n, 0),
+  num_comments = coalesce(c.n, 0)
+FROM users u
+LEFT JOIN (SELECT author_id, count(*) AS n FROM posts GROUP BY author_id) p ON p.author_id = u.id
+LEFT JOIN (
+  SELECT author_id, count(*) AS n
+  FROM comments
+  WHERE content <> '[deleted]'
+  GROUP BY author_id
+) c ON c.author_id = u.id
+WHERE users.id = u.id;
+
+-- User pages page through each author's posts and comments by (time, id),
+-- which the old (author_id, time) indexes couldn't give in order.
+CREATE INDEX IF NOT EXISTS posts_author_time_id_idx ON posts(author_id, time DESC, id DESC);
+CREATE INDEX IF NOT EXISTS comments_author_time_id_idx ON comments(author_id, time DESC, id DESC);
+DROP INDEX IF EXISTS posts_author_time_idx;
+DROP INDEX IF EXISTS comments_author_time_idx;
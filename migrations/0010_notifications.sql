@@ -0,0 +1,20 @@
+-- Inbox: one row per reply to something of yours, see argot/inbox.py.
+CREATE TABLE IF NOT EXISTS notifications (
+  id         SERIAL PRIMARY KEY,
+  user_id    INTEGER NOT NULL REFERENCES users(id),
+  comment_id INTEGER NOT NULL REFERENCES comments(id),
+  time       TIMESTAMP NOT NULL,
+  read_at    TIMESTAMP
+);
+
+-- Marking a comment read, and not being told about it twice.
+CREATE UNIQUE INDEX IF NOT EXISTS notifications_user_comment_idx ON notifications(user_id, comment_id);
+-- Listing the inbox newest first, read or not, and just the unread part.
+CREATE INDEX IF NOT EXISTS notifications_user_idx ON notifications(user_id, id DESC);
+CREATE INDEX IF NOT EXISTS notifications_unread_idx ON notifications(user_id, id DESC) WHERE read_at IS NULL;
+-- Deleting a post takes its comments' notifications with it.
+CREATE INDEX IF NOT EXISTS notifications_comment_idx ON notifications(comment_id);
+
+-- Unread count, so polling /inbox/size is a primary key lookup. Maintained
+-- by argot.inbox, fixed up by `manage recount`.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS unread INTEGER NOT NULL DEFAULT 0;
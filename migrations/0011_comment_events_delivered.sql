@@ -0,0 +1,7 @@
+-- Nothing consumes "comment" events (argot.live reads the table directly),
+-- so they're now published as delivered. Clear out the ones that piled up
+-- in events_pending_idx before that.
+UPDATE events SET delivered_at = time WHERE kind = 'comment' AND delivered_at IS NULL;
+
+-- `manage prune` deletes delivered events by age.
+CREATE INDEX IF NOT EXISTS events_delivered_idx ON events(delivered_at) WHERE delivered_at IS NOT NULL;
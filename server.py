@@ -1,44 +1,58 @@
 import itertools
 
-from flask import Flask, request, abort
+from flask import Blueprint, Flask, request, abort
 from marshmallow import Schema, ValidationError, fields
+from marshmallow.validate import Range
 from flask_cors import CORS
 from flask_login import *
 
 import argot
 from argot.models import *
-
-from io import StringIO
-import sys
-
-from bs4 import BeautifulSoup
-import urllib
-from collections import defaultdict
-
-import discord
-from discord.ext import tasks
-from dotenv import dotenv_values
-import time
-config = dotenv_values(".env")
+from argot import feed, tree, serialize, tagquery, search, kdf, titles, events, lookup, cache, stream, bulk, metrics, ranking, adb, activity, inbox, live, wire
 
 import threading
 
-app = Flask(__name__)
-app.config["SECRET_KEY"] = "uh idk whats secret"
-CORS(app, supports_credentials=True)
+# Every route lives on this, and create_app puts it on an app. The Discord
+# bot runs in a process of its own (see argot/notifier.py), so web workers
+# never load discord.py.
+views = Blueprint("argot", __name__)
+# Shared by every app create_app makes; Flask-Login keeps its per-app state
+# on the app, and the user loader doesn't care which app it's in.
 login_manager = LoginManager()
-login_manager.init_app(app)
 
-intents = discord.Intents.default()
-intents.message_content = True
-client = discord.Client(intents=intents)
+def create_app():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "uh idk whats secret"
+    CORS(app, supports_credentials=True, expose_headers=["X-Next-Cursor"])
+    metrics.init_app(app)
+    wire.init_app(app)
+    login_manager.init_app(app)
+    app.before_request(open_db)
+    app.teardown_request(close_db)
+    app.register_blueprint(views)
+    return app
+
+def open_db():
+    db.connect(reuse_if_open=True)
+
+def close_db(exc):
+    # Hands the connection back to the pool rather than really closing it.
+    if not db.is_closed():
+        db.close()
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.select().where(User.id == int(user_id)).get()
+    return lookup.user(user_id)
+
+def nick_of(row):
+    """Nick of whoever wrote `row`, without a query if it was the current user."""
+    if current_user.is_authenticated and row.author_id_id == current_user.id:
+        return current_user.nick
+    return User.select(User.nick).where(User.id == row.author_id_id).scalar()
 
-def ago(x):
-    return datetime.now()-x.time
+def post_changed(post):
+    """Drop cached pages that show `post`. Call once the change has committed."""
+    cache.bump("posts", f"post:{post.id}", f"user:{nick_of(post)}")
 
 class PostSchema(Schema):
     title = fields.Str(required=True)
@@ -53,8 +67,31 @@ class CommentSchema(Schema):
     parent = fields.Int()
     private = fields.Bool()
 
+class ThreadQuerySchema(Schema):
+    parent = fields.Int()
+    after = fields.Int()
+    depth = fields.Int()
+    limit = fields.Int(validate=Range(min=1, max=tree.MAX_LIMIT))
+
 class PostsQuerySchema(Schema):
     pg = fields.Int()
+    after = fields.Str()
+    limit = fields.Int()
+    stream = fields.Str()
+    sort = fields.Str()
+
+class UserQuerySchema(Schema):
+    after = fields.Str()
+    limit = fields.Int()
+    stream = fields.Str()
+
+class InboxQuerySchema(Schema):
+    after = fields.Int()
+    limit = fields.Int()
+    all = fields.Bool()
+
+class MarkReadSchema(Schema):
+    comments = fields.List(fields.Int())
 
 class LoginSchema(Schema):
     nick = fields.Str(required=True)
@@ -66,39 +103,70 @@ class SignupSchema(Schema):
     bio = fields.Str()
     email = fields.Email()
 
-# notifs = defaultdict(set)
 
-CHANNEL = 1194118320660680846
-new_posts = []
-posts_lock = threading.Lock()
-
-@app.route("/posts/<post_id>", methods=["GET"])
+@views.route("/posts/<int:post_id>", methods=["GET"])
+@cache.cached(lambda post_id: [f"post:{post_id}"])
 def get_post(post_id):
-    post_id = int(post_id)
-    if len(Post.select().where(Post.id == post_id)) == 0 :
-        return f"A post with the ID {post_id} does not exist!", 404
-    p = Post.select().where(Post.id == post_id).get().to_dict()
-    if p["private"] == True and not current_user.is_authenticated:
-        return f"A post with the ID {post_id} does not exist!", 404
-    cs = Comment.select().where((Comment.post_id == post_id) & (Comment.parent_id == None))
-    if not current_user.is_authenticated:
-        cs = filter(lambda c: not c.private, cs)
-    cs = [c.to_mini_dict() for c in cs]
+    try:
+        args = ThreadQuerySchema(only=["depth", "limit"]).load(request.args)
+    except ValidationError:
+        return "Type check failed!", 400
+
+    post = lookup.get_or_404(Post, post_id, serialize.post_query())
+    if post.private == True and not current_user.is_authenticated:
+        lookup.not_found(Post, post_id)
+    p = serialize.posts([post])[0]
+
+    cs, more = tree.load(post_id, private=current_user.is_authenticated, **args)
     p["comments"] = cs
+    p["more"] = more
 
     return p, 200
 
-@app.route("/comments/<comment_id>", methods=["GET"])
+@views.route("/posts/<int:post_id>/comments", methods=["GET"])
+def get_post_comments(post_id):
+    """The "load more" end of get_post: replies under `parent` after `after`."""
+    try:
+        args = ThreadQuerySchema().load(request.args)
+    except ValidationError:
+        return "Type check failed!", 400
+
+    p = lookup.get_or_404(Post, post_id)
+    if p.private == True and not current_user.is_authenticated:
+        lookup.not_found(Post, post_id)
+
+    cs, more = tree.load(post_id, private=current_user.is_authenticated, **args)
+    return {"comments": cs, "more": more}, 200
+
+@views.route("/comments/<int:comment_id>", methods=["GET"])
 def get_comment(comment_id):
-    comment_id = int(comment_id)
-    if len(Comment.select().where(Comment.id == comment_id)) == 0:
-        return f"A comment with the ID {comment_id} does not exist!", 404
-    c = Comment.select().where(Comment.id == comment_id).get().to_dict()
-    return c.to_flat_dict(), 200
+    c = lookup.get_or_404(Comment, comment_id, serialize.comment_query())
+    if not current_user.is_authenticated:
+        # Public comments on private posts are still private.
+        if c.private == True or lookup.get(Post, c.post_id_id).private == True:
+            lookup.not_found(Comment, comment_id)
+    return serialize.comments([c])[0], 200
+
+@views.route("/comments/<int:comment_id>/context", methods=["GET"])
+def get_comment_context(comment_id):
+    """A comment in its thread: everything it's replying to, and its replies."""
+    try:
+        args = ThreadQuerySchema(only=["depth", "limit"]).load(request.args)
+    except ValidationError:
+        return "Type check failed!", 400
 
-@app.route("/posts/<post_id>", methods=["PUT"])
+    private = current_user.is_authenticated
+    found = tree.context(comment_id, private=private, **args)
+    if found is None:
+        lookup.not_found(Comment, comment_id)
+    post_id, cs = found
+    post = lookup.get(Post, post_id)
+    if post.private == True and not private:
+        lookup.not_found(Comment, comment_id)
+    return {"post": post_id, "comments": cs}, 200
+
+@views.route("/posts/<int:post_id>", methods=["PUT"])
 def update_post(post_id):
-    post_id = int(post_id)
     req = request.json
     
     try:
@@ -106,10 +174,7 @@ def update_post(post_id):
     except ValidationError:
         return "Type check failed!", 400
     
-    if len(Post.select().where(Post.id == post_id)) == 0:
-        return f"A post with the ID {post_id} does not exist!", 404
-    
-    p = Post.select().where(Post.id == post_id).get()
+    p = lookup.get_or_404(Post, post_id)
     if "title" in req:
         p.title = req["title"]
     if "link" in req:
@@ -117,27 +182,25 @@ def update_post(post_id):
     if "content" in req:
         p.content = req["content"]
     p.save()
+    post_changed(p)
 
     return "", 200
 
-@app.route("/posts/<post_id>", methods=["DELETE"])
+@views.route("/posts/<int:post_id>", methods=["DELETE"])
 @login_required
 def delete_post(post_id):
-    post_id = int(post_id)
-
-    if len(Post.select().where(Post.id == post_id)) == 0:
-        return f"A post with the ID {post_id} does not exist!", 404
-
-    post = Post.get(Post.id == post_id)
-    if post.author_id.id != current_user.id:
+    post = lookup.get_or_404(Post, post_id)
+    if post.author_id_id != current_user.id:
         return "Not yours to delete!", 403    
 
-    TagMap.delete().where(TagMap.post_id == post_id).execute()    
-    post.delete_instance()
+    commenters = bulk.delete_post(post)
+    tagquery.changed()
+    post_changed(post)
+    cache.bump(*[f"user:{nick}" for nick in commenters])
     
     return "", 200
 
-@app.route("/posts", methods=["POST"])
+@views.route("/posts", methods=["POST"])
 @login_required
 def add_post():
     req = request.json
@@ -147,39 +210,51 @@ def add_post():
     except ValidationError:
         return "Type check failed!", 400
 
-    if "title" not in req or req["title"] == "":
+    # Without a title we post right away with the link standing in for it,
+    # and fill in the page's real title once it's been fetched.
+    guess = "title" not in req or req["title"] == ""
+    if guess:
         if "link" not in req:
             return "Can't guess title.", 400
-
-        src = urllib.request.urlopen(req["link"])
-        soup = BeautifulSoup(src, "html")
-        title = soup.title.string
+        title = req["link"]
     else:
         title = req["title"]
 
     tags = list(set(req["tags"]))
-    for tag in tags:
-        if len(Tag.select().where(Tag.id == tag)) == 0:
-            return f"Tag {tag} doesn't exist.", 404
+    missing = bulk.missing_tags(tags)
+    if len(missing) != 0:
+        return f"Tag {min(missing)} doesn't exist.", 404
 
-    p = Post.new(
+    p = bulk.create_post(
         req["link"],
         title,
         current_user.id,
         content=req["content"],
         private=req["private"],
+        tags=tags,
+        # Give the title fetch a chance to finish before it gets announced.
+        announce_in=titles.DEADLINE if guess else 0,
     )
+    tagquery.changed()
+    post_changed(p)
 
-    for tag in tags:
-        TagMap.create(post_id=p.id, tag_id=tag)
-
-    posts_lock.acquire();
-    new_posts.append(p.id)
-    posts_lock.release()
+    if guess:
+        nick = current_user.nick
+        titles.fetch_later(req["link"], lambda meta: fill_title(p.id, title, meta, nick))
         
     return str(p.id), 200
 
-@app.route("/comments", methods=["POST"])
+@in_background
+def fill_title(post_id, placeholder, meta, nick):
+    if meta["title"] is not None:
+        # Leave it alone if someone's edited the title in the meantime.
+        n = Post.update(title=meta["title"]).where(
+            (Post.id == post_id) & (Post.title == placeholder)
+        ).execute()
+        if n != 0:
+            cache.bump("posts", f"post:{post_id}", f"user:{nick}")
+
+@views.route("/comments", methods=["POST"])
 @login_required
 def add_comment():
     req = request.json
@@ -188,94 +263,99 @@ def add_comment():
     except ValidationError:
         return "Type check failed!", 400
 
-    if len(Post.select().where(Post.id == int(req["post"]))) == 0:
-        return f"A post with the ID {post_id} does not exist!", 404
+    post = lookup.get_or_404(Post, req["post"])
 
+    parent = None
     if "parent" in req:
-        post = Post.select().where(Post.id == req['post']).get()
-        ids = [c.id for c in post.comments]
-        if int(req["parent"]) not in ids:
+        parent = lookup.get(Comment, req["parent"])
+        if parent is None or parent.post_id_id != post.id:
             return f"Can't reply to comment from other post.", 400
 
-    c = Comment.new(
-        req["post"],
-        current_user.id,
-        req["content"],
-        parent=req["parent"] if "parent" in req else None,
-        private=req["private"] if "private" in req else False,
-    )
+    with db.atomic():
+        c = Comment.new(
+            req["post"],
+            current_user.id,
+            req["content"],
+            parent=req["parent"] if "parent" in req else None,
+            private=req["private"] if "private" in req else False,
+        )
+        events.publish("comment", c.id, broadcast=True)
+        orig_author = (parent or post).author_id_id
+        if orig_author != current_user.id:
+            inbox.notify(orig_author, c)
+    # The post's comment count and activity time changed too.
+    post_changed(post)
+    cache.bump(f"user:{current_user.nick}")
 
-    if "parent" in req:
-        orig_author = Comment.select().where(Comment.id == req['parent']).get().author_id.id
-    else:
-        orig_author = Post.select().where(Post.id == req['post']).get().author_id.id
-    # if orig_author != current_user.id:
-    #     notifs[orig_author].add(c)
     return str(c.id), 200
 
+@views.route("/inbox", methods=["GET"])
+@login_required
+def get_inbox():
+    """Replies to you, newest first. Just the unread ones unless ?all=true."""
+    try:
+        args = InboxQuerySchema().load(request.args)
+    except ValidationError:
+        return "Type check failed!", 400
+
+    limit = feed.clamp(args.get("limit", feed.PAGE_SIZE))
+    cs, cursor = inbox.page(current_user.id, not args.get("all", False), args.get("after"), limit)
+    headers = {"X-Next-Cursor": cursor} if cursor is not None else {}
+    return cs, 200, headers
 
-# @app.route("/inbox", methods=["GET"])
-# @login_required
-# def get_inbox():
-#     return [c.to_flat_dict() for c in list(notifs[current_user.id])], 200
-
-# @app.route("/inbox/read/<comment_id>", methods=["POST"])
-# @login_required
-# def mark_read(comment_id):
-#     try:
-#         to_remove = None
-#         for c in notifs[current_user.id]:
-#             if c.id == int(comment_id):
-#                 to_remove = c
-#                 break
-#         notifs[current_user.id].remove(to_remove)
-#         return "", 200
-#     except KeyError:
-#         return "Not in inbox!", 404
-
-# @app.route("/inbox/size", methods=["GET"])
-# @login_required
-# def get_inbox_sz():
-#     return {"size": len(notifs[current_user.id])}, 200
-
-@app.route("/comments/<comment_id>", methods=["PUT"])
+@views.route("/inbox/read/<int:comment_id>", methods=["POST"])
+@login_required
+def mark_read(comment_id):
+    if inbox.mark_read(current_user.id, [comment_id]) == 0:
+        return "Not in inbox!", 404
+    return "", 200
+
+@views.route("/inbox/read", methods=["POST"])
+@login_required
+def mark_all_read():
+    """Mark the comments listed in the body read, or everything without one."""
+    req = request.get_json(silent=True) or {}
+    try:
+        req = MarkReadSchema().load(req)
+    except ValidationError:
+        return "Type check failed!", 400
+    return {"read": inbox.mark_read(current_user.id, req.get("comments"))}, 200
+
+@views.route("/inbox/size", methods=["GET"])
+@login_required
+def get_inbox_sz():
+    return {"size": inbox.size(current_user.id)}, 200
+
+@views.route("/comments/<int:comment_id>", methods=["PUT"])
 @login_required
 def update_comment(comment_id):
     req = request.json
-    comment_id = int(comment_id)
     
     if "content" not in req:
         return "Need new content.", 400    
 
-    query = Comment.select().where(Comment.id == comment_id)
-    if len(query) == 0:
-        return f"A comment with the ID {comment_id} does not exist!", 404
-
-    c = query.get()
+    c = lookup.get_or_404(Comment, comment_id)
     c.content = req["content"]
     c.save()
+    cache.bump(f"post:{c.post_id_id}", f"user:{nick_of(c)}")
     
     return "", 200
 
-@app.route("/comments/<comment_id>", methods=["DELETE"])
+@views.route("/comments/<int:comment_id>", methods=["DELETE"])
 @login_required
 def delete_comment(comment_id):
-    comment_id = int(comment_id)
-
-    if len(Comment.select().where(Comment.id == comment_id)) == 0:
-        return f"A comment with the ID {comment_id} does not exist!", 404
-
-    comment = Comment.get(Comment.id == comment_id)
-    if comment.author_id.id != current_user.id:
+    comment = lookup.get_or_404(Comment, comment_id)
+    if comment.author_id_id != current_user.id:
         return "Not yours to delete!", 403    
     
-    comment.content = "[deleted]"
-    comment.save()
+    comment.remove()
+    post_changed(lookup.get(Post, comment.post_id_id))
+    cache.bump(f"user:{current_user.nick}")
     
     return "", 200
 
 
-@app.route("/login", methods=["POST"])
+@views.route("/login", methods=["POST"])
 def login():
     req = request.json
 
@@ -284,24 +364,27 @@ def login():
     except ValidationError:
         return "Type check failed!", 400
 
-    user = User.select().where(User.nick == req["nick"])
-
-    if len(user) == 0:
+    user = lookup.find(User, User.nick == req["nick"])
+    if user is None:
         return "No such user.", 400
-    user = user.get()
 
-    hash = hashlib.scrypt(
-        req["password"].encode(), salt=user.salt.encode(), n=16384, r=8, p=1
-    ).hex()
-    if user.hash != hash:
+    try:
+        ok, stale = kdf.verify(req["password"], user.salt, user.hash)
+    except kdf.Busy:
+        return "Too many logins at once, try again shortly.", 503, {"Retry-After": "1"}
+    if not ok:
         return "Invalid password.", 403
+    if stale:
+        kdf.rehash(req["password"], in_background(lambda hash, salt: (User.update(
+            hash=hash, salt=salt
+        ).where(User.id == user.id).execute(), lookup.forget_user(user.id))))
 
-    print(f"Logged in {user.nick}")
+    metrics.log(event="login", user=user.nick)
     # TODO look into REMEMBER_COOKIE_DURATION
     login_user(user, remember=True)
     return {"nick": user.nick, "id": user.id}, 200
 
-@app.route("/signup", methods=["POST"])
+@views.route("/signup", methods=["POST"])
 def signup():
     req = request.json
 
@@ -310,8 +393,7 @@ def signup():
     except ValidationError:
         return "Type check failed!", 400
 
-    user = User.select().where(User.nick == req["nick"])
-    if len(user) != 0:
+    if User.select().where(User.nick == req["nick"]).exists():
         return f"User with nick '{req['nick']}' already exists!", 400
 
     # TODO: This is a very scuffed system for enforcing a whitelist.
@@ -319,204 +401,267 @@ def signup():
     if req["nick"] not in whitelist:
         return "Not on the whitelist.", 403
 
-    User.new(
-        req["nick"], req["password"],
-        bio = req["bio"] if "bio" in req else None,
-        email = req["email"] if "email" in req else None,
-    )
+    try:
+        User.new(
+            req["nick"], req["password"],
+            bio = req["bio"] if "bio" in req else None,
+            email = req["email"] if "email" in req else None,
+        )
+    except kdf.Busy:
+        return "Too many signups at once, try again shortly.", 503, {"Retry-After": "1"}
     return "", 200
 
-@app.route("/tags/<name>", methods=["POST"])
+@views.route("/tags/<name>", methods=["POST"])
 @login_required
 def add_tag(name):
     name = str(name)
     if not name.isalnum():
         return "Invalid character in tag name.", 400
-    if len(Tag.select().where(Tag.name == name)) != 0:
+    if Tag.select().where(Tag.name == name).exists():
         return "Tag already exists.", 400
 
     t = Tag.create(name=name)
+    cache.bump("tags")
     return str(t.id), 200
 
-@app.route("/tags", methods=["GET"])
+@views.route("/tags", methods=["GET"])
+@cache.cached(lambda: ["tags"])
 def get_tags():
     out = [{"name": t.name, "id": t.id} for t in Tag.select()]    
     return out, 200
 
-@app.route("/users/<user_name>", methods=["GET"])
-def get_user(user_name):    
-    query = User.select().where(User.nick == str(user_name))
-    if len(query) == 0:
+@views.route("/users/<user_name>", methods=["GET"])
+@cache.cached(lambda user_name: [f"user:{user_name}"])
+def get_user(user_name):
+    """A user, with their posts and comments mixed together newest first."""
+    try:
+        args = UserQuerySchema().load(request.args)
+    except ValidationError:
+        return "Type check failed!", 400
+    after = None
+    if "after" in args:
+        after = activity.decode_cursor(args["after"])
+        if after is None:
+            return "Bad cursor!", 400
+
+    user = lookup.find(User, User.nick == str(user_name))
+    if user is None:
         return "No such user.", 404
-    user = query.get()
-    posts = sorted(user.posts, key=ago)
-    comments = sorted(user.comments, key=ago)
-    if not current_user.is_authenticated:
-        posts = filter(lambda p: not p.private, posts)
-        comments = filter(lambda c: not c.private, comments)
-    
-    out = {
+    private = current_user.is_authenticated
+    if private:
+        num_posts, num_comments = user.num_posts, user.num_comments
+    else:
+        # The stored counts take in private things too.
+        num_posts, num_comments = activity.public_counts(user.id)
+    head = {
         "nick": user.nick,
         "bio": user.bio,
-        "posts": [p.to_dict() for p in posts],
-        "comments": [c.to_flat_dict() for c in comments],
+        "num_posts": num_posts,
+        "num_comments": num_comments,
     }
-    
-    return out, 200
 
-@app.route("/posts/<post_id>/tags", methods=["PUT"])
+    fmt = stream.wanted()
+    if fmt is not None:
+        return stream.respond(stream.document(head, [
+            ("activity", None, activity.everything(user.id, private, after)),
+        ], fmt), fmt)
+
+    items, cursor = activity.page(user.id, private, after, feed.clamp(args.get("limit", feed.PAGE_SIZE)))
+    headers = {"X-Next-Cursor": cursor} if cursor is not None else {}
+    return {**head, "activity": items}, 200, headers
+
+@views.route("/posts/<int:post_id>/tags", methods=["PUT"])
 @login_required
 def add_post_tag(post_id):
-    if len(Post.select().where(Post.id == post_id)) == 0:
-        return f"A post with the ID {post_id} does not exist!", 404
+    post = lookup.get_or_404(Post, post_id)
     if "name" not in request.args:
         return "Need a tag name!", 400
     tag_name = str(request.args["name"])
 
-    tq = Tag.select().where(Tag.name == tag_name)
-    if len(tq) == 0:
+    tag = lookup.find(Tag, Tag.name == tag_name)
+    if tag is None:
         return f"A tag with the name {tag_name} does not exist!", 404
-    tag = tq.get()
 
-    query = TagMap.select().where(
-        (TagMap.post_id == post_id) & (TagMap.tag_id == tag.id)
-    )
-    if len(query) != 0:
-        i = query.get()
-        return str(query.get().id), 200
+    tm = TagMap.get_or_none((TagMap.post_id == post_id) & (TagMap.tag_id == tag.id))
+    if tm is not None:
+        return str(tm.id), 200
 
     tm = TagMap.create(post_id=post_id, tag_id=tag.id)
+    tagquery.changed()
+    post_changed(post)
     return str(tm.id), 200
 
-@app.route("/posts/search", methods=["PUT"])
-def search_posts():
-    term = request.data.decode()    
-    posts = Post.select().where(Match(Post.content, term))
-    posts_titles = Post.select().where(Match(Post.title, term))
-    posts_links = Post.select().where(Match(Post.link, term))
-    if not current_user.is_authenticated:
-        posts = list(filter(lambda p: not p.private, posts))
-        posts_titles = list(filter(lambda p: not p.private, posts_titles))
-        posts_links = list(filter(lambda p: not p.private, posts_links))
+class BulkTagSchema(Schema):
+    posts = fields.List(fields.Int(), required=True)
+    tags = fields.List(fields.Int(), required=True)
 
-    posts = list(set(posts+posts_titles+posts_links))    
-    posts = sorted(list(posts), key=ago)
-    return [p.to_dict() for p in posts], 200
+@views.route("/posts/tags", methods=["PUT"])
+@login_required
+def tag_posts():
+    try:
+        # None for a missing or non-JSON body, which load() turns down too.
+        req = BulkTagSchema().load(request.get_json(silent=True))
+    except ValidationError:
+        return "Type check failed!", 400
 
-@app.route("/comments/search", methods=["PUT"])
-def search_comments():
-    term = request.data.decode()    
-    cs = Comment.select().where(Match(Comment.content, term))
-    if not current_user.is_authenticated:
-        cs = filter(lambda c: not c.private, cs)
-    cs = sorted(list(cs), key=ago)    
-    return [c.to_flat_dict() for c in cs], 200
+    missing = bulk.missing_posts(req["posts"])
+    if len(missing) != 0:
+        return f"A post with the ID {min(missing)} does not exist!", 404
+    missing = bulk.missing_tags(req["tags"])
+    if len(missing) != 0:
+        return f"Tag {min(missing)} doesn't exist.", 404
+
+    added = bulk.tag_posts(set(req["posts"]), set(req["tags"]))
+    if added != 0:
+        tagquery.changed()
+        authors = (User
+                   .select(User.nick)
+                   .join(Post, on=(Post.author_id == User.id))
+                   .where(Post.id << req["posts"])
+                   .distinct())
+        cache.bump("posts", *[f"post:{id}" for id in set(req["posts"])], *[f"user:{u.nick}" for u in authors])
+    return {"added": added}, 200
+
+@views.route("/posts/import", methods=["POST"])
+@login_required
+def import_posts():
+    """NDJSON of posts (see argot/bulk.py), all by the current user."""
+    report = bulk.import_posts(request.stream, current_user.nick, trusted=False)
+    if report["posts"] != 0:
+        tagquery.changed()
+        cache.bump("posts", "tags", f"user:{current_user.nick}")
+    return report, 200
+
+class SearchQuerySchema(Schema):
+    limit = fields.Int()
+    offset = fields.Int()
+    stream = fields.Str()
+
+def run_search(kind):
+    try:
+        args = SearchQuerySchema().load(request.args)
+    except ValidationError:
+        return "Type check failed!", 400
 
-@app.route("/posts/query", methods=["PUT"])
-def query_posts():
-    query = request.data.decode()
-    intersection = None
-
-    tags = []
-    excl = []
-    excluding = False
-    pos = 0
-    # Real gross, I know. I swear it's just a quick hack.
-    for i, c in enumerate(query):
-        if c == '|' and intersection is None:
-            intersection = False
-        elif c == '+' and intersection is None:
-            intersection = True
-        elif c == '+' and intersection == False:
-            return "Mixing and matching +/| operators not supported!", 400
-        elif c == '|' and intersection == True:
-            return "Mixing and matching +/| operators not supported!", 400
-        if c in ('|', '+'):            
-            tags.append(query[pos:i])
-            pos = i + 1
-        elif c == '-':
-            if excluding: excl.append(query[pos:i])
-            else:
-                tags.append(query[pos:i])
-                excluding = True
-            pos = i + 1
-    if excluding: excl.append(query[pos:])
-    else: tags.append(query[pos:])
-
-    # NOTE: the way the parsing works means that just exclusions
-    # should erroneously result in an empty first exclusion tag
-    if tags[0] == '':        
-        res = Post.tag_exclude(excl)
-    else:
-        res = Post.tag_query(tags, excl, intersection=intersection)
-    return res, 200
+    term = request.data.decode(errors="replace")
+    offset = args.get("offset", 0)
+    fmt = stream.wanted()
+    if fmt is not None:
+        results = search.results(kind, term, offset=offset, private=current_user.is_authenticated)
+        return stream.respond(stream.array(results, fmt), fmt)
+
+    out = search.run(
+        kind,
+        term,
+        limit=args.get("limit", search.PAGE_SIZE),
+        offset=offset,
+        private=current_user.is_authenticated,
+    )
+    return out, 200
 
-@app.route("/logout", methods=["POST"])
-def logout():
-    logout_user()
-    return "", 200
+@views.route("/posts/search", methods=["PUT"])
+def search_posts():
+    return run_search("posts")
+
+@views.route("/comments/search", methods=["PUT"])
+def search_comments():
+    return run_search("comments")
 
-# page_size = 10
+@views.route("/search", methods=["PUT"])
+def search_everything():
+    return run_search("everything")
 
-@app.route("/posts", methods=["GET"])
-def get_posts():
+@views.route("/posts/query", methods=["PUT"])
+def query_posts():
     try:
-        PostsQuerySchema().validate(request.args)
+        args = PostsQuerySchema().load(request.args)
     except ValidationError:
         return "Type check failed!", 400
 
-    page = int(request.args["pg"]) if "pg" in request.args else 0
-    ps = Post.select().order_by(Post.time.desc())
-    # ps = itertools.islice(ps, page_size*page, page_size*(page+1))
+    try:
+        expr = tagquery.parse(request.data.decode(errors="replace"))
+    except tagquery.ParseError as e:
+        return f"Bad query: {e}", 400
+
+    sort = args.get("sort", "new")
+    if sort not in feed.SORTS:
+        return f"Can't sort by {sort}.", 400
+    after = None
+    if "after" in args:
+        after = feed.decode_cursor(args["after"], sort)
+        if after is None:
+            return "Bad cursor!", 400
+    page = args.get("pg", 0)
+    limit = args.get("limit", feed.PAGE_SIZE)
+
+    fmt = stream.wanted()
+    if fmt is not None:
+        ps = feed.everything(after, current_user.is_authenticated, tagquery.where(expr), sort=sort)
+        return stream.respond(stream.array(ps, fmt), fmt)
+
+    ps, cursor = tagquery.query(
+        expr,
+        after=after,
+        pg=page,
+        limit=limit,
+        private=current_user.is_authenticated,
+        sort=sort,
+    )
+    headers = {"X-Next-Cursor": cursor} if cursor is not None else {}
+    return ps, 200, headers
 
-    if not current_user.is_authenticated:
-        ps = filter(lambda p: not p.private, ps)
-    
-    return [p.to_dict() for p in ps], 200
+@views.route("/stats", methods=["GET"])
+def get_stats():
+    return {"kdf": kdf.pool.stats(), "db": db.stats(), "adb": adb.pool.stats(), "live": live.hub.stats(), "cache": cache.stats()}, 200
 
-# @client.event
-# async def on_guild_join(guild):
-#     pass
+@views.route("/metrics", methods=["GET"])
+def get_metrics():
+    text = metrics.render(kdf=kdf.pool.stats(), db=db.stats(), adb=adb.pool.stats(), live=live.hub.stats(), cache=cache.stats())
+    return text, 200, {"Content-Type": "text/plain; version=0.0.4"}
 
-# @client.event
-# async def on_guild_remove(guild):
-#     pass
+@views.route("/logout", methods=["POST"])
+def logout():
+    logout_user()
+    return "", 200
 
+@views.route("/posts", methods=["GET"])
+@cache.cached(lambda: ["posts"])
+def get_posts():
+    try:
+        args = PostsQuerySchema().load(request.args)
+    except ValidationError:
+        return "Type check failed!", 400
 
-def post_to_embed(p):
-    embed = discord.Embed(
-        title=p.title,
-        url=p.link,
-        description=f"{p.content}\n\n[(discuss)](https://argot.jklsnt.com/posts/{p.id})"
+    sort = args.get("sort", "new")
+    if sort not in feed.SORTS:
+        return f"Can't sort by {sort}.", 400
+    after = None
+    if "after" in args:
+        after = feed.decode_cursor(args["after"], sort)
+        if after is None:
+            return "Bad cursor!", 400
+    page = args.get("pg", 0)
+    limit = args.get("limit", feed.PAGE_SIZE)
+
+    fmt = stream.wanted()
+    if fmt is not None:
+        ps = feed.everything(after, current_user.is_authenticated, sort=sort)
+        return stream.respond(stream.array(ps, fmt), fmt)
+
+    ps, cursor = feed.latest(
+        after=after,
+        pg=page,
+        limit=limit,
+        private=current_user.is_authenticated,
+        sort=sort,
     )
-    embed.set_author(name=p.author_id.nick, url=f"https://argot.jklsnt.com/users/{p.author_id.nick}")
-    if len(p.tags) != 0:
-        embed.add_field(name="tags", value=", ".join([t.tag_id.name for t in p.tags]))
-    return embed
-
-@tasks.loop(seconds=1.0)
-async def notify_people():
-    global new_posts
-    if posts_lock.acquire(blocking=False):
-        try:
-            for i in new_posts:
-                p = Post.select().where(Post.id == i).get()
-                embed = post_to_embed(p)
-                await client.get_channel(CHANNEL).send(embed=embed)
-            new_posts = []
-        except:
-            # Don't die with the lock on us. That'd be bad.
-            pass
-        posts_lock.release()
-    
-@client.event
-async def on_ready():    
-    await client.wait_until_ready()
-    notify_people.start()
+    headers = {"X-Next-Cursor": cursor} if cursor is not None else {}
+    return ps, 200, headers
+
+# What gunicorn (server:app) and async_server.py serve.
+app = create_app()
 
 if __name__ == '__main__':
-    bot = threading.Thread(target=lambda: client.run(config["DISCORD_SECRET"]))    
-    bot.start()        
+    # Run the Discord bot alongside with `python -m argot.manage notifier`.
+    threading.Thread(target=ranking.run, daemon=True).start()
     app.run(debug=True)
-
-    
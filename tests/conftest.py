@@ -0,0 +1,59 @@
+"""Shared fixtures.
+
+Tests that need Postgres take `database`, which wipes a scratch database
+(TEST_DB_NAME, argot_test by default), creating it if needed, and migrates
+it up from nothing once per run. They're skipped if Postgres isn't there.
+The database is shared by the whole run, so tests make their own users with
+`make_user` rather than counting on what's in there.
+"""
+import contextlib
+import io
+import itertools
+
+import psycopg2
+import pytest
+
+from argot.models import *
+from argot import config
+from argot import migrate as schema
+
+NAME = config.get("TEST_DB_NAME", "argot_test")
+
+@pytest.fixture(scope="session")
+def database():
+    if NAME == "argot":
+        pytest.exit("Refusing to wipe the real database.")
+    params = db.web.connect_params
+    try:
+        conn = psycopg2.connect(dbname="postgres", **params)
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"No Postgres to test against: {e}")
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT 1 FROM pg_database WHERE datname = %s", (NAME,))
+        if cur.fetchone() is None:
+            cur.execute(f'CREATE DATABASE "{NAME}"')
+    conn.close()
+
+    db.init(NAME, **params)
+    db.execute_sql("DROP SCHEMA public CASCADE")
+    db.execute_sql("CREATE SCHEMA public")
+    with contextlib.redirect_stdout(io.StringIO()):
+        schema.migrate()
+    yield db
+    db.close()
+
+nicks = itertools.count()
+
+@pytest.fixture
+def make_user(database):
+    """make_user(password=None) -> a new User with a nick nobody else has.
+
+    Only users given a password can log in; the rest skip the hashing.
+    """
+    def make(password=None):
+        nick = f"user{next(nicks)}"
+        if password is not None:
+            return User.new(nick, password)
+        return User.create(nick=nick, hash="", salt="")
+    return make
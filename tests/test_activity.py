@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+from argot import activity
+from argot.models import *
+
+def test_cursor_round_trip():
+    row = ("comment", 42, datetime(2024, 1, 31, 12, 30, 5, 123456))
+    assert activity.decode_cursor(activity.encode_cursor(row)) == (row[2], "comment", 42)
+
+def test_bad_cursors():
+    for cursor in ["", "garbage", "2024-01-31T12:30:05_post", "2024-01-31T12:30:05_tag_1",
+                   "2024-01-31T12:30:05_post_x", "notadate_post_1"]:
+        assert activity.decode_cursor(cursor) is None
+
+def timeline(user_id, private):
+    return [(kind, id) for kind, id, _ in activity.query(user_id, private)]
+
+def test_private_posts_hide_their_comments(make_user):
+    user = make_user()
+    start = datetime(2024, 1, 1)
+    shown = Post.new(None, "Shown", user.id, time=start)
+    hidden = Post.new(None, "Hidden", user.id, time=start + timedelta(minutes=1), private=True)
+    on_shown = Comment.new(shown.id, user.id, "a", time=start + timedelta(minutes=2))
+    on_hidden = Comment.new(hidden.id, user.id, "b", time=start + timedelta(minutes=3))
+    secret = Comment.new(shown.id, user.id, "c", time=start + timedelta(minutes=4), private=True)
+
+    assert timeline(user.id, True) == [
+        ("comment", secret.id), ("comment", on_hidden.id), ("comment", on_shown.id),
+        ("post", hidden.id), ("post", shown.id),
+    ]
+    assert timeline(user.id, False) == [("comment", on_shown.id), ("post", shown.id)]
+
+def test_pages_meet_up(make_user):
+    user = make_user()
+    start = datetime(2024, 1, 1)
+    post = Post.new(None, "Post", user.id, time=start)
+    for i in range(5):
+        Comment.new(post.id, user.id, str(i), time=start + timedelta(minutes=i // 2))
+
+    seen, after = [], None
+    while True:
+        items, cursor = activity.page(user.id, False, after, 2)
+        seen += [(i["type"], i["id"]) for i in items]
+        if cursor is None:
+            break
+        after = activity.decode_cursor(cursor)
+    assert seen == timeline(user.id, False)
+    assert len(seen) == 6
+
+def test_anonymous_counts_leave_out_private_things(make_user):
+    import server
+    client = server.app.test_client()
+    user = make_user("password")
+    shown = Post.new(None, "Shown", user.id)
+    hidden = Post.new(None, "Hidden", user.id, private=True)
+    Comment.new(shown.id, user.id, "a")
+    Comment.new(shown.id, user.id, "b", private=True)
+    Comment.new(hidden.id, user.id, "c")
+    Comment.new(shown.id, user.id, "d").remove()
+
+    r = client.get(f"/users/{user.nick}")
+    assert (r.json["num_posts"], r.json["num_comments"]) == (1, 1)
+    assert len(r.json["activity"]) == 3
+
+    client.post("/login", json={"nick": user.nick, "password": "password"})
+    r = client.get(f"/users/{user.nick}")
+    assert (r.json["num_posts"], r.json["num_comments"]) == (2, 3)
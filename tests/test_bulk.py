@@ -0,0 +1,50 @@
+import json
+from datetime import datetime, timezone
+
+from argot import bulk, ranking
+from argot.models import *
+
+def lines(*records):
+    return [json.dumps(r) for r in records]
+
+def test_aware_times(make_user):
+    importer = make_user().nick
+    report = bulk.import_posts(lines(
+        {"link": "https://example.com/utc", "time": "2024-01-31T12:00:00Z",
+         "comments": [{"content": "hi", "time": "2024-01-31T14:00:00+02:00"}]},
+        {"link": "https://example.com/naive", "time": "2024-01-31T12:00:00"},
+    ), importer)
+    assert report["errors"] == []
+    assert report["posts"] == 2
+
+    local = datetime(2024, 1, 31, 12, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    post = Post.get(Post.link == "https://example.com/utc")
+    assert post.time == local
+    assert post.time.tzinfo is None
+    # 14:00+02:00 is the same moment as the post.
+    assert post.last_activity == local
+    assert Post.get(Post.link == "https://example.com/naive").time == datetime(2024, 1, 31, 12)
+
+def test_bad_line_is_skipped(make_user):
+    importer = make_user().nick
+    report = bulk.import_posts(lines(
+        {"link": "https://example.com/ok"},
+        {"link": "https://example.com/bad", "time": "yesterday"},
+    ), importer)
+    assert report["posts"] == 1
+    assert [e["line"] for e in report["errors"]] == [2]
+
+def test_batch_failures_are_reported(make_user, monkeypatch):
+    importer = make_user().nick
+    def broken(*args):
+        raise TypeError("can't compare")
+    monkeypatch.setattr(ranking, "score", broken)
+    report = bulk.import_posts(lines(
+        {"link": "https://example.com/a"},
+        {"link": "https://example.com/b"},
+    ), importer, batch=1)
+    assert report["posts"] == 0
+    assert report["errors"] == [
+        {"line": 1, "to_line": 1, "error": "can't compare"},
+        {"line": 2, "to_line": 2, "error": "can't compare"},
+    ]
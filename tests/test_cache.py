@@ -0,0 +1,48 @@
+import pytest
+
+from argot import cache
+from argot.models import *
+
+@pytest.fixture
+def client(database, monkeypatch):
+    import server
+    monkeypatch.setattr(cache, "backend", cache.Memory(64))
+    return server.app.test_client()
+
+def test_hit_and_bump(client, make_user):
+    user = make_user()
+    post = Post.new(None, "Before", user.id)
+    assert client.get(f"/posts/{post.id}").json["title"] == "Before"
+
+    Post.update(title="After").where(Post.id == post.id).execute()
+    assert client.get(f"/posts/{post.id}").json["title"] == "Before"
+    cache.bump(f"post:{post.id}")
+    assert client.get(f"/posts/{post.id}").json["title"] == "After"
+
+def test_bump_reaches_unnormalized_ids(client, make_user):
+    user = make_user()
+    post = Post.new(None, "Before", user.id)
+    assert client.get(f"/posts/00{post.id}").json["title"] == "Before"
+
+    Post.update(title="After").where(Post.id == post.id).execute()
+    cache.bump(f"post:{post.id}")
+    assert client.get(f"/posts/00{post.id}").json["title"] == "After"
+
+def test_etags_without_a_backend(database, make_user, monkeypatch):
+    import server
+    monkeypatch.setattr(cache, "backend", None)
+    client = server.app.test_client()
+    post = Post.new(None, "Tagged", make_user().id)
+
+    r = client.get(f"/posts/{post.id}")
+    assert r.status_code == 200
+    tag = r.headers["ETag"]
+    r = client.get(f"/posts/{post.id}", headers={"If-None-Match": tag})
+    assert r.status_code == 304
+    assert r.data == b""
+
+    Post.update(title="Changed").where(Post.id == post.id).execute()
+    r = client.get(f"/posts/{post.id}", headers={"If-None-Match": tag})
+    assert r.status_code == 200
+    assert r.headers["ETag"] != tag
+    assert client.get("/posts/999999999").status_code == 404
@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta
+
+from argot import events
+from argot.models import *
+
+def test_broadcast_is_delivered(database):
+    e = events.publish("comment", 1, broadcast=True)
+    assert Event.get_by_id(e.id).delivered_at is not None
+    e = events.publish("post", 1)
+    assert Event.get_by_id(e.id).delivered_at is None
+
+def test_prune(database):
+    old = datetime.now() - timedelta(days=30)
+    stale = Event.create(kind="post", ref_id=1, time=old, available_at=old, delivered_at=old)
+    pending = Event.create(kind="post", ref_id=2, time=old, available_at=old)
+    fresh = events.publish("comment", 3, broadcast=True)
+
+    assert events.prune(7) >= 1
+    remaining = {e.id for e in Event.select(Event.id)}
+    assert stale.id not in remaining
+    assert pending.id in remaining
+    assert fresh.id in remaining
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+from argot import feed
+from argot.models import Post
+
+def test_cursor_round_trip():
+    post = Post(id=42, time=datetime(2024, 1, 31, 12, 30, 5, 123456))
+    cursor = feed.encode_cursor(post)
+    assert feed.decode_cursor(cursor) == (post.time, 42)
+
+def test_cursor_without_microseconds():
+    assert feed.decode_cursor("2024-01-31T12:30:05_7") == (datetime(2024, 1, 31, 12, 30, 5), 7)
+
+def test_bad_cursors():
+    for cursor in ["", "garbage", "2024-01-31T12:30:05", "2024-01-31T12:30:05_x", "notadate_7"]:
+        assert feed.decode_cursor(cursor) is None
+
+def test_hot_cursor_round_trip():
+    post = Post(id=42, hot=1234.5678901234567)
+    cursor = feed.encode_cursor(post, "hot")
+    assert feed.decode_cursor(cursor, "hot") == (post.hot, 42)
+    assert feed.decode_cursor("-3.5_7", "hot") == (-3.5, 7)
+
+def test_bad_hot_cursors():
+    for cursor in ["", "1.5", "1.5_x", "x_7", "nan_7", "inf_7", "-inf_7", "Infinity_7", "None_7"]:
+        assert feed.decode_cursor(cursor, "hot") is None
+
+def test_bad_hot_cursor_is_a_400(database):
+    import server
+    client = server.app.test_client()
+    assert client.get("/posts?sort=hot&after=nan_1").status_code == 400
+    assert client.get("/posts?sort=hot&after=1.5_1").status_code == 200
+
+def test_clamp():
+    assert feed.clamp(0) == 1
+    assert feed.clamp(-5) == 1
+    assert feed.clamp(10) == 10
+    assert feed.clamp(10 ** 6) == feed.MAX_PAGE_SIZE
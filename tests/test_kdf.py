@@ -0,0 +1,55 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from argot import kdf
+
+def test_hash_then_verify():
+    hash, salt = kdf.hash_password("hunter2")
+    assert hash.startswith("scrypt$")
+    assert kdf.verify("hunter2", salt, hash) == (True, False)
+    assert kdf.verify("hunter3", salt, hash) == (False, False)
+
+def test_encode_decode():
+    assert kdf.decode(kdf.encode((1024, 8, 2), "abcd")) == ((1024, 8, 2), "abcd")
+    # Bare hex is from before the cost was stored.
+    assert kdf.decode("abcd") == (kdf.LEGACY, "abcd")
+
+def test_stale_cost_wants_rehash():
+    salt = kdf.new_salt()
+    old = kdf.encode((1024, 8, 1), kdf.scrypt("pw", salt, 1024, 8, 1))
+    assert kdf.verify("pw", salt, old) == (True, (1024, 8, 1) != kdf.COST)
+    # Wrong passwords never ask for a rehash.
+    assert kdf.verify("nope", salt, old) == (False, False)
+
+def test_busy_when_full():
+    pool = kdf.Pool(1, 2)
+    release = threading.Event()
+    running = [pool.submit(release.wait) for _ in range(2)]
+    with pytest.raises(kdf.Busy):
+        pool.submit(release.wait)
+    release.set()
+    for f in running:
+        f.result()
+    assert pool.stats()["rejected"] == 1
+    assert pool.stats()["queue_depth"] == 0
+
+def test_rehash_saves():
+    saved = threading.Event()
+    got = []
+    kdf.rehash("pw", lambda hash, salt: (got.append((hash, salt)), saved.set()))
+    assert saved.wait(10)
+    hash, salt = got[0]
+    assert kdf.verify("pw", salt, hash) == (True, False)
+
+def test_rehash_failures_get_logged(capsys):
+    failed = Future()
+    failed.set_exception(RuntimeError("database is down"))
+    kdf.report(failed)
+    assert "database is down" in capsys.readouterr().out
+
+    ok = Future()
+    ok.set_result(None)
+    kdf.report(ok)
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,20 @@
+import json
+
+from argot import metrics
+from argot.models import Pool
+
+def test_apps_share_one_observer(database, capsys, monkeypatch):
+    import server
+    server.create_app()
+    app = server.create_app()
+    assert Pool.observers.count(metrics.observe) == 1
+
+    # Each query is counted once, not once per app.
+    monkeypatch.setattr(metrics, "REQUEST_LOG", True)
+    seen = []
+    monkeypatch.setattr(Pool, "observers", Pool.observers + [lambda sql, seconds: seen.append(sql)])
+    capsys.readouterr()
+    app.test_client().get("/tags")
+    logged = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    requests = [l for l in logged if l.get("event") == "request"]
+    assert requests[-1]["queries"] == len(seen)
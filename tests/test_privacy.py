@@ -0,0 +1,49 @@
+import pytest
+
+from argot.models import *
+
+@pytest.fixture
+def client(database):
+    import server
+    return server.app.test_client()
+
+@pytest.fixture
+def thread(make_user):
+    """A user with a public comment on a private post, and one on a public post."""
+    user = make_user("password")
+    hidden = Post.new(None, "Hidden", user.id, private=True)
+    shown = Post.new(None, "Shown", user.id)
+    return {
+        "nick": user.nick,
+        "on_private": Comment.new(hidden.id, user.id, "public comment, private post").id,
+        "on_public": Comment.new(shown.id, user.id, "public comment, public post").id,
+    }
+
+def test_comment_on_private_post(client, thread):
+    assert client.get(f"/comments/{thread['on_public']}").status_code == 200
+    assert client.get(f"/comments/{thread['on_private']}").status_code == 404
+
+    client.post("/login", json={"nick": thread["nick"], "password": "password"})
+    assert client.get(f"/comments/{thread['on_private']}").status_code == 200
+
+def test_replies_to_private_comments(client, make_user):
+    user = make_user("password")
+    post = Post.new(None, "Shown", user.id)
+    secret = Comment.new(post.id, user.id, "private", private=True)
+    reply = Comment.new(post.id, user.id, "public reply", parent=secret.id)
+    deeper = Comment.new(post.id, user.id, "public reply to that", parent=reply.id)
+    shown = Comment.new(post.id, user.id, "public")
+    answer = Comment.new(post.id, user.id, "public reply", parent=shown.id)
+
+    def replies(parent):
+        r = client.get(f"/posts/{post.id}/comments?parent={parent}")
+        assert r.status_code == 200
+        return [c["id"] for c in r.json["comments"]]
+
+    assert replies(shown.id) == [answer.id]
+    assert replies(secret.id) == []
+    assert replies(reply.id) == []
+
+    client.post("/login", json={"nick": user.nick, "password": "password"})
+    assert replies(secret.id) == [reply.id]
+    assert replies(reply.id) == [deeper.id]
@@ -0,0 +1,35 @@
+import pytest
+
+from argot import metrics
+
+@pytest.fixture
+def client(make_user):
+    import server
+    client = server.app.test_client()
+    user = make_user("password")
+    client.post("/login", json={"nick": user.nick, "password": "password"})
+    return client
+
+@pytest.mark.parametrize("method, url", [
+    ("GET", "/posts/x"),
+    ("GET", "/posts/x/comments"),
+    ("GET", "/comments/x"),
+    ("GET", "/comments/1x/context"),
+    ("PUT", "/posts/x"),
+    ("DELETE", "/posts/x"),
+    ("POST", "/inbox/read/x"),
+    ("PUT", "/comments/x"),
+    ("DELETE", "/comments/-1"),
+    ("PUT", "/posts/x/tags"),
+])
+def test_non_numeric_ids_are_404s(client, method, url):
+    assert client.open(url, method=method).status_code == 404
+
+def test_mark_read_not_in_inbox(client):
+    assert client.post("/inbox/read/999999999").status_code == 404
+
+def test_route_labels_leave_out_converters(client, capsys, monkeypatch):
+    monkeypatch.setattr(metrics, "REQUEST_LOG", True)
+    capsys.readouterr()
+    client.get("/posts/999999999")
+    assert '"route": "/posts/<post_id>"' in capsys.readouterr().out
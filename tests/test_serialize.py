@@ -0,0 +1,68 @@
+"""Every row gets its own author, whichever way the serializers get their rows."""
+import pytest
+
+from argot.models import *
+from argot import serialize, tree
+
+def test_posts_keep_their_authors(make_user):
+    us = [make_user() for _ in range(3)]
+    ps = [Post.new(f"https://example.com/{i}", f"post {i}", us[i % 3].id) for i in range(6)]
+    want = {p.id: us[i % 3].nick for i, p in enumerate(ps)}
+
+    rows = list(serialize.post_query().where(Post.id << list(want)))
+    assert all(r.author_id_id is not None for r in rows)
+    for got in [serialize.posts(rows), serialize.posts(list(want))]:
+        assert {p["id"]: p["author"] for p in got} == want
+
+def test_comments_keep_their_authors(make_user):
+    us = [make_user() for _ in range(3)]
+    post = Post.new("https://example.com/thread", "thread", us[0].id)
+    cs = [Comment.new(post.id, us[i % 3].id, f"comment {i}") for i in range(6)]
+    want = {c.id: us[i % 3].nick for i, c in enumerate(cs)}
+
+    rows = list(serialize.comment_query().where(Comment.id << list(want)))
+    assert all(r.author_id_id is not None for r in rows)
+    for got in [serialize.comments(rows), serialize.comments(list(want))]:
+        assert {c["id"]: c["author"] for c in got} == want
+
+    rows = list(tree.comment_query(Comment.post_id == post.id, private=True))
+    assert {r.id: r.author_id_id for r in rows} == {c.id: us[i % 3].id for i, c in enumerate(cs)}
+    loaded, _ = tree.load(post.id, private=True)
+    assert {c["id"]: c["author"] for c in loaded} == want
+
+@pytest.fixture
+def queries(monkeypatch):
+    """The SQL of every query run from here on."""
+    seen = []
+    monkeypatch.setattr(Pool, "observers", Pool.observers + [lambda sql, seconds: seen.append(sql)])
+    return seen
+
+def count(queries, f):
+    start = len(queries)
+    f()
+    return len(queries) - start
+
+def test_query_counts_stay_flat(make_user, queries):
+    us = [make_user() for _ in range(5)]
+    tags = [Tag.create(name=f"flat{i}") for i in range(3)]
+    post = Post.new("https://example.com/flat", "flat", us[0].id)
+    for i in range(50):
+        p = Post.new(f"https://example.com/flat/{i}", f"flat {i}", us[i % 5].id)
+        TagMap.create(post_id=p.id, tag_id=tags[i % 3].id)
+        Comment.new(post.id, us[i % 5].id, f"comment {i}")
+
+    def sizes(f):
+        return {n: count(queries, lambda: f(n)) for n in (5, 50)}
+
+    newest = lambda n: list(Post.select().order_by(Post.id.desc()).limit(n))
+    assert len(set(sizes(lambda n: serialize.posts(newest(n))).values())) == 1
+    assert len(set(sizes(lambda n: serialize.posts([p.id for p in newest(n)])).values())) == 1
+    on_post = lambda n: list(Comment.select().where(Comment.post_id == post.id).limit(n))
+    assert len(set(sizes(lambda n: serialize.comments(on_post(n))).values())) == 1
+
+    import server
+    client = server.app.test_client()
+    def listing(n):
+        r = client.get(f"/posts?limit={n}")
+        assert len(r.json) == n
+    assert len(set(sizes(listing).values())) == 1
@@ -0,0 +1,94 @@
+import pytest
+
+from argot.models import *
+from argot import tagquery
+from argot.tagquery import ParseError, parse
+
+def test_single_tag():
+    assert parse("rust") == ("tag", "rust")
+    assert parse("  rust  ") == ("tag", "rust")
+
+def test_plus_binds_tighter_than_or():
+    assert parse("a+b|c") == ("or", ("and", ("tag", "a"), ("tag", "b")), ("tag", "c"))
+    assert parse("a|b+c") == ("or", ("tag", "a"), ("and", ("tag", "b"), ("tag", "c")))
+
+def test_minus_binds_loosest():
+    assert parse("a|b-c") == ("and", ("or", ("tag", "a"), ("tag", "b")), ("not", ("tag", "c")))
+    assert parse("a+b-c") == ("and", ("and", ("tag", "a"), ("tag", "b")), ("not", ("tag", "c")))
+
+def test_left_associative():
+    assert parse("a-b-c") == ("and", ("and", ("tag", "a"), ("not", ("tag", "b"))), ("not", ("tag", "c")))
+
+def test_unary_not():
+    assert parse("-a") == ("not", ("tag", "a"))
+    assert parse("!a") == ("not", ("tag", "a"))
+    assert parse("a+!b") == ("and", ("tag", "a"), ("not", ("tag", "b")))
+    assert parse("--a") == ("not", ("not", ("tag", "a")))
+
+def test_parentheses():
+    assert parse("(rust|go)+tutorial-video") == (
+        "and",
+        ("and", ("or", ("tag", "rust"), ("tag", "go")), ("tag", "tutorial")),
+        ("not", ("tag", "video")),
+    )
+    assert parse("a-(b|c)") == ("and", ("tag", "a"), ("not", ("or", ("tag", "b"), ("tag", "c"))))
+
+@pytest.mark.parametrize("text", [
+    "", "   ", "a+", "+a", "a||b", "(a", "a)", "()", "a b", "a*b", "a+(b|)", "-",
+])
+def test_malformed(text):
+    with pytest.raises(ParseError):
+        parse(text)
+
+@pytest.mark.parametrize("text", [
+    "(" * 1000 + "a" + ")" * 1000,
+    "-" * 1000 + "a",
+    "+".join(["a"] * 500),
+    "a" * 5000,
+])
+def test_too_big(text):
+    with pytest.raises(ParseError):
+        parse(text)
+
+def test_biggest_allowed_compiles():
+    # As many tags and as much nesting as the caps allow still turns into SQL.
+    depth = tagquery.MAX_DEPTH - 1
+    text = "(" * depth + "|".join(["t"] * tagquery.MAX_TAGS) + ")" * depth
+    node = parse("-" + text)
+    sql, params = Post.select(Post.id).where(tagquery.to_sql(node)).sql()
+    assert len(params) == tagquery.MAX_TAGS
+
+def test_to_sql_params():
+    sql, params = Post.select(Post.id).where(tagquery.to_sql(parse("a+b-c"))).sql()
+    assert params == ["a", "b", "c"]
+    assert sql.count("NOT") == 1
+
+def test_bad_query_is_a_400(database):
+    import server
+    client = server.app.test_client()
+    for body in ["a+", "(" * 1000, "+".join(["a"] * 500)]:
+        r = client.put("/posts/query", data=body)
+        assert r.status_code == 400
+        assert r.data.startswith(b"Bad query:")
+    assert client.put("/posts/query?limit=x", data="a").status_code == 400
+    assert client.put("/posts/query", data="a").status_code == 200
+
+def test_query_sorts_and_pages(make_user):
+    import server
+    client = server.app.test_client()
+    user = make_user()
+    tag = Tag.create(name="sorted")
+    ps = [Post.new(None, f"sorted {i}", user.id) for i in range(3)]
+    for p, hot in zip(ps, [2.0, 3.0, 1.0]):
+        Post.update(hot=hot).where(Post.id == p.id).execute()
+        TagMap.create(post_id=p.id, tag_id=tag.id)
+
+    ids = lambda r: [p["id"] for p in r.json]
+    assert ids(client.put("/posts/query", data="sorted")) == [ps[2].id, ps[1].id, ps[0].id]
+    hot = client.put("/posts/query?sort=hot&limit=2", data="sorted")
+    assert ids(hot) == [ps[1].id, ps[0].id]
+    after = hot.headers["X-Next-Cursor"]
+    assert ids(client.put(f"/posts/query?sort=hot&after={after}", data="sorted")) == [ps[2].id]
+    assert ids(client.put("/posts/query?sort=hot&limit=2&pg=1", data="sorted")) == [ps[2].id]
+    assert client.put("/posts/query?sort=bogus", data="sorted").status_code == 400
+    assert client.put("/posts/query?sort=hot&after=2024-01-01T00:00:00_1", data="sorted").status_code == 400
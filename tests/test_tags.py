@@ -0,0 +1,36 @@
+import pytest
+
+from argot.models import *
+
+@pytest.fixture
+def client(make_user):
+    import server
+    client = server.app.test_client()
+    user = make_user("password")
+    client.post("/login", json={"nick": user.nick, "password": "password"})
+    return client
+
+@pytest.mark.parametrize("body", [
+    {"posts": "x", "tags": [1]},
+    {"posts": [1]},
+    {"tags": [1]},
+    {"posts": ["a"], "tags": [1]},
+    [1, 2],
+    None,
+])
+def test_bad_bulk_tag_body_is_a_400(client, body):
+    r = client.put("/posts/tags", json=body)
+    assert r.status_code == 400
+    assert r.data == b"Type check failed!"
+
+def test_non_json_body_is_a_400(client):
+    assert client.put("/posts/tags", data="posts=1").status_code == 400
+
+def test_bulk_tag(client, make_user):
+    post = Post.new(None, "Untagged", make_user().id)
+    tag = Tag.create(name="bulk")
+    r = client.put("/posts/tags", json={"posts": [post.id], "tags": [tag.id]})
+    assert r.status_code == 200
+    assert r.json == {"added": 1}
+    assert client.put("/posts/tags", json={"posts": [post.id], "tags": [tag.id]}).json == {"added": 0}
+    assert client.put("/posts/tags", json={"posts": [999999999], "tags": [tag.id]}).status_code == 404
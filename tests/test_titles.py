@@ -0,0 +1,102 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from argot import titles
+
+PAGES = {
+    "/page": ("text/html; charset=utf-8",
+              b"<html><head><title>\n  Hello,\n  world </title>"
+              b"<meta name='description' content='A page.'></head><body>hi</body></html>"),
+    "/og": ("text/html", b"<head><meta property='og:title' content='From og'></head>"),
+    "/no-title": ("text/html", b"<html><head><meta charset='utf-8'></head><body><h1>Hi</h1></body></html>"),
+    "/latin1": ("text/html; charset=iso-8859-1", "<title>Caf\xe9</title>".encode("latin-1")),
+    "/image.png": ("image/png", b"\x89PNG\r\n\x1a\n"),
+}
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/slow":
+            time.sleep(1)
+        if self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/page")
+            self.end_headers()
+            return
+        if self.path == "/trickle":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.end_headers()
+            try:
+                for _ in range(50):
+                    self.wfile.write(b"<!-- -->")
+                    self.wfile.flush()
+                    time.sleep(0.05)
+            except OSError:
+                pass
+            return
+        if self.path not in PAGES:
+            self.send_error(404)
+            return
+        kind, body = PAGES[self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture(scope="module")
+def site():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+def test_title(site):
+    assert titles.fetch(f"{site}/page") == {"title": "Hello, world", "description": "A page."}
+
+def test_og_title(site):
+    assert titles.fetch(f"{site}/og")["title"] == "From og"
+
+def test_charset(site):
+    assert titles.fetch(f"{site}/latin1")["title"] == "Caf\xe9"
+
+def test_redirect(site):
+    assert titles.fetch(f"{site}/moved")["title"] == "Hello, world"
+
+def test_no_title(site):
+    assert titles.fetch(f"{site}/no-title") == {"title": None, "description": None}
+
+def test_not_html(site):
+    with pytest.raises(ValueError, match="isn't HTML"):
+        titles.fetch(f"{site}/image.png")
+
+def test_bad_status(site):
+    with pytest.raises(ValueError, match="404"):
+        titles.fetch(f"{site}/missing")
+
+def test_read_timeout(site, monkeypatch):
+    monkeypatch.setattr(titles, "READ_TIMEOUT", 0.2)
+    with pytest.raises(TimeoutError):
+        titles.fetch(f"{site}/slow")
+
+def test_deadline(site, monkeypatch):
+    monkeypatch.setattr(titles, "DEADLINE", 0.3)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        titles.fetch(f"{site}/trickle")
+    assert time.monotonic() - start < 1
+
+def test_lookup_caches_failures(site, monkeypatch):
+    monkeypatch.setattr(titles, "cache", titles.Cache(16, 60))
+    url = f"{site}/image.png"
+    assert titles.lookup(url) == {"title": None, "description": None}
+    assert titles.cache.get(url) == {"title": None, "description": None}
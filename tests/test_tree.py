@@ -0,0 +1,25 @@
+import pytest
+
+from argot import tree
+from argot.models import *
+
+@pytest.fixture
+def client(database):
+    import server
+    return server.app.test_client()
+
+def test_limit_bounds(client, make_user):
+    user = make_user()
+    post = Post.new(None, "Thread", user.id)
+    top = Comment.new(post.id, user.id, "top")
+    for i in range(3):
+        Comment.new(post.id, user.id, str(i), parent=top.id)
+
+    for url in [f"/posts/{post.id}", f"/posts/{post.id}/comments", f"/comments/{top.id}/context"]:
+        for limit in [0, -1, tree.MAX_LIMIT + 1]:
+            assert client.get(f"{url}?limit={limit}").status_code == 400, (url, limit)
+        assert client.get(f"{url}?limit=1").status_code == 200
+
+    r = client.get(f"/posts/{post.id}/comments?parent={top.id}&limit=2")
+    assert len(r.json["comments"]) == 2
+    assert r.json["more"] == 1
@@ -1,3 +1,6 @@
+-- Baseline schema. Everything since lives in migrations/, so after loading
+-- this run `python -m argot.manage migrate`.
+
 CREATE TABLE users (
   id         SERIAL PRIMARY KEY,
   nick       TEXT NOT NULL,